@@ -66,7 +66,14 @@ import xml.etree.ElementTree as etree
 
 import gdal
 import numpy
-import scipy.ndimage
+
+#
+# Array kernels shared with the Linux scripts in 'thesis'.
+#
+import thesispath
+import kernels
+import bandstats
+import resample
 
 
 
@@ -334,6 +341,7 @@ def convert_imgFolders(options, imgFolders):
                 stacked_file = '{}calrefbyt_lndstlk.dat'.format(
                     os.path.basename(band)[:-7])
                 filepath = os.path.join(PROC_DATA, stacked_file)
+                stacked_path = filepath
 
                 #
                 # Print driver for stacked layers (6 bands, 8-bit unsigned).
@@ -375,16 +383,11 @@ def convert_imgFolders(options, imgFolders):
                 thermDs.SetProjection(projection)
 
                 #
-                # Create constant array with a value of 110.
-                #
-                therm_array = numpy.ones((img_rows, img_cols)).astype(int)
-                therm_array = therm_array * 110
-
-                #
-                # Write the data to the designated band.
+                # Fill the band with a constant value of 110, without
+                # creating an array for it.
                 #
                 outBand = thermDs.GetRasterBand(1)
-                outBand.WriteArray(therm_array, 0, 0)
+                outBand.Fill(kernels.THERMAL_VALUE)
 
                 #
                 # Flush data to disk and set the NoData value.
@@ -393,10 +396,13 @@ def convert_imgFolders(options, imgFolders):
                 # outBand.SetNoDataValue(-99)
 
                 #
-                # Calculate statistics.
+                # Set statistics of the constant band without reading it
+                # back, and export its histogram.
                 #
-                stats = outBand.ComputeStatistics(False)
-                outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+                stats = bandstats.BandStats().add_value(
+                    kernels.THERMAL_VALUE, img_rows * img_cols)
+                stats.apply(outBand)
+                bandstats.write_sidecar(filepath, [stats])
 
                 print 'Fake thermal band created.\n\n'
                 print 'Elapsed time: {}'.format(
@@ -407,7 +413,6 @@ def convert_imgFolders(options, imgFolders):
                 #
                 del driver
                 band_id = None
-                therm_array = None
                 outBand = None
                 stats = None
                 thermDs = None
@@ -416,6 +421,11 @@ def convert_imgFolders(options, imgFolders):
 
         print 'Creating 6 band stack for tile {}\n'.format(tile_id)
 
+        #
+        # Histograms of the stacked bands, accumulated as they are written.
+        #
+        out_stats = [bandstats.BandStats() for i in range(6)]
+
         for band in tile_bands:
 
             #
@@ -474,26 +484,10 @@ def convert_imgFolders(options, imgFolders):
                 # print 'Original min: {}'.format(numpy.amin(img_array))
 
                 #
-                # Adjust outliers (areas with very high reflectance and negative).
-                #
-                outData = img_array / 10000.0
-                outData = numpy.where((outData > 1), (1), outData)
-                outData = numpy.where((outData < 0), (0), outData)
-
-                #
-                # Old, slow method for reference.
-                #
-                # for i in range(0, img_rows):
-                #     for j in range(0, img_cols):
-                #         if outData[i,j] > 1:
-                #             outData[i,j] = 1
-                #         elif outData[i,j] < 0:
-                #             outData[i,j] = 0
-
-                #
-                # Possible adjustment for noData.
+                # Adjust outliers (areas with very high reflectance and
+                # negative) and convert to 8-bit with a lookup table.
                 #
-                #outData = numpy.where((img_array == 0), (-1), outData)
+                outData = kernels.to_byte(img_array)
                 img_array = None
 
                 #
@@ -503,15 +497,10 @@ def convert_imgFolders(options, imgFolders):
 
                     print 'Resample by a factor of 2 with nearest interpolation.'
 
-                    outData = scipy.ndimage.zoom(outData, 2, order=0)
+                    outData = resample.nearest2x(outData)
 
                     print 'Resampled size: {}'.format(outData.shape)
 
-                #
-                # Convert to 8-bit.
-                #
-                outData = ((numpy.absolute(outData) * 255.0) + 0.5).astype(int)
-
                 #
                 # Write the data to the designated band.
                 #
@@ -525,10 +514,11 @@ def convert_imgFolders(options, imgFolders):
                 # outBand.SetNoDataValue(-99)
 
                 #
-                # Calculate statistics.
+                # Set statistics from the written array, without reading the
+                # band back.
                 #
-                stats = outBand.ComputeStatistics(False)
-                outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+                stats = out_stats[band_in_stack - 1].update(outData)
+                stats.apply(outBand)
 
                 print 'Band #{} completed.\n'.format(band_id)
                 print 'Elapsed time: {}'.format(
@@ -545,6 +535,11 @@ def convert_imgFolders(options, imgFolders):
                 img = None
 
 
+        #
+        # Export the histograms of the stack for QA.
+        #
+        bandstats.write_sidecar(stacked_path, out_stats)
+
         print 'Tile {} processed and stacked.'.format(tile_id)
         print '------------------------------------------------------------\n\n\n'
 
@@ -65,12 +65,22 @@ import xml.etree.ElementTree as etree
 
 import gdal
 import numpy
-import scipy.ndimage
 
 #
-# Define S2 root folder, where all downloads are located.
+# Array kernels shared with the Linux scripts in 'thesis'.
+#
+import thesispath
+import kernels
+import bandstats
+import resample
+
+#
+# Define S2 root folder, where all downloads are located. It can be given as
+# the first argument, and '--auto' skips the popup, e.g. for the benchmark.
 #
 root_folder = 'C:\\tempS2'
+if len(sys.argv) > 1 and sys.argv[1] != '--auto':
+    root_folder = sys.argv[1]
 
 #
 # Create list for IMG_DATA folder paths.
@@ -82,17 +92,23 @@ for dirpath, dirnames, filenames in os.walk(root_folder, topdown=True):
         if dirname == 'IMG_DATA':
             imgFolders.append(os.path.join(dirpath, dirname))
 
-#
-# Hide the main window for the message popup.
-#
-Tkinter.Tk().withdraw()
+if '--auto' in sys.argv[1:]:
 
-#
-# Create the content of the popup window.
-#
-question = ('Number of tiles found: {}'
-    '\n\nDo you want to process all folders?').format(len(imgFolders))
-messagebox = tkMessageBox.askyesno('Sentinel for SIAM', question)
+    messagebox = True
+
+else:
+
+    #
+    # Hide the main window for the message popup.
+    #
+    Tkinter.Tk().withdraw()
+
+    #
+    # Create the content of the popup window.
+    #
+    question = ('Number of tiles found: {}'
+        '\n\nDo you want to process all folders?').format(len(imgFolders))
+    messagebox = tkMessageBox.askyesno('Sentinel for SIAM', question)
 
 if not messagebox:
     print 'No folders processed.'
@@ -245,6 +261,7 @@ for imgFolder in imgFolders:
             stacked_file = '{}calrefbyt_lndstlk.dat'.format(
                 os.path.basename(band)[:-7])
             filepath = os.path.join(PROC_DATA, stacked_file)
+            stacked_path = filepath
 
             #
             # Print driver for stacked layers (6 bands, 8-bit unsigned).
@@ -286,16 +303,11 @@ for imgFolder in imgFolders:
             thermDs.SetProjection(projection)
 
             #
-            # Create constant array with a value of 110.
-            #
-            therm_array = numpy.ones((img_rows, img_cols)).astype(int)
-            therm_array = therm_array * 110
-
-            #
-            # Write the data to the designated band.
+            # Fill the band with a constant value of 110, without creating an
+            # array for it.
             #
             outBand = thermDs.GetRasterBand(1)
-            outBand.WriteArray(therm_array, 0, 0)
+            outBand.Fill(kernels.THERMAL_VALUE)
 
             #
             # Flush data to disk and set the NoData value.
@@ -304,10 +316,13 @@ for imgFolder in imgFolders:
             # outBand.SetNoDataValue(-99)
 
             #
-            # Calculate statistics.
+            # Set statistics of the constant band without reading it back,
+            # and export its histogram.
             #
-            stats = outBand.ComputeStatistics(outBand)
-            outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+            stats = bandstats.BandStats().add_value(
+                kernels.THERMAL_VALUE, img_rows * img_cols)
+            stats.apply(outBand)
+            bandstats.write_sidecar(filepath, [stats])
 
             print 'Fake thermal band created.\n\n'
             print 'Elapsed time: {}'.format(
@@ -318,7 +333,6 @@ for imgFolder in imgFolders:
             #
             del band_id
             del driver
-            del therm_array
             del outBand
             del stats
             thermDs = None
@@ -327,6 +341,11 @@ for imgFolder in imgFolders:
 
     print 'Creating 6 band stack for tile {}\n'.format(tile_id)
 
+    #
+    # Histograms of the stacked bands, accumulated as they are written.
+    #
+    out_stats = [bandstats.BandStats() for i in range(6)]
+
     for band in tile_bands:
 
         #
@@ -380,26 +399,20 @@ for imgFolder in imgFolders:
             # print 'Original min: {}'.format(numpy.amin(img_array))
 
             #
-            # Adjust outliers (areas with very high reflectance and negative).
+            # Adjust outliers (areas with very high reflectance and negative)
+            # and convert to 8-bit with a lookup table.
             #
-            outData = img_array / 10000.0
+            outData = kernels.to_byte(img_array)
             del img_array
-            outData = numpy.where((outData > 1), (1), outData)
-            outData = numpy.where((outData < 0), (0), outData)
 
             #
             # Resample bands 11 and 12 from 20m to 10m resolution.
             #
             if band.endswith(('_B11_20m.jp2','_B12_20m.jp2')):
                 print 'Resample by a factor of 2 with nearest interpolation.'
-                outData = scipy.ndimage.zoom(outData, 2, order=0)
+                outData = resample.nearest2x(outData)
                 print 'Resampled size: {}'.format(outData.shape)
 
-            #
-            # Convert to 8-bit.
-            #
-            outData = ((numpy.absolute(outData) * 255.0) + 0.5).astype(int)
-
             #
             # Write the data to the designated band.
             #
@@ -413,10 +426,11 @@ for imgFolder in imgFolders:
             # outBand.SetNoDataValue(-99)
 
             #
-            # Calculate statistics.
+            # Set statistics from the written array, without reading the band
+            # back.
             #
-            stats = outBand.ComputeStatistics(outBand)
-            outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+            stats = out_stats[band_in_stack - 1].update(outData)
+            stats.apply(outBand)
 
             print 'Band #{} completed.\n'.format(band_id)
             print 'Elapsed time: {}'.format(
@@ -427,13 +441,17 @@ for imgFolder in imgFolders:
             #
             del img_band
             del band_id
-            del img_array
             del outData
             del outBand
             del stats
             img = None
 
 
+    #
+    # Export the histograms of the stack for QA.
+    #
+    bandstats.write_sidecar(stacked_path, out_stats)
+
     print 'Tile {} processed and stacked.'.format(tile_id)
     print '------------------------------------------------------------\n\n\n'
 
@@ -61,8 +61,14 @@ import xml.etree.ElementTree as etree
 
 import gdal
 import numpy
-import scipy.ndimage
-from PIL import Image
+
+#
+# Array kernels shared with the Linux scripts in 'thesis'.
+#
+import thesispath
+import kernels
+import bandstats
+import resample
 
 ###############################################################################
 
@@ -144,7 +150,7 @@ def nodata_array(tile_bands, PROC_DATA):
             #
             # Nearest neighbor interpolation.
             #
-            band_array = scipy.ndimage.zoom(band_array, 2, order=0)
+            band_array = resample.nearest2x(band_array)
 
         #
         # Adjust output layer to 0 where there is nodata.
@@ -168,10 +174,12 @@ def nodata_array(tile_bands, PROC_DATA):
     outBand.FlushCache()
 
     #
-    # Calculate statistics.
+    # Set statistics from the written array, without reading the band back,
+    # and export its histogram.
     #
-    stats = outBand.ComputeStatistics(False)
-    outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+    stats = bandstats.BandStats().update(noData_array)
+    stats.apply(outBand)
+    bandstats.write_sidecar(filepath, [stats])
 
     del gdal_format
     del outDs
@@ -491,6 +499,7 @@ def convert_imgs(root_folder, imgFolders):
                 stacked_file = '{}calrefbyt_lndstlk.dat'.format(
                     os.path.basename(band)[:-7])
                 filepath = os.path.join(PROC_DATA, stacked_file)
+                stacked_path = filepath
 
                 #
                 # Print driver for stacked layers (6 bands, 8-bit unsigned).
@@ -532,16 +541,10 @@ def convert_imgs(root_folder, imgFolders):
                 thermDs.SetProjection(projection)
 
                 #
-                # Create constant array with a value of 110.
+                # Create constant 8-bit array with a value of 110, removing
+                # pixels having no data in any of the input bands.
                 #
-                therm_array = numpy.ones((img_rows, img_cols)).astype(int)
-                therm_array = therm_array * 110
-
-                #
-                # Remove pixels having no data in any of the input bands.
-                #
-                therm_array = numpy.where(
-                    (noData_array == 1), (0), therm_array)
+                therm_array = kernels.fake_thermal(noData_array)
 
                 #
                 # Write the data to the designated band.
@@ -556,10 +559,12 @@ def convert_imgs(root_folder, imgFolders):
                 # outBand.SetNoDataValue(-99)
 
                 #
-                # Calculate statistics.
+                # Set statistics from the written array, without reading the
+                # band back, and export its histogram.
                 #
-                stats = outBand.ComputeStatistics(False)
-                outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+                stats = bandstats.BandStats().update(therm_array)
+                stats.apply(outBand)
+                bandstats.write_sidecar(filepath, [stats])
 
                 print ('Fake thermal band created.\n\n')
                 print ('Elapsed time: {}'.format(
@@ -578,6 +583,11 @@ def convert_imgs(root_folder, imgFolders):
 
         print ('Creating 6 band stack for tile {}\n'.format(tile_id))
 
+        #
+        # Histograms of the stacked bands, accumulated as they are written.
+        #
+        out_stats = [bandstats.BandStats() for i in range(6)]
+
         for band in tile_bands:
 
             #
@@ -634,30 +644,17 @@ def convert_imgs(root_folder, imgFolders):
                 # print 'Original max: {}'.format(numpy.amax(img_array))
                 # print 'Original min: {}'.format(numpy.amin(img_array))
 
-                #
-                # Adjust outliers (very high reflectance and negative).
-                #
-                outData = img_array / 10000.0
-                outData = numpy.where((outData > 1), (1), outData)
-                outData = numpy.where((outData < 0), (0), outData)
-
-                #
-                # Old, slow method for reference.
-                #
-                # for i in range(0, img_rows):
-                #     for j in range(0, img_cols):
-                #         if outData[i,j] > 1:
-                #             outData[i,j] = 1
-                #         elif outData[i,j] < 0:
-                #             outData[i,j] = 0
-
-                img_array = None
-
                 #
                 # Resample bands 11 and 12 from 20m to 10m resolution.
                 #
                 if band.endswith(('_B11.jp2', '_B12.jp2')):
 
+                    #
+                    # Adjust outliers (very high reflectance and negative).
+                    #
+                    outData = kernels.reflectance(img_array)
+                    img_array = None
+
                     print ('Resample by a factor of 2 - bilinear interpolation.')
 
                     # Reference:
@@ -670,34 +667,34 @@ def convert_imgs(root_folder, imgFolders):
                         datetime.datetime.now() - start_time))
 
                     #
-                    # Calculate bilinear interpolation (2x2) using pillow
-                    # (comparable to ArcGIS output)
+                    # Calculate bilinear interpolation (2x2) with NumPy, same
+                    # weights as pillow's BILINEAR resize (comparable to
+                    # ArcGIS output)
                     #
-                    im = Image.fromarray(outData)
-                    img_cols_2 = int(img_cols)*2
-                    img_rows_2 = int(img_rows)*2
-                    im = im.resize((img_cols_2, img_rows_2), resample=Image.BILINEAR)
-                    outData = numpy.array(im)
-
-                    #
-                    # Close and clean up.
-                    #
-                    im.close()
-                    del im
+                    outData = resample.bilinear2x(outData)
 
                     print ('end resample: {}'.format(
                         datetime.datetime.now() - start_time))
                     print ('Resampled size: {}'.format(outData.shape))
 
-                #
-                # Convert to 8-bit.
-                #
-                outData = ((numpy.absolute(outData) * 255.0) + 0.5).astype(int)
+                    #
+                    # Convert the interpolated reflectance to 8-bit.
+                    #
+                    outData = kernels.reflectance_to_byte(outData)
+
+                else:
+
+                    #
+                    # Adjust outliers (very high reflectance and negative) and
+                    # convert to 8-bit with a lookup table.
+                    #
+                    outData = kernels.to_byte(img_array)
+                    img_array = None
 
                 #
                 # Remove pixels having no data in any of the input bands.
                 #
-                outData = numpy.where((noData_array == 1), (0), outData)
+                kernels.mask_nodata(outData, noData_array)
 
                 #
                 # Write the data to the designated band.
@@ -712,10 +709,11 @@ def convert_imgs(root_folder, imgFolders):
                 # outBand.SetNoDataValue(-99)
 
                 #
-                # Calculate statistics.
+                # Set statistics from the written array, without reading the
+                # band back.
                 #
-                stats = outBand.ComputeStatistics(False)
-                outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+                stats = out_stats[band_in_stack - 1].update(outData)
+                stats.apply(outBand)
 
                 print ('Band #{} completed.\n'.format(band_id))
                 print ('Elapsed time: {}'.format(
@@ -731,6 +729,11 @@ def convert_imgs(root_folder, imgFolders):
                 stats = None
                 img = None
 
+        #
+        # Export the histograms of the stack for QA.
+        #
+        bandstats.write_sidecar(stacked_path, out_stats)
+
         i += 1
 
         message = (
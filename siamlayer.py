@@ -15,26 +15,39 @@
 import os
 import sys
 import fnmatch
+import argparse
 import datetime
 import Tkinter
 import tkMessageBox
 
 import gdal
 import numpy
-import scipy.ndimage
 
+#
+# Resampling kernels, the data inventory, metrics and profiling shared with
+# the Linux scripts in 'thesis'.
+#
+import thesispath
+import resample
+import inventory
+import metrics
+import profiling
+
+#
+# Data root holding the inventory of all products (see inventory.py).
+#
+DATA_ROOT = 'C:\\tempS2'
 
-def siam_folders(root_folder):
 
-    '''This function creates a list of siamoutput folder paths.'''
+def siam_folders(root_folder, data_root=DATA_ROOT):
 
-    siamFolders = []
+    '''This function creates a list of siamoutput folder paths.'''
 
-    for dirpath, dirnames, filenames in os.walk(root_folder, topdown=True):
-        for dirname in dirnames:
-            if (dirname == 'siamoutput'
-                    and fnmatch.fnmatch(dirpath, '*PROC_DATA*')):
-                siamFolders.append(os.path.join(dirpath, dirname))
+    siamFolders = [
+        folder for folder in
+        inventory.open_inventory(data_root, under=root_folder).folders(
+            'siamoutput', under=root_folder)
+        if fnmatch.fnmatch(os.path.dirname(folder), '*PROC_DATA*')]
 
     return siamFolders
 
@@ -46,6 +59,11 @@ def siam_layer(siam_folders, stack_type, layer_endings, start_time):
 
     for folder in siam_folders:
 
+        stage = metrics.Stage(
+            'layer', folder=folder, stack_type=stack_type).start()
+        folder_profile = profiling.profile(
+            'layer_{}_'.format(stack_type) + folder).start()
+
         #
         # Create new list of desired layers depending on stack type.
         #
@@ -123,6 +141,8 @@ def siam_layer(siam_folders, stack_type, layer_endings, start_time):
         del outDs
         img = None
 
+        folder_profile.stop()
+        stage.finish()
         time_elapsed(start_time)
         print '\nFinished layer: {}'.format(layer_name)
         print '--------------------------------'
@@ -278,6 +298,20 @@ def remove_nodata(folder, outData):
         original Sentinel-2 bands used to create the .dat SIAM input file.
         These correspond to S2 bands 2, 3, 4, 8, 11 and 12.'''
 
+    #
+    # Use the nodata mask written during conversion if there is one, instead
+    # of decoding all of the bands again.
+    #
+    proc_folder = os.path.dirname(folder)
+
+    for fn in os.listdir(proc_folder):
+        if fn.endswith(('nodata.dat', 'nodata.tif')):
+            print 'Using noData mask {}'.format(fn)
+            noData_array = open_as_array(os.path.join(proc_folder, fn))
+            outData = numpy.where((noData_array == 1), (0), outData)
+            noData_array = None
+            return outData
+
     #
     # Access original image folder.
     #
@@ -370,7 +404,7 @@ def remove_nodata(folder, outData):
         # Resample bands 11 and 12 from 20m to 10m resolution.
         #
         if band.endswith(('_B11.jp2','_B12.jp2')):
-            band_array = scipy.ndimage.zoom(band_array, 2, order=0)
+            band_array = resample.nearest2x(band_array)
 
         #
         # Ddjust output layer to 0 where there is nodata.
@@ -437,6 +471,18 @@ if __name__ == "__main__":
     # Register all of the GDAL drivers
     #
     gdal.AllRegister()
+    metrics.configure('log/metrics.jsonl', 'log/siamlayer.prom', 'siamlayer')
+
+    #
+    # Optional profiling of each layer.
+    #
+    parser = argparse.ArgumentParser(description='SIAM layer creator.')
+    parser.add_argument(
+        '--profile', dest='profile', action='store', type=str,
+        help=('Directory to save cProfile stats, sampled stacks and '
+              'tracemalloc reports of each layer to. Default: none.'),
+        default=None)
+    profiling.configure(parser.parse_args().profile)
 
     #
     # Get siam output folders from the defined root folder.
@@ -0,0 +1,173 @@
+# ------------------------------------------------------------------------------
+# Name:        Area of interest of a conversion.
+# Purpose:     Map an area of interest, given as a lon/lat bounding box or a
+#              GeoJSON file, to the pixel window of a tile, so only that
+#              window is read from the bands and written to the outputs. The
+#              window is the bounding box of the area in the projection of
+#              the tile (from the B02 geotransform), on the 10m grid; the
+#              matching 20m windows of bands 11 and 12 follow from it.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import json
+import math
+
+import osr
+
+#
+# Points per edge of a bounding box when it is projected, as its edges are
+# not straight lines in the projection of the tile.
+#
+EDGE_POINTS = 16
+
+
+class AOIError(Exception):
+    pass
+
+
+def _coordinates(geojson):
+
+    '''
+    Returns all (lon, lat) positions of a GeoJSON geometry, feature or
+    feature collection.
+    '''
+
+    if geojson.get('type') == 'FeatureCollection':
+        return [p for feature in geojson['features']
+                for p in _coordinates(feature)]
+    if geojson.get('type') == 'Feature':
+        return _coordinates(geojson['geometry'])
+    if geojson.get('type') == 'GeometryCollection':
+        return [p for geometry in geojson['geometries']
+                for p in _coordinates(geometry)]
+
+    points = []
+    todo = [geojson['coordinates']]
+    while todo:
+        value = todo.pop()
+        if isinstance(value[0], (int, float)):
+            points.append((float(value[0]), float(value[1])))
+        else:
+            todo.extend(value)
+
+    return points
+
+
+def _bbox_outline(west, south, east, north):
+
+    '''
+    Returns points along the outline of a lon/lat bounding box.
+    '''
+
+    points = []
+    for i in range(EDGE_POINTS + 1):
+        f = float(i) / EDGE_POINTS
+        lon = west + f * (east - west)
+        lat = south + f * (north - south)
+        points.extend([(lon, south), (lon, north), (west, lat), (east, lat)])
+
+    return points
+
+
+def parse_aoi(value):
+
+    '''
+    Returns the (lon, lat) points of an area of interest given on the command
+    line: 'west,south,east,north' in degrees or the path of a GeoJSON file.
+    Raises AOIError if it is neither.
+    '''
+
+    if os.path.isfile(value):
+        try:
+            with open(value) as f:
+                points = _coordinates(json.load(f))
+        except (IOError, ValueError, KeyError, IndexError, TypeError) as e:
+            raise AOIError('Could not read the AOI from {}: {}'.format(
+                value, e))
+        if not points:
+            raise AOIError('No coordinates in {}.'.format(value))
+        return points
+
+    try:
+        west, south, east, north = [float(v) for v in value.split(',')]
+    except ValueError:
+        raise AOIError(
+            'AOI must be west,south,east,north or a GeoJSON file: '
+            '{}'.format(value))
+    if west >= east or south >= north:
+        raise AOIError('Empty AOI bounding box: {}'.format(value))
+
+    return _bbox_outline(west, south, east, north)
+
+
+def _to_projection(points, projection):
+
+    '''
+    Projects lon/lat points to the coordinate system of a tile (WKT).
+    '''
+
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    tile_srs = osr.SpatialReference()
+    tile_srs.ImportFromWkt(projection)
+
+    #
+    # GDAL 3 uses the lat/lon axis order of EPSG:4326 unless told otherwise.
+    #
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        tile_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    transformation = osr.CoordinateTransformation(wgs84, tile_srs)
+
+    return [transformation.TransformPoint(lon, lat)[:2]
+            for lon, lat in points]
+
+
+def pixel_window(points, transform, projection, img_cols, img_rows):
+
+    '''
+    Returns the window (xoff, yoff, xsize, ysize) of a tile covering the area
+    of interest, clipped to the tile, or None if they do not overlap. The
+    tile is given by the geotransform, projection and size of its B02 band.
+    '''
+
+    projected = _to_projection(points, projection)
+    xs = [p[0] for p in projected]
+    ys = [p[1] for p in projected]
+
+    #
+    # Sentinel-2 geotransforms are north up, with a negative pixel height.
+    #
+    x0 = (min(xs) - transform[0]) / transform[1]
+    x1 = (max(xs) - transform[0]) / transform[1]
+    y0 = (max(ys) - transform[3]) / transform[5]
+    y1 = (min(ys) - transform[3]) / transform[5]
+
+    xoff = max(int(math.floor(min(x0, x1))), 0)
+    yoff = max(int(math.floor(min(y0, y1))), 0)
+    xend = min(int(math.ceil(max(x0, x1))), img_cols)
+    yend = min(int(math.ceil(max(y0, y1))), img_rows)
+
+    if xend <= xoff or yend <= yoff:
+        return None
+
+    return xoff, yoff, xend - xoff, yend - yoff
+
+
+def window_transform(transform, window):
+
+    '''
+    Returns the geotransform of a window of a raster.
+    '''
+
+    xoff, yoff = window[:2]
+
+    return (transform[0] + xoff * transform[1] + yoff * transform[2],
+            transform[1], transform[2],
+            transform[3] + xoff * transform[4] + yoff * transform[5],
+            transform[4], transform[5])
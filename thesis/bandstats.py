@@ -0,0 +1,137 @@
+# ------------------------------------------------------------------------------
+# Name:        Band statistics for 8-bit outputs.
+# Purpose:     Accumulate a 256-bin histogram of an 8-bit band while its
+#              blocks are written, so min/max/mean/std and the default
+#              histogram can be set on the band without GDAL reading it back
+#              with ComputeStatistics. The histograms are also exported to a
+#              JSON file next to the output for QA.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import json
+
+import numpy
+
+#
+# One bin per 8-bit value, centred on the value as GDAL does for Byte bands.
+#
+BUCKETS = 256
+HIST_MIN = -0.5
+HIST_MAX = 255.5
+
+#
+# Pixels counted per bincount call, which works on a platform int copy.
+#
+CHUNK_PIXELS = 1 << 20
+
+
+class BandStats(object):
+
+    '''
+    Histogram of the values written to one 8-bit band, updated block by
+    block, from which the band statistics are derived.
+    '''
+
+    def __init__(self):
+        self.histogram = numpy.zeros(BUCKETS, dtype=numpy.int64)
+
+    def update(self, block):
+
+        '''
+        Adds the values of a block (any shape, uint8) to the histogram.
+        '''
+
+        flat = block.reshape(-1)
+        for start in range(0, flat.size, CHUNK_PIXELS):
+            self.histogram += numpy.bincount(
+                flat[start:start + CHUNK_PIXELS], minlength=BUCKETS)
+
+        return self
+
+    def add_value(self, value, count):
+
+        '''
+        Adds 'count' pixels of a single value, e.g. for a band filled with a
+        constant.
+        '''
+
+        self.histogram[value] += count
+
+        return self
+
+    def statistics(self):
+
+        '''
+        Returns min, max, mean and standard deviation of all values added, in
+        the order of ComputeStatistics. All are 0 if nothing was added.
+        '''
+
+        count = self.histogram.sum()
+        if count == 0:
+            return 0.0, 0.0, 0.0, 0.0
+
+        values = numpy.arange(BUCKETS, dtype=numpy.float64)
+        present = numpy.flatnonzero(self.histogram)
+        mean = numpy.dot(values, self.histogram) / float(count)
+        variance = numpy.dot(self.histogram, (values - mean) ** 2) / count
+
+        return (float(present[0]), float(present[-1]), float(mean),
+                float(numpy.sqrt(variance)))
+
+    def apply(self, outBand):
+
+        '''
+        Sets the statistics and the default histogram on a GDAL band.
+        '''
+
+        stats = self.statistics()
+        outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+        outBand.SetDefaultHistogram(
+            HIST_MIN, HIST_MAX, [int(c) for c in self.histogram])
+
+    def as_dict(self):
+
+        '''
+        Returns the statistics and histogram in a JSON serialisable dict.
+        '''
+
+        stats = self.statistics()
+
+        return {'min': stats[0], 'max': stats[1], 'mean': stats[2],
+                'std': stats[3], 'hist_min': HIST_MIN, 'hist_max': HIST_MAX,
+                'histogram': [int(c) for c in self.histogram]}
+
+
+def sidecar_path(filepath):
+
+    '''
+    Returns the path of the JSON statistics file for an output file, i.e.
+    '*nodata.dat' -> '*nodata_stats.json'.
+    '''
+
+    return '{}_stats.json'.format(os.path.splitext(filepath)[0])
+
+
+def write_sidecar(filepath, band_stats):
+
+    '''
+    Writes the statistics of the bands of an output file (list of BandStats,
+    in band order) to its JSON sidecar and returns the sidecar path.
+    '''
+
+    bands = []
+    for band_in_stack, stats in enumerate(band_stats, 1):
+        band = stats.as_dict()
+        band['band'] = band_in_stack
+        bands.append(band)
+
+    json_path = sidecar_path(filepath)
+    with open(json_path, 'w') as f:
+        json.dump({'file': os.path.basename(filepath), 'bands': bands}, f,
+                  indent=1, sort_keys=True)
+
+    return json_path
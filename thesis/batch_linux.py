@@ -24,6 +24,10 @@ from time import strftime as date
 
 import gdal
 
+import inventory
+import metrics
+import profiling
+
 # Set GDAL environment variable for translating grib to tiff.
 # os.environ['GDAL_DATA'] = r'C:\Program Files\GDAL\gdal-data'
 
@@ -151,27 +155,25 @@ def get_args():
             help=('Calculate shape indicators. Default 0.'),
             choices=['1', '0'],
             default=1)
+        parser.add_argument(
+            '--profile', dest='profile', action='store', type=str,
+            help=('Directory to save cProfile stats, sampled stacks and '
+                  'tracemalloc reports of each batch file to. Default: none.'),
+            default=None)
 
         return parser.parse_args()
 
 
 def check_procFolders(options):
 
-    procFolders = []
-    siamFolders = []
-
-    for dirpath, dirnames, filenames in os.walk(
-            options.read_dir, topdown=True):
-
-        for dirname in dirnames:
-
-            if dirname == 'PROC_DATA':
-
-                procFolders.append(os.path.join(dirpath, dirname))
-
-            elif dirname == 'siamoutput':
+    #
+    # PROC_DATA and siamoutput folders from the inventory of the read
+    # directory.
+    #
+    inv = inventory.open_inventory(options.read_dir)
+    procFolders = inv.folders('PROC_DATA')
+    siamFolders = inv.folders('siamoutput')
 
-                siamFolders.append(os.path.join(dirpath, dirname))
     #
     # Determine which tile folders have no siamoutput folder.
     #
@@ -443,17 +445,21 @@ if __name__ == '__main__':
         format='%(asctime)s:%(levelname)s:%(message)s',
         level=logging.DEBUG)
     logger = logging.getLogger('batch')
+    metrics.configure('log/metrics.jsonl', 'log/batch.prom', 'batch')
 
     #
     # Parse command line to get global arguments.
     #
     options = get_args()
+    profiling.configure(options.profile)
 
     bool_answer, unprocFolders = check_procFolders(options)
 
     if bool_answer:
 
-        create_batch(options, unprocFolders)
+        with metrics.stage('batch', tiles=len(unprocFolders)), \
+                profiling.profile('batch'):
+            create_batch(options, unprocFolders)
 
     else:
 
@@ -0,0 +1,502 @@
+# ------------------------------------------------------------------------------
+# Name:        Benchmark of the conversion scripts.
+# Purpose:     Run each conversion variant (conversion.py, conversion2.py,
+#              conversion3_python3_windows.py, nodata_linux.py and
+#              conversion_linux.py, plus any engine given on the command line)
+#              on synthetic tiles of several sizes (see synthsafe.py), each in
+#              its own process on its own copy of the products, and report
+#              tiles per hour, MB/s of band pixels decoded, peak RSS and
+#              whether the outputs are byte for byte those of the reference
+#              engine.
+#              Results are appended to a JSON lines file. With
+#              '--save_baseline' they become the baseline, and later runs
+#              flag engines that got slower or use more memory than the
+#              baseline allows (exit status 1), e.g. after a change to the
+#              kernels.
+#              Peak RSS comes from wait4, so it is missing on Windows.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import shutil
+import socket
+import hashlib
+import argparse
+import datetime
+import subprocess
+
+import synthsafe
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#
+# Products each engine reads: conversion.py only knows psd-12 metadata and
+# conversion2.py Level-2A products.
+#
+PRODUCTS = {
+    'l1c': {'layout': 'new', 'psd': 14},
+    'l1c_psd12': {'layout': 'old', 'psd': 12},
+    'l2a': {'level': 'L2A'},
+}
+
+#
+# Engines: command (with {python2}, {python3}, {repo} and {read_dir}), text
+# answering its prompt, its products and whether it needs the PROC_DATA
+# folders of converted tiles (nodata_linux.py only adds the nodata mask to
+# them). The first one is the reference the outputs are compared to.
+#
+ENGINES = (
+    ('conversion_linux',
+     ('{python2} {repo}/thesis/conversion_linux.py -r {read_dir} --auto y',
+      None, 'l1c', False)),
+    ('nodata_linux',
+     ('{python2} {repo}/thesis/nodata_linux.py -r {read_dir} --auto y',
+      None, 'l1c', True)),
+    ('conversion',
+     ('{python2} {repo}/conversion.py -r {read_dir}', 'y\n', 'l1c_psd12',
+      False)),
+    ('conversion2',
+     ('{python2} {repo}/conversion2.py {read_dir} --auto', None, 'l2a',
+      False)),
+    ('conversion3',
+     ('{python3} {repo}/conversion3_python3_windows.py {read_dir}', None,
+      'l1c', False)),
+)
+
+#
+# Tiles of the study area, used in turn for the synthetic products.
+#
+TILES = ('37SBA', '37SCA', '37SDA', '37SBU', '37SBV')
+
+#
+# Outputs compared between engines, by the end of their file names.
+#
+OUTPUTS = ('calrefbyt_lndstlk.dat', 'caltembyt_lndstlk.dat', 'nodata.dat')
+
+RESULTS_FILE = 'log/benchmark.jsonl'
+BASELINE_FILE = 'log/benchmark_baseline.json'
+
+#
+# Fraction by which an engine may be slower, or use more memory, than its
+# baseline before it is flagged.
+#
+TOLERANCE = 0.10
+
+
+def decoded_bytes(size):
+
+    '''
+    Bytes of band pixels decoded for the stack of one tile of size 10m
+    pixels: bands 2, 3, 4 and 8 at 10m and 11 and 12 at 20m, uint16.
+    '''
+
+    return 2 * (4 * size ** 2 + 2 * (size // 2) ** 2)
+
+
+def make_products(work_dir, kind, size, tiles, nodata, cloud, seed):
+
+    '''
+    Returns a folder of synthetic products for the benchmark, generating it
+    the first time. The folders are kept, as generating large tiles takes
+    longer than converting them.
+    '''
+
+    folder = os.path.join(work_dir, 'products', '{}_{}_{}_{}_{}_{}'.format(
+        kind, size, tiles, nodata, cloud, seed))
+    if os.path.isdir(folder):
+        return folder
+
+    temp_folder = folder + '.tmp'
+    if os.path.exists(temp_folder):
+        shutil.rmtree(temp_folder)
+    os.makedirs(temp_folder)
+
+    first = datetime.datetime(
+        2016 if PRODUCTS[kind].get('layout') == 'old' else 2017, 1, 1, 8, 23,
+        32)
+    for i in range(tiles):
+        sensing = first + datetime.timedelta(days=10 * (i // len(TILES)))
+        synthsafe.make_product(
+            temp_folder, tile=TILES[i % len(TILES)], sensing=sensing,
+            size=size, nodata=nodata, cloud=cloud, seed=seed + i,
+            **PRODUCTS[kind])
+    os.rename(temp_folder, folder)
+
+    return folder
+
+
+def run_engine(command, answer, values, cwd, log_path):
+
+    '''
+    Runs an engine and returns its exit status, wall time in seconds and
+    peak RSS in bytes (None where wait4 is missing). Its output goes to
+    log_path.
+    '''
+
+    args = [token.format(**values) for token in shlex.split(command)]
+
+    with open(log_path, 'w') as log:
+        start = time.time()
+        process = subprocess.Popen(
+            args, cwd=cwd, stdout=log, stderr=subprocess.STDOUT,
+            stdin=subprocess.PIPE)
+        if answer is not None:
+            process.stdin.write(answer.encode('ascii'))
+        process.stdin.close()
+
+        if hasattr(os, 'wait4'):
+            pid, status, usage = os.wait4(process.pid, 0)
+            wall = time.time() - start
+            returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                          else -os.WTERMSIG(status))
+            process.returncode = returncode
+            #
+            # ru_maxrss is in KB on Linux and in bytes on macOS.
+            #
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin'
+                                          else 1024)
+        else:
+            returncode = process.wait()
+            wall = time.time() - start
+            peak_rss = None
+
+    return returncode, wall, peak_rss
+
+
+def _file_hash(path):
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def output_hashes(read_dir):
+
+    '''
+    Returns the SHA1 of each output, by tile ('37SBA_0' for the first
+    product of tile 37SBA) and output, so the outputs of the old and new
+    product layouts can be compared.
+    '''
+
+    folders = []
+    for dirpath, dirnames, filenames in os.walk(read_dir):
+        if os.path.basename(dirpath) == 'PROC_DATA':
+            folders.append(dirpath)
+
+    hashes = {}
+    seen = {}
+    for folder in sorted(folders):
+        match = re.search(r'_T(\d\d[A-Z]{3})_',
+                          os.path.basename(os.path.dirname(folder)))
+        if match is None:
+            continue
+        tile = match.group(1)
+        key = '{}_{}'.format(tile, seen.get(tile, 0))
+        seen[tile] = seen.get(tile, 0) + 1
+        for filename in os.listdir(folder):
+            for output in OUTPUTS:
+                if filename.endswith(output):
+                    hashes[(key, output)] = _file_hash(
+                        os.path.join(folder, filename))
+
+    return hashes
+
+
+def compare_outputs(hashes, reference):
+
+    '''
+    Returns 'same' if the outputs an engine shares with the reference are
+    identical, 'differs: <outputs>' if not, or None if it shares none.
+    '''
+
+    common = [key for key in hashes if key in reference]
+    if not common:
+        return None
+
+    differing = sorted(set(output for key, output in common
+                           if hashes[(key, output)] !=
+                           reference[(key, output)]))
+    if not differing:
+        return 'same'
+
+    return 'differs: {}'.format(', '.join(differing))
+
+
+def check_baseline(result, baseline, tolerance):
+
+    '''
+    Returns the regressions of a result against its baseline.
+    '''
+
+    previous = baseline.get('{}/{}'.format(result['engine'], result['size']))
+    if previous is None:
+        return []
+    if result['status'] != 'ok':
+        return ['failed']
+
+    regressions = []
+    if result['tiles_per_hour'] < previous['tiles_per_hour'] * (1 - tolerance):
+        regressions.append('slower: {:.0f} tiles/h, baseline {:.0f}'.format(
+            result['tiles_per_hour'], previous['tiles_per_hour']))
+    if (result['peak_rss_mb'] is not None
+            and previous.get('peak_rss_mb') is not None
+            and result['peak_rss_mb'] >
+            previous['peak_rss_mb'] * (1 + tolerance)):
+        regressions.append('memory: {:.0f} MB, baseline {:.0f}'.format(
+            result['peak_rss_mb'], previous['peak_rss_mb']))
+
+    return regressions
+
+
+def benchmark(name, command, answer, kind, proc_data, size, options,
+              reference):
+
+    '''
+    Runs one engine on one tile size and returns its result.
+    '''
+
+    products = make_products(options.work_dir, kind, size, options.tiles,
+                             options.nodata, options.cloud, options.seed)
+
+    #
+    # Each run converts its own copy, next to its own 'log' folder for the
+    # scripts that log to 'log/converter.log'.
+    #
+    run_dir = os.path.join(options.work_dir, 'run', '{}_{}'.format(name,
+                                                                    size))
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    read_dir = os.path.abspath(os.path.join(run_dir, 'data'))
+    shutil.copytree(products, read_dir)
+    os.makedirs(os.path.join(run_dir, 'log'))
+    if proc_data:
+        for dirpath, dirnames, filenames in os.walk(read_dir):
+            if 'IMG_DATA' in dirnames:
+                os.mkdir(os.path.join(dirpath, 'PROC_DATA'))
+
+    log_path = os.path.join(options.work_dir, '{}_{}.log'.format(name, size))
+    values = {'python2': options.python2, 'python3': options.python3,
+              'repo': REPO_DIR, 'read_dir': read_dir}
+    try:
+        returncode, wall, peak_rss = run_engine(command, answer, values,
+                                                run_dir, log_path)
+    except OSError as e:
+        returncode, wall, peak_rss = str(e), None, None
+    hashes = output_hashes(read_dir)
+
+    if not options.keep:
+        shutil.rmtree(run_dir)
+
+    tiles_done = len(set(key for key, output in hashes))
+    if returncode != 0:
+        status = 'exit {}'.format(returncode)
+    elif tiles_done < options.tiles:
+        status = 'no outputs for {} tiles'.format(options.tiles - tiles_done)
+    else:
+        status = 'ok'
+
+    ok = status == 'ok'
+    return {
+        'engine': name,
+        'size': size,
+        'tiles': options.tiles,
+        'status': status,
+        'wall_s': round(wall, 3) if wall is not None else None,
+        'tiles_per_hour': (round(3600.0 * options.tiles / wall, 1)
+                           if ok else None),
+        'mb_per_s': (round(decoded_bytes(size) * options.tiles /
+                           (wall * 1e6), 2) if ok else None),
+        'peak_rss_mb': (round(peak_rss / 1e6, 1)
+                        if peak_rss is not None else None),
+        'outputs': (compare_outputs(hashes, reference)
+                    if reference is not None else None),
+        'hashes': hashes,
+    }
+
+
+def get_args():
+
+    '''
+    Gets arguments from command line.
+    '''
+
+    prog = os.path.basename(sys.argv[0])
+
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        usage='%(prog)s [options]',
+        description='Benchmark of the Sentinel-2 conversion scripts.',
+        argument_default=None,
+        epilog='Go get \'em!')
+
+    #
+    # Arguments.
+    #
+    parser.add_argument(
+        '--sizes', dest='sizes', action='store', type=str,
+        help=('Comma separated widths of the tiles in 10m pixels, multiples '
+              'of 6. Real tiles are 10980. Default 1098,5490.'),
+        default='1098,5490')
+    parser.add_argument(
+        '-t', '--tiles', dest='tiles', action='store', type=int,
+        help='Tiles converted by each engine per size. Default 2.',
+        default=2)
+    parser.add_argument(
+        '-e', '--engines', dest='engines', action='store', type=str,
+        help=('Comma separated engines to run, the first being the reference '
+              'for the outputs. Default: {}.').format(
+                  ','.join(name for name, engine in ENGINES)),
+        default=None)
+    parser.add_argument(
+        '--engine', dest='extra_engines', action='append',
+        help=('Another engine, as NAME=COMMAND with {python2}, {python3}, '
+              '{repo} and {read_dir} in the command, e.g. "linux4={python2} '
+              '{repo}/thesis/conversion_linux.py -r {read_dir} --auto y '
+              '--workers 4". It reads new layout Level-1C products. Can be '
+              'repeated.'),
+        default=[])
+    parser.add_argument(
+        '--python2', dest='python2', action='store', type=str,
+        help='Python 2 interpreter. Default python2.', default='python2')
+    parser.add_argument(
+        '--python3', dest='python3', action='store', type=str,
+        help='Python 3 interpreter. Default python3.', default='python3')
+    parser.add_argument(
+        '-w', '--work_dir', dest='work_dir', action='store', type=str,
+        help=('Folder for the products, runs and engine logs. Default '
+              'benchmark.'),
+        default='benchmark')
+    parser.add_argument(
+        '--nodata', dest='nodata', action='store', type=float,
+        help='Fraction of each tile without data. Default 0.1.', default=0.1)
+    parser.add_argument(
+        '--cloud', dest='cloud', action='store', type=float,
+        help='Cloud percentage of each tile. Default 10.', default=10.0)
+    parser.add_argument(
+        '--seed', dest='seed', action='store', type=int,
+        help='Seed of the synthetic products. Default 0.', default=0)
+    parser.add_argument(
+        '--baseline', dest='baseline', action='store', type=str,
+        help='Baseline file. Default {}.'.format(BASELINE_FILE),
+        default=BASELINE_FILE)
+    parser.add_argument(
+        '--save_baseline', dest='save_baseline', action='store_true',
+        help='Save the results of this run as the baseline.')
+    parser.add_argument(
+        '--tolerance', dest='tolerance', action='store', type=float,
+        help=('Fraction by which an engine may be slower or use more memory '
+              'than its baseline. Default {}.').format(TOLERANCE),
+        default=TOLERANCE)
+    parser.add_argument(
+        '--results', dest='results', action='store', type=str,
+        help='JSON lines file the results are appended to. Default {}.'
+        .format(RESULTS_FILE),
+        default=RESULTS_FILE)
+    parser.add_argument(
+        '--keep', dest='keep', action='store_true',
+        help='Keep the converted copies of the products.')
+
+    options = parser.parse_args()
+
+    try:
+        options.sizes = [int(size) for size in options.sizes.split(',')]
+    except ValueError:
+        parser.error('--sizes must be comma separated integers.')
+    if any(size <= 0 or size % 6 for size in options.sizes):
+        parser.error('--sizes must be positive multiples of 6.')
+
+    engines = dict(ENGINES)
+    for extra in options.extra_engines:
+        if '=' not in extra:
+            parser.error('--engine must be NAME=COMMAND: {}'.format(extra))
+        name, command = extra.split('=', 1)
+        engines[name] = (command, None, 'l1c', False)
+
+    names = [name for name, engine in ENGINES] + [
+        extra.split('=', 1)[0] for extra in options.extra_engines]
+    if options.engines is not None:
+        names = options.engines.split(',')
+    unknown = [name for name in names if name not in engines]
+    if unknown:
+        parser.error('Unknown engines: {}'.format(', '.join(unknown)))
+    options.engines = [(name, engines[name]) for name in names]
+
+    return options
+
+
+if __name__ == '__main__':
+
+    options = get_args()
+
+    try:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    except (IOError, OSError, ValueError):
+        baseline = {}
+
+    for folder in (options.work_dir, os.path.dirname(options.results),
+                   os.path.dirname(options.baseline)):
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    print('{:<18} {:>6} {:>9} {:>9} {:>8} {:>9}  {}'.format(
+        'engine', 'size', 'tiles/h', 'MB/s', 'RSS MB', 'wall s', 'outputs'))
+
+    results = []
+    regressed = False
+    for size in options.sizes:
+        reference = None
+        for i, (name, engine) in enumerate(options.engines):
+            result = benchmark(name, engine[0], engine[1], engine[2],
+                               engine[3], size, options, reference)
+            if i == 0:
+                reference = result.pop('hashes')
+                result['outputs'] = 'reference'
+            else:
+                result.pop('hashes')
+            result['regressions'] = check_baseline(result, baseline,
+                                                   options.tolerance)
+            regressed = regressed or bool(result['regressions'])
+            results.append(result)
+
+            print('{:<18} {:>6} {:>9} {:>9} {:>8} {:>9}  {}'.format(
+                name, size,
+                result['tiles_per_hour'] or '-', result['mb_per_s'] or '-',
+                result['peak_rss_mb'] or '-', result['wall_s'] or '-',
+                result['outputs'] or '-') + ('' if result['status'] == 'ok'
+                                            else '  ({})'.format(
+                                                result['status'])))
+            for regression in result['regressions']:
+                print('    REGRESSION {}'.format(regression))
+
+    with open(options.results, 'a') as f:
+        for result in results:
+            record = dict(result, date=datetime.datetime.now().isoformat(),
+                          host=socket.gethostname())
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    if options.save_baseline:
+        for result in results:
+            if result['status'] == 'ok':
+                baseline['{}/{}'.format(result['engine'], result['size'])] = {
+                    'tiles_per_hour': result['tiles_per_hour'],
+                    'peak_rss_mb': result['peak_rss_mb'],
+                    'mb_per_s': result['mb_per_s'],
+                }
+        with open(options.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('Baseline saved to {}.'.format(options.baseline))
+
+    if regressed:
+        sys.exit(1)
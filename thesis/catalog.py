@@ -0,0 +1,280 @@
+# ------------------------------------------------------------------------------
+# Name:        Catalog of the products found on the data hubs.
+# Purpose:     Keep the results of the hub queries in a SQLite file in the
+#              download folder: UUID, title, file name, tile, sensing and
+#              ingestion dates, size, cloud cover, checksum and download state
+#              of each product, with its Atom entry. For every query (without
+#              its ingestion dates) the latest ingestion date seen is kept, so
+#              the automatic runs only ask the hub for products ingested since
+#              the last one, and take the products they still have to download
+#              from the catalog instead of checking every result on disk again.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import datetime
+import sqlite3
+import threading
+import xml.etree.ElementTree as etree
+
+from hubsearch import ATOM
+
+#
+# Name of the catalog database in the download folder.
+#
+CATALOG_FILE = '.s2_catalog.sqlite'
+
+#
+# Download states of a product.
+#
+FOUND = 'found'
+DOWNLOADED = 'downloaded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+#
+# Days before the latest ingestion date a query is continued from, for
+# products the hub indexes late. Products found twice are only kept once.
+#
+SYNC_OVERLAP_DAYS = 1
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    uuid TEXT PRIMARY KEY,
+    title TEXT,
+    filename TEXT,
+    tile TEXT,
+    sensing TEXT,
+    ingestion TEXT,
+    size INTEGER,
+    cloud REAL,
+    checksum TEXT,
+    state TEXT,
+    updated TEXT,
+    entry TEXT
+);
+CREATE INDEX IF NOT EXISTS products_tile ON products (tile);
+CREATE TABLE IF NOT EXISTS query_products (
+    query TEXT,
+    uuid TEXT,
+    PRIMARY KEY (query, uuid)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    query TEXT PRIMARY KEY,
+    ingestion TEXT,
+    synced TEXT
+);
+'''
+
+
+def parse_date(text):
+
+    '''
+    Returns a hub date (e.g. '2017-01-01T10:20:31.026Z') as a datetime, to
+    the second, or None.
+    '''
+
+    if not text:
+        return None
+
+    return datetime.datetime.strptime(text.rstrip('Z').split('.')[0],
+                                      DATE_FORMAT)
+
+
+def parse_size(text):
+
+    '''
+    Returns the size of a result (e.g. '1.02 GB') in bytes, or None.
+    '''
+
+    try:
+        value, unit = text.split()
+        return int(float(value) * {'KB': 1 << 10, 'MB': 1 << 20,
+                                   'GB': 1 << 30, 'TB': 1 << 40}[unit])
+    except (AttributeError, ValueError, KeyError):
+        return None
+
+
+def _field(entry, name):
+
+    element = entry.find('.//*[@name="{}"]'.format(name))
+
+    return element.text if element is not None else None
+
+
+def entry_values(entry):
+
+    '''
+    Returns the catalog columns of a result entry.
+    '''
+
+    filename = _field(entry, 'filename') or ''
+
+    #
+    # Tile of the new single tile products, e.g. '..._T37SBA_...SAFE'.
+    #
+    tile = None
+    if filename.startswith(('S2A_MSIL', 'S2B_MSIL')):
+        tile = filename[-26:-21]
+
+    ingestion = parse_date(_field(entry, 'ingestiondate'))
+    cloud = _field(entry, 'cloudcoverpercentage')
+
+    return {
+        'uuid': entry.find(ATOM + 'id').text,
+        'title': entry.find(ATOM + 'title').text,
+        'filename': filename,
+        'tile': tile,
+        'sensing': _field(entry, 'beginposition'),
+        'ingestion': (ingestion.strftime(DATE_FORMAT)
+                      if ingestion is not None else None),
+        'size': parse_size(_field(entry, 'size')),
+        'cloud': float(cloud) if cloud is not None else None,
+        'entry': etree.tostring(entry),
+    }
+
+
+class Catalog(object):
+
+    '''
+    Catalog of the products found by the queries of a download folder. It
+    can be used by the threads of the download pool.
+    '''
+
+    def __init__(self, db_path):
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, timeout=60,
+                                  check_same_thread=False)
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+
+    def add(self, entries, query=None):
+
+        '''
+        Adds or updates the products of result entries, keeping their
+        download state, and links them to the query that found them.
+        '''
+
+        now = datetime.datetime.now().isoformat()
+        with self.lock:
+            for entry in entries:
+                values = entry_values(entry)
+                self.db.execute(
+                    'INSERT OR IGNORE INTO products (uuid, state) '
+                    'VALUES (?, ?)', (values['uuid'], FOUND))
+                self.db.execute(
+                    'UPDATE products SET title = ?, filename = ?, '
+                    'tile = coalesce(?, tile), sensing = ?, ingestion = ?, '
+                    'size = ?, cloud = ?, entry = ?, updated = ? '
+                    'WHERE uuid = ?',
+                    (values['title'], values['filename'], values['tile'],
+                     values['sensing'], values['ingestion'], values['size'],
+                     values['cloud'], values['entry'], now, values['uuid']))
+                if query is not None:
+                    self.db.execute(
+                        'INSERT OR IGNORE INTO query_products VALUES (?, ?)',
+                        (query, values['uuid']))
+            self.db.commit()
+
+    def state(self, uuid):
+
+        with self.lock:
+            row = self.db.execute('SELECT state FROM products WHERE uuid = ?',
+                                  (uuid,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def set_state(self, uuid, state, checksum=None, tile=None):
+
+        '''
+        Records the download state of a product, and its checksum or tile if
+        given.
+        '''
+
+        with self.lock:
+            self.db.execute(
+                'UPDATE products SET state = ?, '
+                'checksum = coalesce(?, checksum), tile = coalesce(?, tile), '
+                'updated = ? WHERE uuid = ?',
+                (state, checksum, tile, datetime.datetime.now().isoformat(),
+                 uuid))
+            self.db.commit()
+
+    def pending(self, query):
+
+        '''
+        Returns the entries of the products found by a query that are not
+        downloaded (or skipped) yet, oldest ingestion first.
+        '''
+
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT p.entry FROM products p JOIN query_products q '
+                'ON p.uuid = q.uuid WHERE q.query = ? AND p.state IN (?, ?) '
+                'AND p.entry IS NOT NULL ORDER BY p.ingestion',
+                (query, FOUND, FAILED)).fetchall()
+
+        return [etree.fromstring(row[0]) for row in rows]
+
+    def since(self, query):
+
+        '''
+        Returns the ingestion date (hub format) a query continues from, or
+        None if it was never synced.
+        '''
+
+        with self.lock:
+            row = self.db.execute('SELECT ingestion FROM syncs WHERE query = ?',
+                                  (query,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+
+        since = (datetime.datetime.strptime(row[0], DATE_FORMAT) -
+                 datetime.timedelta(days=SYNC_OVERLAP_DAYS))
+
+        return since.strftime(DATE_FORMAT) + '.000Z'
+
+    def synced(self, query, entries):
+
+        '''
+        Records that a query returned all its results: its latest ingestion
+        date becomes that of the newest entry, if it is newer.
+        '''
+
+        dates = [entry_values(entry)['ingestion'] for entry in entries]
+        latest = max([d for d in dates if d is not None] or [None])
+
+        with self.lock:
+            row = self.db.execute('SELECT ingestion FROM syncs WHERE query = ?',
+                                  (query,)).fetchone()
+            if row is not None and row[0] is not None and (
+                    latest is None or row[0] > latest):
+                latest = row[0]
+            self.db.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)',
+                            (query, latest,
+                             datetime.datetime.now().isoformat()))
+            self.db.commit()
+
+    def close(self):
+
+        self.db.close()
+
+
+def open_catalog(path):
+
+    '''
+    Returns the catalog in a file, creating it (and its folder) the first
+    time.
+    '''
+
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    return Catalog(path)
@@ -1,13 +1,11 @@
 import os
 import sys
 
-def findProcData(input_dir):
+import inventory
 
-    proc_data_dirs = list()
+def findProcData(input_dir):
 
-    for dirpath, dirnames, filenames in os.walk(input_dir):
-        if dirpath.endswith('PROC_DATA'):
-            proc_data_dirs.append(dirpath)
+    proc_data_dirs = inventory.open_inventory(input_dir).folders('*PROC_DATA')
 
     return proc_data_dirs
 
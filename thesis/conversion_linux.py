@@ -52,20 +52,71 @@
 
 import os
 import sys
+import time
 import shutil
 import datetime
 import fnmatch
+import signal
+import zipfile
 import argparse
 import logging
-import xml.etree.ElementTree as etree
+import traceback
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.queues
 
 import gdal
 import numpy
-import scipy.ndimage
+
+import aoi
+import kernels
+import bandstats
+import safezip
+import inventory
+import rasterout
+import tilemeta
+import tilejournal
+import nodataprobe
+import metrics
+import profiling
+import resample
+
+###############################################################################
+
+#
+# Default memory budget (in MB) for the working arrays of one strip, and a
+# rough count of bytes held per output pixel while a strip is converted.
+#
+BLOCK_MB = 256
+STRIP_BYTES_PER_PIXEL = 24
+
+#
+# Default GDAL block cache (in MB) for each conversion process.
+#
+GDAL_CACHE_MB = 256
+
+#
+# Seconds between two checks for worker processes that died (e.g. killed
+# for running out of memory) while waiting for the result of a tile.
+#
+WORKER_POLL_SECONDS = 5
+
+#
+# Sentinel-2 bands in the order of the 6-band stack (Landsat 1-5 and 7).
+#
+STACK_BANDS = ('_B02.jp2', '_B03.jp2', '_B04.jp2', '_B08.jp2', '_B11.jp2',
+               '_B12.jp2')
 
 ###############################################################################
 
 
+class TileError(Exception):
+
+    '''
+    Raised when a single tile cannot be converted.
+    '''
+
+
 def get_args():
 
     '''
@@ -108,155 +159,211 @@ def get_args():
             help=('No user input necessary -- automatically converts all '
                   'previously not converted images files.'),
             default=None)
+        parser.add_argument(
+            '-b', '--block_mb', dest='block_mb', action='store', type=int,
+            help=('Memory budget in MB for the arrays of one row strip. Tiles '
+                  'are read, converted and written strip by strip.'),
+            default=BLOCK_MB)
+        parser.add_argument(
+            '--workers', dest='workers', action='store', type=int,
+            help='Number of tiles converted in parallel worker processes.',
+            default=1)
+        parser.add_argument(
+            '--gdal_cache_mb', dest='gdal_cache_mb', action='store', type=int,
+            help='GDAL block cache in MB for each worker process.',
+            default=GDAL_CACHE_MB)
+        parser.add_argument(
+            '--band_threads', dest='band_threads', action='store', type=int,
+            help='Number of threads decoding the bands of one tile.',
+            default=1)
+        parser.add_argument(
+            '--resampling', dest='resampling', action='store',
+            choices=sorted(resample.HALO),
+            help='Resampling of bands 11 and 12 from 20m to 10m.',
+            default='nearest')
+        parser.add_argument(
+            '--output-format', dest='output_format', action='store',
+            choices=sorted(rasterout.FORMATS),
+            help=('Format of the nodata mask: ENVI .dat file, or tiled, '
+                  'compressed GeoTIFF with overviews (cloud optimized). The '
+                  'stacks SIAM reads are always ENVI files. Default envi.'),
+            default='envi')
+        parser.add_argument(
+            '--compress', dest='compress', action='store',
+            choices=rasterout.COMPRESSIONS,
+            help=('Compression of GeoTIFF outputs. ZSTD needs GDAL 2.3 or '
+                  'later. Default DEFLATE.'),
+            default='DEFLATE')
+        parser.add_argument(
+            '--jp2_threads', dest='jp2_threads', action='store', type=int,
+            help=('Number of threads OpenJPEG uses to decode each JP2 '
+                  '(GDAL_NUM_THREADS). Default: GDAL setting.'),
+            default=None)
+        parser.add_argument(
+            '--aoi', dest='aoi', action='store', type=str,
+            help=('Only convert the window of each tile covering an area of '
+                  'interest: west,south,east,north in degrees or a GeoJSON '
+                  'file. Default: whole tiles.'),
+            default=None)
+        parser.add_argument(
+            '--min_valid', dest='min_valid', action='store', type=float,
+            help=('Minimum fraction (0-1) of valid pixels of a tile, '
+                  'estimated from a low resolution read of band 1 before '
+                  'conversion. Default: no probe.'),
+            default=None)
+        parser.add_argument(
+            '--below_min', dest='below_min', action='store',
+            choices=('skip', 'last'),
+            help=('Skip tiles below --min_valid, or convert them after all '
+                  'others. Default skip.'),
+            default='skip')
+        parser.add_argument(
+            '--max_cloud', dest='max_cloud', action='store', type=float,
+            help=('Skip tiles with a higher cloud percentage (tile metadata '
+                  'CLOUDY_PIXEL_PERCENTAGE). Default: no limit.'),
+            default=None)
+        parser.add_argument(
+            '--order', dest='order', action='store',
+            choices=('path', 'cloud'),
+            help=('Order in which tiles are converted: by path, or the '
+                  'clearest tiles first. Default path.'),
+            default='path')
+        parser.add_argument(
+            '--profile', dest='profile', action='store', type=str,
+            help=('Directory to save cProfile stats, sampled stacks and '
+                  'tracemalloc reports of each tile to. Default: none.'),
+            default=None)
 
         return parser.parse_args()
 
 
-def nodata_array(tile_bands, PROC_DATA):
+def strip_rows(img_band, img_cols, img_rows, block_mb):
 
     '''
-    This function creates a noData mask array based on all pixels that have
-    a value of 0 in any of the original Sentinel-2 bands used to create the
-    6 band .dat SIAM input file, and saves a copy as '*nodata.dat'.
-    These correspond to S2 bands: 2, 3, 4, 8, 10 and 11.
+    This function returns the number of rows converted at once, so that the
+    working arrays of one strip stay within the block budget. Strips are a
+    multiple of the JP2 block height (and even, so the 20m bands line up).
     '''
 
-    #
-    # Create array with same projection, etc.
-    #
-    noData = gdal.Open(tile_bands[0], gdal.GA_ReadOnly)
-    noData_array = (noData.GetRasterBand(1)).ReadAsArray()
-    noData_array = numpy.where((noData_array > 0), (1), noData_array)
-    #
-    # Establish size of raster from B02 for nodata output file.
-    #
-    projection = noData.GetProjection()
-    transform = noData.GetGeoTransform()
-    img_rows = noData.RasterYSize
-    img_cols = noData.RasterXSize
+    block_rows = img_band.GetBlockSize()[1]
+    if block_rows % 2 == 1:
+        block_rows *= 2
 
-    #
-    # Open output format driver, see gdal_translate --formats for list.
-    #
-    gdal_format = 'ENVI'
-    driver = gdal.GetDriverByName(gdal_format)
+    budget_rows = int(block_mb * 1024 * 1024 /
+                      (img_cols * STRIP_BYTES_PER_PIXEL))
+    rows = max(block_rows, budget_rows - budget_rows % block_rows)
 
-    #
-    # Test nodata mask file path.
-    #
-    band_basename = os.path.basename(tile_bands[0])
-    nodata_file = '{}nodata.dat'.format(
-        os.path.basename(band_basename[:-7]))
-    filepath = os.path.join(PROC_DATA, nodata_file)
+    return min(rows, img_rows)
 
-    #
-    # Print driver for nodata mask (1 band, 8-bit unsigned).
-    #
-    outDs = driver.Create(filepath, img_cols, img_rows, 1,
-                          gdal.GDT_Byte)
-    if outDs is None:
-        print 'Could not create test file.'
-        sys.exit(1)
 
-    #
-    # Georeference the nodata .dat file and set the projection.
-    #
-    outDs.SetGeoTransform(transform)
-    outDs.SetProjection(projection)
+def iter_strips(img_rows, rows):
 
-    for band in tile_bands:
+    '''
+    This generator yields the row offset and height of every strip.
+    '''
 
-        #
-        # Open the band as read only.
-        #
-        img = gdal.Open(band, gdal.GA_ReadOnly)
-        band_id = band[-6:-4]
-        if img is None:
-            print 'Could not open band #{}'.format(band_id)
-            sys.exit(1)
-        print 'Processing noData for band #{}'.format(band_id)
+    for yoff in range(0, img_rows, rows):
+        yield yoff, min(rows, img_rows - yoff)
 
-        #
-        # Cycle through bands, removing noData.
-        #
-        band_array = (img.GetRasterBand(1)).ReadAsArray()
 
-        #
-        # Resample bands 11 and 12 from 20m to 10m resolution.
-        #
-        if band.endswith(('_B11.jp2', '_B12.jp2')):
-            band_array = scipy.ndimage.zoom(band_array, 2, order=0)
+def read_strip(img_band, band, xoff, yoff, xsize, ysize,
+               resampling='nearest'):
 
-        #
-        # Adjust output layer to 0 where there is nodata.
-        #
-        noData_array = numpy.where((band_array == 0), (0), noData_array)
+    '''
+    This function reads one strip (window) of a band on the 10m grid. Bands
+    11 and 12 are read from the matching 20m window (plus halo) and resampled
+    by a factor of 2. Returns the strip with nearest interpolation, used for the
+    noData mask, and the strip with the chosen resampling (the same array for
+    10m bands and nearest).
+    '''
 
-    #
-    # Invert array to mask, where 0 are values to be processed and 1 is nodata.
-    #
-    noData_array = numpy.where((noData_array == 0), (1), (0))
+    if band.endswith(('_B11.jp2', '_B12.jp2')):
+        window = resample.source_window(
+            xoff, yoff, xsize, ysize, img_band.XSize, img_band.YSize,
+            resampling)
+        block = img_band.ReadAsArray(*window)
+        band_array = resample.upsample_window(
+            block, xoff, yoff, xsize, ysize, window[0], window[1])
+        if resampling == 'nearest':
+            return band_array, band_array
+        return band_array, resample.upsample_window(
+            block, xoff, yoff, xsize, ysize, window[0], window[1],
+            resampling)
 
-    #
-    # Write the data to the designated band.
-    #
-    outBand = outDs.GetRasterBand(1)
-    outBand.WriteArray(noData_array, 0, 0)
+    band_array = img_band.ReadAsArray(xoff, yoff, xsize, ysize)
 
-    #
-    # Flush data to disk.
-    #
-    outBand.FlushCache()
+    return band_array, band_array
 
-    #
-    # Calculate statistics.
-    #
-    stats = outBand.ComputeStatistics(False)
-    outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
 
-    del gdal_format
-    del outDs
-    del outBand
-    del noData
-    img = None
-    band_id = None
-    band_array = None
-    outBand = None
-    stats = None
+def read_band_strip(task):
 
-    return noData_array
+    '''
+    This function reads one row strip of a band for the band thread pool.
+    Every band has its own dataset handle, so no two threads share one. The
+    time taken (decoding, and upsampling for bands 11 and 12) is added to
+    the 'decode_s' metric of the tile.
+    '''
 
+    band, img, band_in_stack, xoff, yoff, xsize, ysize, resampling = task
 
-def check_imgFolders(options_in):
+    start = time.time()
+    arrays = read_strip(
+        img.GetRasterBand(1), band, xoff, yoff, xsize, ysize, resampling)
+    metrics.add('decode_s', time.time() - start)
 
-    #
-    # Create list for IMG_DATA folder and existing PROC_DATA folder paths.
-    #
-    imgFolders = []
-    procFolders = []
+    return (band_in_stack,) + arrays
 
-    for dirpath, dirnames, filenames in os.walk(
-            options_in.read_dir, topdown=True):
 
-        for dirname in dirnames:
+def check_imgFolders(options_in, aoi_points=None):
 
-            if dirname == 'IMG_DATA':
+    #
+    # Create list for IMG_DATA folder and existing PROC_DATA folder paths,
+    # from the inventory of the read directory.
+    #
+    inv = inventory.open_inventory(options_in.read_dir)
+    imgFolders = inv.folders('IMG_DATA')
+    procFolders = inv.folders('PROC_DATA')
 
-                imgFolders.append(os.path.join(dirpath, dirname))
+    #
+    # Products downloaded with '--unzip n' are read from the zip through
+    # GDAL's /vsizip/, unless they have also been extracted.
+    #
+    for zip_path, size, mtime in inv.files('*.zip'):
 
-            elif dirname == 'PROC_DATA':
+        dirpath, filename = os.path.split(zip_path)
+        title = filename[:-len('.zip')]
 
-                procFolder = os.path.join(dirpath, dirname)
+        if (not safezip.is_product_zip(filename)
+                or os.path.exists(os.path.join(dirpath, title))
+                or os.path.exists(os.path.join(dirpath, title + '.SAFE'))):
+            continue
+
+        try:
+            imgFolders.extend(safezip.find_img_folders(zip_path))
+        except zipfile.BadZipfile:
+            logger.error('Zip file corrupt: ' + zip_path)
 
-                procFolders.append(procFolder)
     #
     # Determine which tile folders have no PROC_DATA folder.
     #
     unprocFolders = []
+    journaled = set()
 
     for imgFolder in imgFolders:
 
-        test_path = os.path.join(os.path.dirname(imgFolder), 'PROC_DATA')
+        test_path = safezip.proc_data_folder(imgFolder)
+
+        #
+        # Tiles with a conversion journal are skipped if they are done,
+        # without checking their files again, and otherwise converted
+        # (or completed) again.
+        #
+        journal = tilejournal.TileJournal(test_path)
+        if journal.stage is not None:
+            journaled.add(test_path)
+            if not journal.is_done():
+                unprocFolders.append(imgFolder)
+            continue
 
         if test_path in procFolders:
             
@@ -275,6 +382,9 @@ def check_imgFolders(options_in):
     #
     for procFolder in procFolders:
 
+        if procFolder in journaled:
+            continue
+
         #
         # Initialize variables for PROC_DATA folder.
         #
@@ -320,6 +430,37 @@ def check_imgFolders(options_in):
             logger.info('Removed Folder: ' + procFolder)
             unprocFolders.append(procFolder)
 
+    #
+    # Skip tiles outside the area of interest.
+    #
+    if aoi_points is not None:
+        unprocFolders, outsideFolders = aoi_imgFolders(unprocFolders,
+                                                       aoi_points)
+        print 'Tiles outside the AOI skipped: {}'.format(len(outsideFolders))
+
+    #
+    # Skip tiles that are too cloudy and convert the clearest first.
+    #
+    if options_in.max_cloud is not None or options_in.order == 'cloud':
+        unprocFolders, cloudyFolders = cloud_imgFolders(
+            unprocFolders, options_in.max_cloud, options_in.order)
+        if options_in.max_cloud is not None:
+            print 'Tiles above {}% cloud cover skipped: {}'.format(
+                options_in.max_cloud, len(cloudyFolders))
+
+    #
+    # Skip tiles that are mostly nodata (e.g. at the edge of the swath), or
+    # put them last.
+    #
+    if options_in.min_valid is not None:
+        unprocFolders, belowFolders = probe_imgFolders(
+            unprocFolders, options_in.min_valid, options_in.below_min)
+        print 'Tiles below {:.0%} valid pixels: {} ({})'.format(
+            options_in.min_valid, len(belowFolders),
+            'skipped' if options_in.below_min == 'skip' else 'converted last')
+        if options_in.below_min == 'last':
+            unprocFolders.extend(belowFolders)
+
     #
     # Create the content of the popup window.
     #
@@ -358,429 +499,707 @@ def check_imgFolders(options_in):
     return bool_ans, unprocFolders
 
 
-def convert_imgs(root_folder, imgFolders):
+def aoi_imgFolders(imgFolders, aoi_points):
 
-    start_time = datetime.datetime.now()
+    '''
+    This function drops the IMG_DATA folders whose tile does not overlap the
+    area of interest (lon/lat points, see aoi.parse_aoi), from the
+    georeferencing of one of its bands. Tiles without a readable band are
+    kept. Returns the folders kept and the folders dropped.
+    '''
 
-    print '================================================================='
-    print 'Hold on to your hat. This may take ~45s per S2 tile folder.'
-    print 'Number of unprocessed IMG_DATA folders found: {}'.format(
-        len(imgFolders))
-    print 'Estimated time: {} minutes'.format(int(len(imgFolders)) * 0.75)
-    print 'Start time: {}'.format(start_time.time())
-    print '=================================================================\n'
+    keepFolders = []
+    outsideFolders = []
 
-    message = (
-        'Root Folder: {} \nNumber of unprocessed IMG_DATA folders '
-        'found: {}\nStart time: {}'
-        ).format(root_folder, len(imgFolders), start_time.time())
-    logger.info(message)
-    #
-    # Register all of the GDAL drivers.
-    #
-    gdal.AllRegister()
+    for imgFolder in imgFolders:
 
-    #
-    # Possible XML Schema namespaces (plus a few potential future ones.)
-    #
-    XML_namespaces = ['https://psd-14.sentinel2.eo.esa.int/',
-                      'https://psd-12.sentinel2.eo.esa.int/',
-                      'https://psd-13.sentinel2.eo.esa.int/',
-                      'https://psd-15.sentinel2.eo.esa.int/',
-                      'https://psd-16.sentinel2.eo.esa.int/']
+        band = nodataprobe.probe_band(imgFolder)
+        img = None
+        if band is not None:
+            img = gdal.Open(band, gdal.GA_ReadOnly)
+        if img is None:
+            keepFolders.append(imgFolder)
+            continue
+
+        window = aoi.pixel_window(aoi_points, img.GetGeoTransform(),
+                                  img.GetProjection(), img.RasterXSize,
+                                  img.RasterYSize)
+        img = None
+
+        if window is None:
+            logger.info('Tile outside the AOI: {}'.format(imgFolder))
+            outsideFolders.append(imgFolder)
+        else:
+            keepFolders.append(imgFolder)
+
+    return keepFolders, outsideFolders
+
+
+def cloud_imgFolders(imgFolders, max_cloud=None, order='path'):
+
+    '''
+    This function drops the IMG_DATA folders whose tile has more than
+    max_cloud percent cloud cover and, with order 'cloud', sorts the others
+    from the clearest to the cloudiest. Tiles with an unknown cloud cover are
+    kept, last. Returns the folders kept and the folders dropped.
+    '''
+
+    clouds = {}
+    for imgFolder in imgFolders:
+        clouds[imgFolder] = None
+        metadata_path = tilemeta.find_metadata(os.path.dirname(imgFolder))
+        if len(metadata_path) != 1:
+            continue
+        try:
+            clouds[imgFolder] = tilemeta.cloud_percentage(
+                tilemeta.read(metadata_path[0]))
+        except (tilemeta.MetadataError, IOError, OSError):
+            continue
 
-    i = 0
+    keepFolders = []
+    cloudyFolders = []
 
     for imgFolder in imgFolders:
+        cloud = clouds[imgFolder]
+        if max_cloud is not None and cloud is not None and cloud > max_cloud:
+            logger.info('Cloud cover {}% above {}%: {}'.format(
+                cloud, max_cloud, imgFolder))
+            cloudyFolders.append(imgFolder)
+        else:
+            keepFolders.append(imgFolder)
 
-        metadata_path = []
+    if order == 'cloud':
+        keepFolders.sort(key=lambda f: (clouds[f] is None, clouds[f]))
 
-        for fn in os.listdir(os.path.dirname(imgFolder)):
-            if ((fn.startswith('S2A_') or fn.startswith('MTD'))
-                    and fn.endswith('.xml')):
-                metadata_file = fn
-                metadata_path.append(
-                    os.path.join(os.path.dirname(imgFolder), fn))
+    return keepFolders, cloudyFolders
 
-        if len(metadata_path) > 1:
-            message = (
-                'Make sure only the original metadata exists in the tile '
-                'folder\n{}\nAborting.'
-                ).format(os.path.dirname(imgFolder))
+
+def probe_imgFolders(imgFolders, min_valid, below_min='skip'):
+
+    '''
+    This function splits the IMG_DATA folders into those with at least
+    min_valid valid pixels and those below, estimated by the nodata probe.
+    The fraction and the decision are kept in the journal of each tile, so
+    later runs do not probe it again. Tiles that cannot be probed are kept.
+    '''
+
+    keepFolders = []
+    belowFolders = []
+
+    for imgFolder in imgFolders:
+
+        journal = tilejournal.TileJournal(safezip.proc_data_folder(imgFolder))
+        fraction = journal.valid_fraction
+
+        if fraction is None:
+            try:
+                fraction = nodataprobe.valid_fraction(imgFolder)
+            except IOError as e:
+                logger.warning(str(e))
+                keepFolders.append(imgFolder)
+                continue
+
+        below = fraction < min_valid
+        journal.probed(fraction, below and below_min == 'skip')
+
+        if below:
+            logger.info('Valid fraction {:.3f} below {}: {}'.format(
+                fraction, min_valid, imgFolder))
+            belowFolders.append(imgFolder)
+        else:
+            keepFolders.append(imgFolder)
+
+    return keepFolders, belowFolders
+
+
+def create_output(filepath, img_cols, img_rows, num_bands, transform,
+                  projection, output_format='envi', compress='DEFLATE'):
+
+    '''
+    This function creates an 8-bit output file with the georeferencing of the
+    input tile, as ENVI .dat or compressed GeoTIFF.
+    '''
+
+    try:
+        return rasterout.Output(filepath, img_cols, img_rows, num_bands,
+                                transform, projection, output_format,
+                                compress)
+    except IOError as e:
+        message = str(e)
+        print message
+        logger.critical(message)
+        raise TileError(message)
+
+
+def convert_tile(tile_bands, PROC_DATA, imgFolder, block_mb=BLOCK_MB,
+                 band_threads=1, resampling='nearest', output_format='envi',
+                 compress='DEFLATE', aoi_points=None):
+
+    '''
+    This function converts one tile in a single pass over its bands. Each row
+    strip of every band is decoded once, used to update the noData mask
+    (pixels with a value of 0 in any band) and converted to 8-bit, and the
+    strip is written to the '*nodata.dat', '*caltembyt_lndstlk.dat' and
+    '*calrefbyt_lndstlk.dat' files together.
+    With band_threads > 1 the bands of a strip are decoded concurrently on a
+    thread pool (GDAL releases the GIL while reading), while all writes stay
+    in this thread. Bands 11 and 12 are upsampled with the given resampling
+    method ('nearest' or 'bilinear'); the noData mask always uses nearest.
+    Band statistics and histograms are accumulated while the strips are
+    written and saved to a '*_stats.json' file next to each output.
+    The stacks SIAM reads are always ENVI files; the nodata mask is an ENVI
+    file (output_format 'envi') or a tiled, compressed GeoTIFF with
+    overviews ('gtiff').
+    With aoi_points (lon/lat points, see aoi.parse_aoi) only the window of
+    the tile covering them is read and written, with its georeferencing.
+    '''
+
+    imgs = []
+
+    for band in tile_bands:
+
+        #
+        # Open the band as read only.
+        #
+        img = gdal.Open(band, gdal.GA_ReadOnly)
+        band_id = band[-6:-4]
+        if img is None:
+            message = ('Could not open band #{} in {}').format(
+                band_id, imgFolder)
             print message
             logger.critical(message)
-            sys.exit()
+            raise TileError(message)
+        print 'Original shape of band #{}: {}'.format(
+            band_id, (img.RasterYSize, img.RasterXSize))
 
         #
-        # Parse the metadata xml-file. There should only be one path.
+        # Keep track of which band we are writing to in the stacked file.
         #
-        try:
-            tree = etree.parse(metadata_path[0])
-        except Exception as e:
-            message = (
-                '{} {} in {} could not be parsed.'
-                ).format(str(e), metadata_path[0], imgFolder)
+        band_in_stack = STACK_BANDS.index(band[-8:]) + 1
+        imgs.append((band, img, band_in_stack))
+
+    #
+    # Get raster georeference info and size from B02 for output .dat files.
+    # Any band with 10m pixel size would do.
+    #
+    img = imgs[0][1]
+    projection = img.GetProjection()
+    transform = img.GetGeoTransform()
+    img_rows = img.RasterYSize
+    img_cols = img.RasterXSize
+
+    #
+    # Window of the tile to convert, on the 10m grid: all of it, or the part
+    # covering the area of interest.
+    #
+    win_xoff = 0
+    win_yoff = 0
+    if aoi_points is not None:
+        window = aoi.pixel_window(aoi_points, transform, projection,
+                                  img_cols, img_rows)
+        if window is None:
+            message = 'Tile in {} does not overlap the AOI.'.format(imgFolder)
+            print message
             logger.critical(message)
+            raise TileError(message)
+        win_xoff, win_yoff, img_cols, img_rows = window
+        transform = aoi.window_transform(transform, window)
+        print 'AOI window of the tile (xoff, yoff, cols, rows): {}'.format(
+            window)
 
-        for namespace in XML_namespaces:
+    rows = strip_rows(img.GetRasterBand(1), img_cols, img_rows, block_mb)
 
-            try:
+    #
+    # Create nodata mask, fake thermal band (1 band each) and stacked layers
+    # (6 bands), all 8-bit unsigned.
+    #
+    basename = os.path.basename(tile_bands[0])[:-7]
+    noData_file = rasterout.output_path(
+        PROC_DATA, '{}nodata'.format(basename), output_format)
+    therm_file = rasterout.output_path(
+        PROC_DATA, '{}caltembyt_lndstlk'.format(basename), output_format)
+    out_file = rasterout.output_path(
+        PROC_DATA, '{}calrefbyt_lndstlk'.format(basename), output_format)
+    noDataDs = create_output(noData_file, img_cols, img_rows, 1, transform,
+                             projection, output_format, compress)
+    thermDs = create_output(therm_file, img_cols, img_rows, 1, transform,
+                            projection, 'envi')
+    outDs = create_output(out_file, img_cols, img_rows, 6, transform,
+                          projection, 'envi')
 
-                #
-                # Get metadata values from the General_Info element.
-                #
-                General_Info = tree.find(
-                    '{' + namespace + 'PSD/'
-                    'S2_PDI_Level-1C_Tile_Metadata.xsd}General_Info')
-                TILE_ID = General_Info.find('TILE_ID').text
-                tile_id = TILE_ID[-12:-7]
-                SENSING_TIME = General_Info.find('SENSING_TIME').text
+    #
+    # Histograms of every output band, accumulated strip by strip.
+    #
+    noData_stats = [bandstats.BandStats()]
+    therm_stats = [bandstats.BandStats()]
+    out_stats = [bandstats.BandStats() for i in range(outDs.RasterCount)]
 
-                #
-                # Get metadata values from the Geometric_Info element.
-                #
-                Geometric_Info = tree.find(
-                    '{' + namespace + 'PSD/'
-                    'S2_PDI_Level-1C_Tile_Metadata.xsd}Geometric_Info')
-                HORIZONTAL_CS_NAME = Geometric_Info.find(
-                    'Tile_Geocoding').find('HORIZONTAL_CS_NAME').text
-                HORIZONTAL_CS_CODE = Geometric_Info.find(
-                    'Tile_Geocoding').find('HORIZONTAL_CS_CODE').text
-                break
+    out_buffer = numpy.empty((rows, img_cols), dtype=numpy.uint8)
+    therm_buffer = numpy.empty((rows, img_cols), dtype=numpy.uint8)
 
-            except Exception as e:
-                message = ('{} {} in {} could not be parsed with {}.').format(
-                    str(e), metadata_path[0], imgFolder, namespace)
-                logger.error(message)
-        else:
-            message = ('{} in {} could not be parsed.').format(
-                metadata_path[0], imgFolder)
-            logger.error(message)
-            continue
+    band_pool = None
+    if band_threads > 1:
+        band_pool = multiprocessing.pool.ThreadPool(band_threads)
 
-        tile_bands = []
+    for yoff, ysize in iter_strips(img_rows, rows):
 
         #
-        # Retrieve desired bands from old data structure.
+        # Read the strip of every band once. Bands 11 and 12 are resampled
+        # from 20m to 10m resolution while reading.
         #
-        if metadata_file.startswith('S2A_'):
-            for dirpath, dirnames, filenames in os.walk(
-                    imgFolder, topdown=True):
-                for filename in filenames:
-                    if (filename.startswith('S2A')
-                            and filename.endswith('.jp2')
-                            and (fnmatch.fnmatch(filename, '*_B02.*')
-                                 or fnmatch.fnmatch(filename, '*_B03.*')
-                                 or fnmatch.fnmatch(filename, '*_B04.*')
-                                 or fnmatch.fnmatch(filename, '*_B08.*')
-                                 or fnmatch.fnmatch(filename, '*_B11.*')
-                                 or fnmatch.fnmatch(filename, '*_B12.*'))):
-
-                        tile_bands.append(os.path.join(dirpath, filename))
+        tasks = [(band, img, band_in_stack, win_xoff, win_yoff + yoff,
+                  img_cols, ysize, resampling)
+                 for band, img, band_in_stack in imgs]
+        if band_pool is not None:
+            band_arrays = band_pool.map(read_band_strip, tasks)
+        else:
+            band_arrays = map(read_band_strip, tasks)
 
         #
-        # Retrieve desired bands from data structure.
+        # Mask, where 0 are values to be processed and 1 is nodata.
         #
-        elif metadata_file.startswith('M'):
-            for dirpath, dirnames, filenames in os.walk(
-                    imgFolder, topdown=True):
-                for filename in filenames:
-                    if (filename.startswith('T')
-                            and filename.endswith('.jp2')
-                            and (fnmatch.fnmatch(filename, '*_B02.*')
-                                 or fnmatch.fnmatch(filename, '*_B03.*')
-                                 or fnmatch.fnmatch(filename, '*_B04.*')
-                                 or fnmatch.fnmatch(filename, '*_B08.*')
-                                 or fnmatch.fnmatch(filename, '*_B11.*')
-                                 or fnmatch.fnmatch(filename, '*_B12.*'))):
-
-                        tile_bands.append(os.path.join(dirpath, filename))
+        noData_array = numpy.zeros((ysize, img_cols), dtype=numpy.uint8)
+        for band_in_stack, img_array, resampled in band_arrays:
+            kernels.flag_nodata(noData_array, img_array)
+
+        noDataDs.write(1, noData_array, yoff)
+        noData_stats[0].update(noData_array)
 
         #
-        # Put bands in numeric order for processing. Redundant, keep anyways.
+        # Constant fake thermal value of 110, removing pixels having no data
+        # in any of the input bands, made from the mask strip.
         #
-        tile_bands.sort()
+        therm_array = kernels.fake_thermal(noData_array, therm_buffer[:ysize])
+        thermDs.write(1, therm_array, yoff)
+        therm_stats[0].update(therm_array)
+
+        for band_in_stack, img_array, resampled in band_arrays:
+
+            #
+            # Convert to 8-bit (reflectance adjusted to [0, 1]) with a lookup
+            # table, into the buffer reused for every strip.
+            #
+            outData = kernels.to_byte(resampled, out_buffer[:ysize])
+
+            #
+            # Remove pixels having no data in any of the input bands.
+            #
+            kernels.mask_nodata(outData, noData_array)
+
+            #
+            # Write the strip to the designated band.
+            #
+            outDs.write(band_in_stack, outData, yoff)
+            out_stats[band_in_stack - 1].update(outData)
+
+        band_arrays = None
+        img_array = None
+        resampled = None
+        outData = None
+
+    if band_pool is not None:
+        band_pool.close()
+        band_pool.join()
+
+    for ds, filepath, ds_stats, overview_resampling in (
+            (noDataDs, noData_file, noData_stats, 'NEAREST'),
+            (thermDs, therm_file, therm_stats, 'NEAREST'),
+            (outDs, out_file, out_stats, 'AVERAGE')):
 
         #
-        # Create the folder for processed data if it doesn't exist.
+        # Flush data to disk and set the statistics and histogram
+        # accumulated while writing, without reading the bands back.
+        # GeoTIFFs get their overviews here.
         #
-        PROC_DATA = os.path.join(os.path.dirname(imgFolder), 'PROC_DATA')
-        if not os.path.exists(PROC_DATA):
-            os.mkdir(PROC_DATA)
+        try:
+            ds.close(ds_stats, overview_resampling)
+        except IOError as e:
+            message = str(e)
+            print message
+            logger.critical(message)
+            raise TileError(message)
 
         #
-        # Create file to save stack to -- there is probably a better way to do
-        # this! Also create fake thermal band file.
+        # Export the histograms for QA.
         #
+        bandstats.write_sidecar(filepath, ds_stats)
 
-        print tile_bands
-        noData_array = None
-        noData_array = nodata_array(tile_bands, PROC_DATA)
+    #
+    # Clean up.
+    #
+    noDataDs = None
+    thermDs = None
+    outDs = None
+    imgs = None
+    img = None
+    out_buffer = None
+    therm_buffer = None
 
-        for band in tile_bands:
 
-            if band.endswith('_B02.jp2'):
+class RecordCollector(logging.Handler):
 
-                #
-                # Open B02 image in order to initialize .dat files. Any band
-                # with 10m pixel size would do. Gets georeferencing info, etc.
-                #
-                img = gdal.Open(band, gdal.GA_ReadOnly)
-                band_id = band[-6:-4]
-                if img is None:
-                    message = (
-                        '{} in {} could not be opened.'
-                        ).format(band, imgFolder)
-                    print message
-                    logger.critical(message)
-                    sys.exit(1)
-
-                print '-------------------------------------------------------'
-                print 'Processing tile {} sensed at {}'.format(
-                    tile_id, SENSING_TIME)
-                print 'Coordinate system: {}, {}\n\n'.format(
-                    HORIZONTAL_CS_NAME, HORIZONTAL_CS_CODE)
+    '''
+    Logging handler that keeps the records of a worker process, so they can
+    be handed back and written to the converter log by the main process.
+    '''
 
-                #
-                # Get raster georeference info from B02 for output .dat files.
-                #
-                projection = img.GetProjection()
-                transform = img.GetGeoTransform()
-                # xOrigin = transform[0]
-                # yOrigin = transform[3]
-                # pixelWidth = transform[1]
-                # pixelHeight = transform[5]
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
 
-                #
-                # Establish size of raster from B02 for stacked output file.
-                #
-                img_rows = img.RasterYSize
-                img_cols = img.RasterXSize
+    def emit(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
 
-                #
-                # Open output format driver, see gdal_translate for formats.
-                #
-                gdal_format = 'ENVI'
-                driver = gdal.GetDriverByName(gdal_format)
 
-                #
-                # Test stacked band file path.
-                #
-                stacked_file = '{}calrefbyt_lndstlk.dat'.format(
-                    os.path.basename(band)[:-7])
-                filepath = os.path.join(PROC_DATA, stacked_file)
+#
+# Queue the workers announce each tile they start on, as (pid, IMG_DATA
+# folder), so the main process knows which tile a dead worker was on. It is
+# a SimpleQueue, written at once rather than by a thread that a killed
+# worker would take down with it.
+#
+_worker = {'started': None}
 
-                #
-                # Print driver for stacked layers (6 bands, 8-bit unsigned).
-                #
-                outDs = driver.Create(filepath, img_cols, img_rows, 6,
-                                      gdal.GDT_Byte)
-                if outDs is None:
-                    print 'Could not create test file.'
-                    sys.exit(1)
 
-                #
-                # Georeference the stacked .dat file and set the projection.
-                #
-                outDs.SetGeoTransform(transform)
-                outDs.SetProjection(projection)
+def init_worker(gdal_cache_mb, started=None):
 
-                print 'Creating fake thermal band for {}\n'.format(tile_id)
+    '''
+    This function sets up a worker process of the conversion pool: it limits
+    the GDAL block cache of the worker and collects its log records instead of
+    writing to the shared log file.
+    '''
 
-                #
-                # Create thermal band file path.
-                #
-                thermal_file = '{}caltembyt_lndstlk.dat'.format(
-                    os.path.basename(band)[:-7])
-                filepath = os.path.join(PROC_DATA, thermal_file)
+    _worker['started'] = started
 
-                #
-                # Print driver for fake thermal band (1 band, 8-bit unsigned).
-                #
-                thermDs = driver.Create(filepath, img_cols, img_rows, 1,
-                                        gdal.GDT_Byte)
-                if thermDs is None:
-                    print 'Could not create test file.'
-                    sys.exit(1)
+    #
+    # Leave keyboard interrupts to the main process.
+    #
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-                #
-                # Georeference the fake thermal band and set the projection.
-                #
-                thermDs.SetGeoTransform(transform)
-                thermDs.SetProjection(projection)
+    gdal.SetCacheMax(gdal_cache_mb * 1024 * 1024)
+    gdal.AllRegister()
 
-                #
-                # Create constant array with a value of 110.
-                #
-                therm_array = numpy.ones((img_rows, img_cols)).astype(int)
-                therm_array = therm_array * 110
+    #
+    # Hand the metrics of the tiles back to the main process as well.
+    #
+    metrics.collect()
 
-                #
-                # Remove pixels having no data in any of the input bands.
-                #
-                therm_array = numpy.where(
-                    (noData_array == 1), (0), therm_array)
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(RecordCollector())
 
-                #
-                # Write the data to the designated band.
-                #
-                outBand = thermDs.GetRasterBand(1)
-                outBand.WriteArray(therm_array, 0, 0)
 
-                #
-                # Flush data to disk and set the NoData value.
-                #
-                outBand.FlushCache()
-                # outBand.SetNoDataValue(-99)
+def convert_folder(imgFolder, **tile_options):
 
-                #
-                # Calculate statistics.
-                #
-                stats = outBand.ComputeStatistics(False)
-                outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+    '''
+    This function converts the bands of one IMG_DATA folder and returns the
+    tile id. The tile options are passed on to convert_tile. Problems with
+    the tile raise a TileError. The outputs only appear in PROC_DATA once
+    they are all complete, with the tile's journal (see tilejournal).
+    '''
 
-                print 'Fake thermal band created.\n\n'
-                print 'Elapsed time: {}'.format(
-                    datetime.datetime.now() - start_time)
+    metadata_path = []
 
-                #
-                # Clean up.
-                #
-                del driver
-                band_id = None
-                therm_array = None
-                outBand = None
-                stats = None
-                thermDs = None
-                img = None
+    for fn in safezip.listdir(os.path.dirname(imgFolder)):
+        if ((fn.startswith('S2A_') or fn.startswith('MTD'))
+                and fn.endswith('.xml')):
+            metadata_file = fn
+            metadata_path.append(
+                os.path.join(os.path.dirname(imgFolder), fn))
 
-        print 'Creating 6 band stack for tile {}\n'.format(tile_id)
+    if len(metadata_path) != 1:
+        message = (
+            'Make sure only the original metadata exists in the tile '
+            'folder\n{}\nAborting.'
+            ).format(os.path.dirname(imgFolder))
+        print message
+        logger.critical(message)
+        raise TileError(message)
 
-        for band in tile_bands:
+    #
+    # Read the metadata xml-file in one pass, or its cached values. There
+    # should only be one path.
+    #
+    try:
+        metadata = tilemeta.read(metadata_path[0])
+    except (tilemeta.MetadataError, IOError, OSError) as e:
+        message = '{} ({})'.format(str(e), imgFolder)
+        logger.critical(message)
+        raise TileError(message)
 
-            #
-            # Keep track of which band we are writing to in the stacked file.
-            #
+    TILE_ID = metadata['TILE_ID']
+    tile_id = TILE_ID[-12:-7]
+    SENSING_TIME = metadata['SENSING_TIME']
+    HORIZONTAL_CS_NAME = metadata['HORIZONTAL_CS_NAME']
+    HORIZONTAL_CS_CODE = metadata['HORIZONTAL_CS_CODE']
 
-            band_in_stack = None
-
-            if band.endswith('_B02.jp2'):
-                band_in_stack = 1
-            if band.endswith('_B03.jp2'):
-                band_in_stack = 2
-            if band.endswith('_B04.jp2'):
-                band_in_stack = 3
-            if band.endswith('_B08.jp2'):
-                band_in_stack = 4
-            if band.endswith('_B11.jp2'):
-                band_in_stack = 5
-            if band.endswith('_B12.jp2'):
-                band_in_stack = 6
+    tile_bands = []
 
-            #
-            # This if statement is redundant now, but keep for now anyways.
-            #
-            if band.endswith(('_B02.jp2', '_B03.jp2', '_B04.jp2', '_B08.jp2',
-                              '_B11.jp2', '_B12.jp2')):
+    #
+    # Retrieve desired bands from old data structure.
+    #
+    if metadata_file.startswith('S2A_'):
+        for dirpath, dirnames, filenames in safezip.walk(imgFolder):
+            for filename in filenames:
+                if (filename.startswith('S2A')
+                        and filename.endswith('.jp2')
+                        and (fnmatch.fnmatch(filename, '*_B02.*')
+                             or fnmatch.fnmatch(filename, '*_B03.*')
+                             or fnmatch.fnmatch(filename, '*_B04.*')
+                             or fnmatch.fnmatch(filename, '*_B08.*')
+                             or fnmatch.fnmatch(filename, '*_B11.*')
+                             or fnmatch.fnmatch(filename, '*_B12.*'))):
+
+                    tile_bands.append(os.path.join(dirpath, filename))
 
-                #
-                # Open the band as read only.
-                #
-                img = gdal.Open(band, gdal.GA_ReadOnly)
-                band_id = band[-6:-4]
-                if img is None:
-                    message = ('Could not open band #{} in {}').format(
-                        band_id, imgFolder)
-                    print message
-                    logger.critical(message)
-                    sys.exit(1)
-                print 'Processing band #{}'.format(band_id)
+    #
+    # Retrieve desired bands from data structure.
+    #
+    elif metadata_file.startswith('M'):
+        for dirpath, dirnames, filenames in safezip.walk(imgFolder):
+            for filename in filenames:
+                if (filename.startswith('T')
+                        and filename.endswith('.jp2')
+                        and (fnmatch.fnmatch(filename, '*_B02.*')
+                             or fnmatch.fnmatch(filename, '*_B03.*')
+                             or fnmatch.fnmatch(filename, '*_B04.*')
+                             or fnmatch.fnmatch(filename, '*_B08.*')
+                             or fnmatch.fnmatch(filename, '*_B11.*')
+                             or fnmatch.fnmatch(filename, '*_B12.*'))):
+
+                    tile_bands.append(os.path.join(dirpath, filename))
 
-                #
-                # Retrieve band and get dimensions.
-                #
-                img_band = img.GetRasterBand(1)
-                img_rows = img.RasterYSize
-                img_cols = img.RasterXSize
+    #
+    # Put bands in numeric order for processing. Redundant, keep anyways.
+    #
+    tile_bands.sort()
 
-                #
-                # Read image as array using GDAL.
-                #
-                img_array = img_band.ReadAsArray(0, 0, img_cols, img_rows)
-                print 'Original shape: {}'.format(img_array.shape)
-                # print 'Original max: {}'.format(numpy.amax(img_array))
-                # print 'Original min: {}'.format(numpy.amin(img_array))
+    #
+    # The folder for processed data, next to the zip for zipped products.
+    # If an earlier run stopped after writing all outputs, only the rename
+    # of its temporary folder is left.
+    #
+    PROC_DATA = safezip.proc_data_folder(imgFolder)
+    journal = tilejournal.TileJournal(PROC_DATA)
+    inputs = dict((os.path.basename(band), tilejournal.checksum(band))
+                  for band in tile_bands)
+
+    if journal.can_commit(inputs):
+        journal.commit()
+        print 'Tile {} completed from an earlier run.'.format(tile_id)
+        return tile_id
+
+    print tile_bands
+    print '-------------------------------------------------------'
+    print 'Processing tile {} sensed at {}'.format(tile_id, SENSING_TIME)
+    print 'Coordinate system: {}, {}\n\n'.format(
+        HORIZONTAL_CS_NAME, HORIZONTAL_CS_CODE)
+    print (
+        'Creating nodata mask, fake thermal band and 6 band stack for '
+        'tile {}\n').format(tile_id)
 
-                #
-                # Adjust outliers (very high reflectance and negative).
-                #
-                outData = img_array / 10000.0
-                outData = numpy.where((outData > 1), (1), outData)
-                outData = numpy.where((outData < 0), (0), outData)
+    #
+    # Create the nodata mask, the fake thermal band and the stack, reading
+    # each band only once, in a temporary folder that replaces PROC_DATA
+    # once all outputs are complete.
+    #
+    work_folder = journal.begin(tile_id, inputs)
+    with metrics.stage('convert_tile', tile=tile_id, folder=imgFolder), \
+            profiling.profile(
+                'convert_' + os.path.basename(os.path.dirname(imgFolder))):
+        convert_tile(tile_bands, work_folder, imgFolder, **tile_options)
+    journal.converted()
+    journal.commit()
 
-                #
-                # Old, slow method for reference.
-                #
-                # for i in range(0, img_rows):
-                #     for j in range(0, img_cols):
-                #         if outData[i,j] > 1:
-                #             outData[i,j] = 1
-                #         elif outData[i,j] < 0:
-                #             outData[i,j] = 0
+    return tile_id
 
-                img_array = None
 
-                #
-                # Resample bands 11 and 12 from 20m to 10m resolution.
-                #
-                if band.endswith(('_B11.jp2', '_B12.jp2')):
-                    print 'Resample by a factor of 2 - nearest interpolation.'
-                    outData = scipy.ndimage.zoom(outData, 2, order=0)
-                    print 'Resampled size: {}'.format(outData.shape)
+def convert_worker(task):
 
-                #
-                # Convert to 8-bit.
-                #
-                outData = ((numpy.absolute(outData) * 255.0) + 0.5).astype(int)
+    '''
+    This function converts one tile in a worker process. Any failure is
+    caught so that it only affects this tile. Returns the tile id (or None),
+    the error message (or None), the log records and the metrics records of
+    the tile.
+    '''
 
-                #
-                # Remove pixels having no data in any of the input bands.
-                #
-                outData = numpy.where((noData_array == 1), (0), outData)
+    imgFolder, tile_options = task
+    if _worker['started'] is not None:
+        _worker['started'].put((os.getpid(), imgFolder))
+    collector = logging.getLogger().handlers[0]
+    collector.records = []
+    tile_id = None
+    error = None
 
-                #
-                # Write the data to the designated band.
-                #
-                outBand = outDs.GetRasterBand(band_in_stack)
-                outBand.WriteArray(outData, 0, 0)
+    try:
+        tile_id = convert_folder(imgFolder, **tile_options)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        logger.error('Conversion of {} failed.\n{}'.format(
+            imgFolder, traceback.format_exc()))
 
-                #
-                # Flush data to disk and set the NoData value.
-                #
-                outBand.FlushCache()
-                # outBand.SetNoDataValue(-99)
+    return tile_id, error, collector.records, metrics.take_records()
 
-                #
-                # Calculate statistics.
-                #
-                stats = outBand.ComputeStatistics(False)
-                outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
 
-                print 'Band #{} completed.\n'.format(band_id)
-                print 'Elapsed time: {}'.format(
-                    datetime.datetime.now() - start_time)
+class WorkerWatch(object):
+
+    '''
+    Waits for the results of the conversion pool, noticing workers that die
+    (the pool replaces them, but the tile they were on never returns).
+    '''
+
+    def __init__(self, started):
+
+        self.started = started
+        self.running = {}
+        self.lost = {}
+        self.deaths = 0
+
+    def _check(self):
+
+        while not self.started.empty():
+            pid, imgFolder = self.started.get()
+            self.running[pid] = imgFolder
+
+        alive = set(p.pid for p in multiprocessing.active_children())
+        for pid, imgFolder in list(self.running.items()):
+            if pid not in alive:
+                del self.running[pid]
+                self.deaths += 1
+                self.lost[imgFolder] = (
+                    'Worker process {} died (killed, out of memory or '
+                    'crashed).').format(pid)
+
+    def wait(self, result, imgFolder):
+
+        '''
+        Returns the result of convert_worker for a tile, or a failure if the
+        worker converting it died.
+        '''
+
+        while True:
+            try:
+                return result.get(WORKER_POLL_SECONDS)
+            except multiprocessing.TimeoutError:
+                pass
+            self._check()
+            if imgFolder in self.lost:
+                return None, self.lost.pop(imgFolder), [], []
+
+
+def convert_imgs(root_folder, imgFolders, workers=1,
+                 gdal_cache_mb=GDAL_CACHE_MB, jp2_threads=None,
+                 **tile_options):
+
+    '''
+    This function converts all IMG_DATA folders, one after another or in a
+    pool of worker processes. The tile options (block_mb, band_threads,
+    resampling) are passed on to convert_tile.
+    '''
+
+    start_time = datetime.datetime.now()
+    run = metrics.Stage('conversion', tiles=len(imgFolders)).start()
 
+    #
+    # Seconds per tile measured by earlier runs, or a rough guess.
+    #
+    tile_seconds = metrics.mean_wall('convert_tile') or 45
+
+    print '================================================================='
+    print (
+        'Hold on to your hat. This may take ~{:.0f}s per S2 tile folder.'
+        ).format(tile_seconds)
+    print 'Number of unprocessed IMG_DATA folders found: {}'.format(
+        len(imgFolders))
+    print 'Number of worker processes: {}'.format(workers)
+    print 'Band threads per tile: {}'.format(
+        tile_options.get('band_threads', 1))
+    print 'Estimated time: {} minutes'.format(
+        int(len(imgFolders)) * tile_seconds / 60.0 / workers)
+    print 'Start time: {}'.format(start_time.time())
+    print '=================================================================\n'
+
+    message = (
+        'Root Folder: {} \nNumber of unprocessed IMG_DATA folders '
+        'found: {}\nStart time: {}'
+        ).format(root_folder, len(imgFolders), start_time.time())
+    logger.info(message)
+    #
+    # Register all of the GDAL drivers.
+    #
+    gdal.AllRegister()
+
+    #
+    # Number of threads OpenJPEG uses to decode each JP2.
+    #
+    if jp2_threads is not None:
+        gdal.SetConfigOption('GDAL_NUM_THREADS', str(jp2_threads))
+        gdal.SetConfigOption('OPJ_NUM_THREADS', str(jp2_threads))
+
+    #
+    # Convert tiles in a pool of worker processes, collecting results in the
+    # original order, or one after another in this process.
+    #
+    pool = None
+    if workers > 1:
+        started = multiprocessing.queues.SimpleQueue()
+        watch = WorkerWatch(started)
+        pool = multiprocessing.Pool(
+            workers, init_worker, (gdal_cache_mb, started))
+        results = [pool.apply_async(convert_worker,
+                                    ((imgFolder, tile_options),))
+                   for imgFolder in imgFolders]
+    else:
+        gdal.SetCacheMax(gdal_cache_mb * 1024 * 1024)
+
+    failed = []
+
+    for i, imgFolder in enumerate(imgFolders, 1):
+
+        if pool is not None:
+            tile_id, error, records, tile_metrics = watch.wait(
+                results[i - 1], imgFolder)
+            for record in records:
+                logging.getLogger().handle(record)
+            for record in tile_metrics:
+                metrics.emit(record)
+        else:
+            tile_id = None
+            error = None
+            try:
+                tile_id = convert_folder(imgFolder, **tile_options)
+            except TileError as e:
+                error = str(e)
+            except Exception as e:
                 #
-                # Clean up to avoid problems processing bands to follow.
+                # Any other failure only affects this tile as well, as in a
+                # worker process.
                 #
-                del outData
-                del outBand
-                img_band = None
-                band_id = None
-                stats = None
-                img = None
+                error = '{}: {}'.format(type(e).__name__, e)
+                logger.error('Conversion of {} failed.\n{}'.format(
+                    imgFolder, traceback.format_exc()))
+
+        if error is not None:
 
-        i += 1
+            #
+            # Remove the partly written outputs and record the failure, so
+            # the tile is converted again by the next run.
+            #
+            tilejournal.TileJournal(
+                safezip.proc_data_folder(imgFolder)).fail(error)
+            failed.append(imgFolder)
+
+            message = (
+                'Tile in {}, {} of {} failed: {}'
+                ).format(imgFolder, str(i), len(imgFolders), error)
+            print message
+            logger.error(message)
+            continue
+
+        print 'Elapsed time: {}'.format(datetime.datetime.now() - start_time)
 
         message = (
             'Tile {}, {} of {} processed and stacked.'
@@ -789,24 +1208,28 @@ def convert_imgs(root_folder, imgFolders):
         print '------------------------------------------------------------\n'
         logger.info(message)
 
+    if pool is not None:
         #
-        # Clean up to avoid problems processing tiles to follow.
+        # The tasks of dead workers never finish, so the pool would wait for
+        # them forever when joined.
         #
-        del metadata_path
-        del tree
-        del SENSING_TIME
-        del HORIZONTAL_CS_NAME
-        del HORIZONTAL_CS_CODE
-        del tile_bands
-        del tile_id
-        outDs = None
-        noData_array = None
+        if watch.deaths:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    run.add('failed', len(failed))
+    run.finish()
 
     print '\n\n==============================================================='
     print 'Done processing.'
+    print 'Failed tiles: {}'.format(len(failed))
     print 'End time: {}'.format(datetime.datetime.now().time())
     print 'Total elapsed time: {}'.format(datetime.datetime.now() - start_time)
     print '===============================================================\n\n'
+    message = ('Failed tiles: {}').format(len(failed))
+    logger.info(message)
     message = ('End time: {}').format(datetime.datetime.now().time())
     logger.info(message)
     message = ('Total elapsed time: {}').format(
@@ -823,14 +1246,24 @@ if __name__ == '__main__':
                         format='%(asctime)s:%(levelname)s:%(message)s',
                         level=logging.DEBUG)
     logger = logging.getLogger('converter ')
+    metrics.configure('log/metrics.jsonl', 'log/converter.prom', 'converter')
 
     #
     # Define S2 root folder, where all downloads are located.
     #
     options = get_args()
     root_folder = options.read_dir
+    profiling.configure(options.profile)
+
+    aoi_points = None
+    if options.aoi is not None:
+        try:
+            aoi_points = aoi.parse_aoi(options.aoi)
+        except aoi.AOIError as e:
+            print str(e)
+            sys.exit(1)
 
-    bool_answer, imgFolders_toProcess = check_imgFolders(options)
+    bool_answer, imgFolders_toProcess = check_imgFolders(options, aoi_points)
 
     if not bool_answer:
         print 'No folders processed.'
@@ -843,4 +1276,11 @@ if __name__ == '__main__':
 
     else:
 
-        convert_imgs(root_folder, imgFolders_toProcess)
+        convert_imgs(root_folder, imgFolders_toProcess, options.workers,
+                     options.gdal_cache_mb, options.jp2_threads,
+                     block_mb=options.block_mb,
+                     band_threads=options.band_threads,
+                     resampling=options.resampling,
+                     output_format=options.output_format,
+                     compress=options.compress,
+                     aoi_points=aoi_points)
@@ -1,7 +1,8 @@
 #-------------------------------------------------------------------------------
 # Name:        Sentinel2 Downloader
-# Purpose:     This script uses wget and requests to download Sentinel2
-#              images from the Sentinel API or Scientific Data Hub on Linux.
+# Purpose:     This script uses requests to download Sentinel2 images from
+#              the Sentinel API or Scientific Data Hub on Linux, several at a
+#              time over one session (see transfer.py).
 #
 # Author:      h.Augustin
 #
@@ -13,6 +14,7 @@
 # -*- coding: iso-8859-1 -*-
 
 import os
+import shutil
 import sys
 import zipfile
 import argparse
@@ -24,6 +26,13 @@ import logging
 
 import requests
 
+import metrics
+import profiling
+import transfer
+import hubsearch
+import catalog
+import tilegrid
+
 ################################################################################
 def get_args():
 
@@ -60,8 +69,8 @@ def get_args():
                 type=str, help='Path where products should be downloaded',
                 default='./tempS2')
         parser.add_argument('-r', dest='MaxRecords', action='store', type=int,
-                help='Maximum number of records to download (default=100)',
-                default=100)
+                help='Maximum number of records to download (default=all)',
+                default=None)
         parser.add_argument('--hub', dest='hub', action='store',
                 help='Try other hubs if apihub is not working', default=None)
         parser.add_argument('--auto', dest='auto', action='store',
@@ -71,6 +80,24 @@ def get_args():
         parser.add_argument('--unzip', dest='unzip', action='store',
                 help=('Determines whether complete downloaded products are '
                 'unzipped.'), choices=['y','n'], default='y')
+        parser.add_argument('--workers', dest='workers', action='store',
+                type=int, help=('Number of files downloaded at the same time '
+                '(default={}, the limit of the hubs per account)').format(
+                transfer.WORKERS), default=transfer.WORKERS)
+        parser.add_argument('--segments', dest='segments', action='store',
+                type=int, help=('Number of connections each product is '
+                'downloaded over, in pieces that are resumed separately '
+                '(default={}). Each one counts against the limit of the hub.'
+                ).format(transfer.SEGMENTS), default=transfer.SEGMENTS)
+        parser.add_argument('--catalog', dest='catalog', action='store',
+                type=str, help=('SQLite catalog of the products found and '
+                'downloaded, from which --auto runs continue (default='
+                '<write_dir>/{}). Products it lists as downloaded are not '
+                'checked on disk again.').format(catalog.CATALOG_FILE),
+                default=None)
+        parser.add_argument('--query_workers', dest='query_workers',
+                action='store', type=int, help=('Number of pages of query '
+                'results requested at the same time (default=1)'), default=1)
 
         #
         # Location related commands
@@ -136,13 +163,30 @@ def get_args():
                 type=str, help='Sentinel-2 product (e.g. S2MSI1C, S2MSI2Ap)',
                 default='S2MSI1C')
 
+        #
+        # Profiling.
+        #
+        parser.add_argument('--profile', dest='profile', action='store',
+                type=str, help='Directory to save cProfile stats, sampled '
+                'stacks and tracemalloc reports of each product to',
+                default=None)
+
         return parser.parse_args()
 
 
 def kml_api(tile):
 
-    '''This function returns the center point of a defined S2 tile based on an
-        API developed by M. Sudmanns, or from the kml file if request fails.'''
+    '''This function returns the center point of a defined S2 tile from the
+        tile index of the kml file, or from an API developed by M. Sudmanns
+        if neither is available.'''
+
+    #
+    # The tile index answers offline, so the API is only asked without it.
+    #
+    if (os.path.exists(tilegrid.INDEX_FILE)
+            or os.path.exists(tilegrid.KML_FILE)):
+
+        return tile_coords(tile, 'point')
 
     #
     # Formulate request and get it.
@@ -172,7 +216,7 @@ def kml_api(tile):
             result = {"status": "FAIL"}
 
     #
-    # Extract lat, lon from API request, or try to get from file if failed.
+    # Extract lat, lon from API request, or quit asking for the kml file.
     #
     if result["status"] == "OK" and result["data"]:
 
@@ -191,8 +235,7 @@ def check_kml():
 
     ''' Checks for existance of ESA kml file, and quits if not available.'''
 
-    kml_file = ('S2A_OPER_GIP_TILPAR_MPC__20151209T095117_V20150622T000000'
-        '_21000101T000000_B00.kml')
+    kml_file = tilegrid.KML_FILE
 
     if os.path.exists(kml_file) is False:
 
@@ -208,91 +251,38 @@ def check_kml():
     return kml_file
 
 
-def tile_coords(tile, form):
-
-    '''Returns polygon or center point coordinates for a tile from the kml.'''
-
-    #
-    # Check for kml file.
-    #
-    kml_file = check_kml()
-
-    print '\n------------------------------------------------------------------'
-    print 'Hold on while we check the kml for the tile\'s coordinates!'
-
-    #
-    # Create element tree of all tiles in the kml file.
-    #
-    tree = etree.parse(kml_file)
+def tile_grid():
 
-    #
-    # Get all placemarks (i.e. tiles).
-    #
-    placemarks = tree.findall('.//{http://www.opengis.net/kml/2.2}Placemark')
-    coords = []
+    '''Returns the tile index of the kml file, compiled from the kml the first
+        time (see tilegrid.py), and quits if neither is available.'''
 
-    #
-    # Iterate through the attributes within each placemark.
-    #
-    for attributes in placemarks:
+    if not os.path.exists(tilegrid.INDEX_FILE):
 
-        for subAttribute in attributes:
+        check_kml()
 
-            #
-            # Iterate through the names of each placemark.
-            #
-            name = attributes.find('.//{http://www.opengis.net/kml/2.2}name')
+    return tilegrid.open_grid(tilegrid.KML_FILE, tilegrid.INDEX_FILE)
 
-            #
-            # If the name is the same as the defined tile, get coordinates,
-            # either the polygon or center point.
-            #
-            if name.text == tile and form == 'polygon':
 
-                #
-                # Find the polygon tag.
-                #
-                points = attributes.find('.//{http://www.opengis.net/kml/2.2}'
-                    'Polygon')
-                #
-                # Access and return the tile's polygon coordinates.
-                #
-                for unit in points:
+def tile_coords(tile, form):
 
-                    xyz = attributes.find('.//{http://www.opengis.net/kml/2.2}'
-                        'coordinates').text
-                    xyz = xyz.strip('\t\n\r')
+    '''Returns polygon or center point coordinates for a tile from the tile
+        index of the kml, as [longitude, latitude] lists.'''
 
-                    #
-                    # Original form: ['longitude,latitude,vertical', ... ]
-                    #
-                    coords = (xyz).split(' ')
+    grid = tile_grid()
 
-                    point1 = coords[0].split(',')
-                    point2 = coords[1].split(',')
-                    point3 = coords[2].split(',')
-                    point4 = coords[3].split(',')
-                    point5 = coords[4].split(',')
+    try:
 
-                    return point1, point2, point3, point4, point5
+        if form == 'polygon':
 
+            coords = grid.outline(tile)
 
-            elif name.text == tile and form == 'point':
-                #
-                # Find the center point tag.
-                #
-                points = attributes.find('.//{http://www.opengis.net/kml/2.2}'
-                    'Point')
+        else:
 
-                for unit in points:
+            coords = grid.center(tile)
 
-                    #
-                    # Save the center point values as a list.
-                    # Form: ['longitude,latitude,vertical', ... ]
-                    #
-                    coords = (unit.text).split(',')
+    finally:
 
-                    return coords
+        grid.close()
 
     if not coords:
 
@@ -300,6 +290,15 @@ def tile_coords(tile, form):
 
         sys.exit(-1)
 
+    if form == 'polygon':
+
+        #
+        # The first five points close the outline of the tile.
+        #
+        return tuple([lon, lat] for lon, lat in coords[:5])
+
+    return list(coords)
+
 
 def validate_date(date_text):
 
@@ -360,6 +359,19 @@ def create_query():
 
                 geom = 'point'
 
+                #
+                # Name the tiles at the point, if the tile index is there.
+                #
+                if (os.path.exists(tilegrid.INDEX_FILE)
+                        or os.path.exists(tilegrid.KML_FILE)):
+
+                    grid = tile_grid()
+                    tiles = grid.at(float(options.lon), float(options.lat))
+                    grid.close()
+
+                    print '\nTiles at the point: {}\n'.format(
+                        ' '.join(tiles) or 'none')
+
             else:
 
                 geom = None
@@ -385,19 +397,19 @@ def create_query():
 
     #
     # Create spatial parts of the query ::: point, rectangle or location name
-    # Beware of the quotation marks. For some reason the double quotes alone are
-    # not registered by the data hub, so they seem to need to be done this way.
+    # The query is sent by requests, so the double quotes need no escaping
+    # from the shell, as they did with wget.
     #
     if geom == 'point':
 
-        query += '(footprint:\\"Intersects({} {})\\")'.format(
+        query += '(footprint:"Intersects({} {})")'.format(
             options.lon, options.lat)
 
     elif geom == 'rectangle':
 
-        query += ('(footprint:\\"Intersects(POLYGON(({lonmin} {latmin}, '
+        query += ('(footprint:"Intersects(POLYGON(({lonmin} {latmin}, '
             '{lonmax} {latmin}, {lonmax} {latmax}, {lonmin} {latmax}, '
-            '{lonmin} {latmin})))\\")').format(latmin = options.latmin,
+            '{lonmin} {latmin})))")').format(latmin = options.latmin,
             latmax = options.latmax, lonmin = options.lonmin,
             lonmax = options.lonmax)
 
@@ -603,9 +615,24 @@ def create_query():
         pass
 
 
+    options.sync_query = None
+
     if options.auto is not None:
 
-        query += (' AND (ingestionDate:[ NOW-60DAYS TO NOW ])')
+        #
+        # Only ask for products ingested since the last run of the same query,
+        # as recorded in the catalog, or within the last 60 days.
+        #
+        options.sync_query = query
+        since = product_catalog.since(query)
+
+        if since is None:
+
+            query += (' AND (ingestionDate:[ NOW-60DAYS TO NOW ])')
+
+        else:
+
+            query += (' AND (ingestionDate:[{} TO NOW ])').format(since)
 
     elif options.start_date is not None or options.end_date is not None:
 
@@ -665,6 +692,8 @@ def start_session():
     #
     # Set data source (apihub vs dhus -- more could be added).
     #
+    options.page_rows = hubsearch.PAGE_ROWS
+
     if options.hub is None:
 
         huburl = 'https://scihub.copernicus.eu/apihub/'
@@ -674,13 +703,11 @@ def start_session():
         huburl = 'https://scihub.copernicus.eu/dhus/'
 
         #
-        # The dhus data hub has a limit of 10 records.
+        # The dhus data hub has a limit of 10 records per request.
         #
-        if int(options.MaxRecords) > 10:
-
-            print 'Max records changed to 10 due to dhus limit.'
+        print 'Results are requested 10 at a time due to dhus limit.'
 
-            options.MaxRecords = '10'
+        options.page_rows = 10
 
     elif options.hub == 'zamg':
 
@@ -720,67 +747,91 @@ def start_session():
         passwd = raw_input('Password: ')
 
     #
-    # Start session/authorization using requests module.
+    # Start session/authorization using requests module, keeping connections
+    # alive for the concurrent downloads.
     #
-    session = requests.Session()
-    session.auth = (account, passwd)
+    session = transfer.open_session(account, passwd,
+        options.workers * options.segments)
 
     return session, huburl, account, passwd
 
 
-def set_wget_var():
+def set_download_var():
 
     #
-    # Set wget query variables used throughout the script.
+    # Set query variables used throughout the script.
     #
     url_search = '{}search?q='.format(huburl)
+    value = '$value'
 
-    # Don't validate server's certificate and don't wait for authorization
-    # challenge from server.
-    wg = 'wget --quiet --no-check-certificate --auth-no-challenge'
-    auth = '--http-user="{}" --http-password="{}"'.format(account, passwd)
-    search_output = ' --output-document=query_results.xml'
-    wg_opt = ' --continue --tries=20 --read-timeout=60 --output-document='
-    value='\\$value'
+    return url_search, value
 
-    return url_search, wg, auth, search_output, wg_opt, value
 
+def fetch_file(link, path):
 
-def get_query_xml():
+    ''' Downloads one file of a product, logging and raising errors. Runs in
+       the download pool.'''
 
-    #
-    # Initialize command variable.
-    #
-    command_wget = None
+    try:
+        transfer.fetch(session, link, path)
 
-    #
-    # Check for existing xml query file and delete if present.
-    #
-    if os.path.exists('query_results.xml'):
+    except (requests.exceptions.RequestException, IOError) as e:
+        logging.error(str(e) + " in getting " + os.path.basename(path) +
+            " from " + link + " in " + os.path.dirname(path))
+
+        raise
 
-        os.remove('query_results.xml')
+
+def get_query_xml():
 
     #
-    # Execute command to download and save query as xml-file in the same location
-    # as the python script.
+    # Query the hub page by page, parsing the results in memory. The entry
+    # tag contains the results.
     #
-    command_wget = '{} {} {} "{}{}&rows={}"'.format(
-        wg, auth, search_output, url_search, query, options.MaxRecords, options.orderby)
+    query_link = '{}{}'.format(url_search, query)
 
-    print command_wget
+    print '{}{}'.format(query_link, options.orderby)
 
     try:
-        os.system(command_wget)
+        entries = hubsearch.search(session, query_link, options.page_rows,
+            options.MaxRecords, options.query_workers, options.orderby)
 
-    except Exception as e:
+    except (requests.exceptions.RequestException, IOError,
+            etree.ParseError) as e:
         logging.error(str(e) + " in getting " + query +
-            " from " + command_wget)
+            " from " + query_link)
+        print 'Query failed: {}'.format(e)
+        entries = []
+
+    else:
+        #
+        # Record the results, and the newest ingestion date of the query if
+        # no results were left out.
+        #
+        product_catalog.add(entries, options.sync_query)
+
+        if (options.sync_query is not None
+                and (options.MaxRecords is None
+                or len(entries) < options.MaxRecords)):
+
+            product_catalog.synced(options.sync_query, entries)
 
     #
-    # Parse the xml query file. The entry tag contains the results.
+    # Add the products found by earlier runs of the query that are not
+    # downloaded yet.
     #
-    tree = etree.parse('query_results.xml')
-    entries = tree.findall('{http://www.w3.org/2005/Atom}entry')
+    if options.sync_query is not None:
+
+        found = set(hubsearch.entry_uuid(entry) for entry in entries)
+        pending = [entry for entry in product_catalog.pending(options.sync_query)
+            if hubsearch.entry_uuid(entry) not in found]
+
+        if pending:
+
+            print '\n{} products found by earlier queries are not downloaded yet.'.format(
+                len(pending))
+
+        entries = pending + entries
 
     #
     # Save the number of scenes to a variable.
@@ -887,7 +938,7 @@ def get_query_xml():
         #
         # Check if file was already downloaded.
         #
-        check = download_check(options.write_dir, title_element, filename)
+        check = is_downloaded(uuid_element, title_element, filename)
 
         if check is True:
 
@@ -1091,6 +1142,56 @@ def download_check(write_dir, title_element, filename):
         return False
 
 
+def is_downloaded(uuid_element, title_element, filename):
+
+    ''' Function checks in the catalog and, if it does not know, on disk
+       (see download_check) if a product has already been downloaded.'''
+
+    if product_catalog.state(uuid_element) == catalog.DOWNLOADED:
+
+        print '{} already downloaded according to the catalog.'.format(
+            title_element)
+
+        return True
+
+    check = download_check(options.write_dir, title_element, filename)
+
+    if check is True:
+
+        product_catalog.set_state(uuid_element, catalog.DOWNLOADED)
+
+    return check
+
+
+def product_checksum(uuid_element):
+
+    ''' Function returns the checksum of a product given by the hub (e.g.
+       'MD5:...'), or None.'''
+
+    product_link = "{}odata/v1/Products('{}')".format(huburl, uuid_element)
+    dataservices = '{http://schemas.microsoft.com/ado/2007/08/dataservices}'
+
+    try:
+        response = session.get(product_link, timeout=transfer.TIMEOUT)
+        response.raise_for_status()
+        product_tree = etree.fromstring(response.content)
+
+    except (requests.exceptions.RequestException, IOError,
+            etree.ParseError):
+        return None
+
+    algorithm = product_tree.find('.//{0}Checksum/{0}Algorithm'.format(
+        dataservices))
+    checksum = product_tree.find('.//{0}Checksum/{0}Value'.format(
+        dataservices))
+
+    if algorithm is None or checksum is None:
+
+        return None
+
+    return '{}:{}'.format(algorithm.text, checksum.text)
+
+
 def return_header(uuid_element, filename):
 
     ''' Function returns name of header xml incldued in a product.'''
@@ -1151,12 +1252,7 @@ def make_dir(location, filename):
 def get_tile_files(uuid_element, filename, tile_file, tile_dir):
 
     ''' Creates structure for tile specific download (tile inside GRANULE
-       folder), and fills it.'''
-
-    #
-    # Initialize command variable.
-    #
-    command_wget = None
+       folder), and fills it. The files are downloaded by the pool.'''
 
     #
     # Define link to tile folder in data hub.
@@ -1198,16 +1294,8 @@ def get_tile_files(uuid_element, filename, tile_file, tile_dir):
             tile_xml_file = tile_entry_title
             tile_xml_link = '{}/{}'.format(tile_entry_id, value)
 
-            command_wget = '{} {} {}{}/{} "{}"'.format(wg, auth, wg_opt,
-                tile_dir, tile_xml_file, tile_xml_link)
-
-            try:
-                os.system(command_wget)
-
-            except Exception as e:
-                logging.error(str(e) + " in getting " + tile_xml_file +
-                    " from " + tile_xml_link + " in " + tile_dir)
-                continue
+            downloads.submit(tile_dir, fetch_file, tile_xml_link,
+                os.path.join(tile_dir, tile_xml_file))
 
         else:
 
@@ -1215,18 +1303,15 @@ def get_tile_files(uuid_element, filename, tile_file, tile_dir):
             # Create folder for files and go get them
             #
             inside_folder_dir = make_dir(tile_dir, tile_entry_title)
-            get_inside_files(inside_folder_dir, tile_entry_id)
+            get_inside_files(inside_folder_dir, tile_entry_id, tile_dir)
 
 
-def get_inside_files(inside_folder_dir, tile_entry_id):
+def get_inside_files(inside_folder_dir, tile_entry_id, tile_dir):
 
     ''' Go deeper in the element tree and download contents to the specified
        folder. This is relevant for tile specific downloads in the old file
-       structure, pre-06.12.16.'''
-    #
-    # Initialize command variables.
-    #
-    command_wget = None
+       structure, pre-06.12.16. The files are downloaded by the pool, named
+       after the tile folder.'''
 
     #
     # Get xml link and connect to server, parsing response as a string.
@@ -1253,24 +1338,136 @@ def get_inside_files(inside_folder_dir, tile_entry_id):
         inside_entry_file = inside_entry_title
         inside_entry_link = '{}/{}'.format(inside_entry_id, value)
 
-        command_wget = '{} {} {}{}/{} "{}"'.format(wg, auth, wg_opt,
-            inside_folder_dir, inside_entry_file, inside_entry_link)
+        downloads.submit(tile_dir, fetch_file, inside_entry_link,
+            os.path.join(inside_folder_dir, inside_entry_file))
 
-        try:
-            os.system(command_wget)
 
-        except Exception as e:
-            logging.error(str(e) + " in getting " + inside_entry_file +
-                " from " + inside_entry_link + " in " + inside_folder_dir)
-            continue
+def download_product(entry, uuid_element, title_element, filename,
+        sentinel_link):
 
+    ''' Downloads the zip of a whole product (or, post 06.12.16, of a tile
+       package) to the write directory, over options.segments connections,
+       and unzips it. Runs in the download pool; errors are recorded in the
+       catalog and raised.'''
 
-def download_results(entries):
+    zfile = '{}.zip'.format(title_element)
+    unzipped_path = os.path.join(options.write_dir, filename)
+    zipped_path = os.path.join(options.write_dir, zfile)
 
     #
-    # Initialize command variables.
+    # Execute download, saving to defined directory (default = ./tempS2).
     #
-    command_wget = None
+    stage = metrics.Stage('download', product=title_element)
+    stage.start()
+    product_profile = profiling.profile('download_' + title_element).start()
+
+    #
+    # Any error (of the transfer, the rename of the .part file or the unzip,
+    # e.g. a full disk) closes the stage and the profile and marks the product
+    # as failed in the catalog before it is raised.
+    #
+    try:
+        transfer.fetch_segmented(session, sentinel_link, zipped_path,
+            options.segments, name=zfile)
+
+        transfer.report('Downloaded Scene #{}: {}'.format(str(entry + 1),
+            zfile))
+
+        #
+        # Unzip.
+        #
+        if os.path.exists(zipped_path):
+            stage.add('bytes', os.path.getsize(zipped_path))
+
+        if options.unzip == 'y':
+
+            with zipfile.ZipFile(zipped_path) as z:
+
+                if (sys.platform.startswith('linux')
+                        or sys.platform.startswith('darwin')):
+
+                    z.extractall(u'{}'.format(options.write_dir))
+
+                else:
+
+                    z.extractall(u'\\\\?\\{}'.format(options.write_dir))
+
+                transfer.report('Unzipped Scene #{}'.format(str(entry + 1)))
+
+        elif options.unzip == 'n':
+
+            transfer.report('Scene #{} remains unzipped'.format(
+                str(entry + 1)))
+
+    except Exception as e:
+
+        if isinstance(e, zipfile.BadZipfile):
+            transfer.report('Zipfile corrupt or hub might have a problem.')
+        logging.error(str(e) + " in getting " + zfile +
+            " from " + sentinel_link + " in " + options.write_dir)
+        product_profile.stop()
+        stage.finish('error')
+        product_catalog.set_state(uuid_element, catalog.FAILED)
+
+        raise
+
+    product_profile.stop()
+    stage.finish()
+
+    product_catalog.set_state(uuid_element, catalog.DOWNLOADED,
+        product_checksum(uuid_element))
+
+    #
+    # If the unzipped and zipped version exist, delete the zipped version.
+    #
+    if (os.path.exists(unzipped_path) and os.path.exists(zipped_path)):
+
+        os.remove(zipped_path)
+
+
+def finish_downloads(tile_dirs=()):
+
+    ''' Waits for all queued downloads and reports the failed ones. Tile
+       folders (pre-06.12.16 products) are given as (folder, message) pairs:
+       the message is printed if all files of the tile were downloaded, and
+       otherwise the folder is removed, so the next run downloads it again.'''
+
+    errors = downloads.wait()
+    failed = []
+
+    for name, e in errors:
+
+        if name not in failed:
+
+            failed.append(name)
+
+        print 'Download failed: {} ({})'.format(os.path.basename(name), e)
+
+    for tile_dir, message in tile_dirs:
+
+        if tile_dir in failed:
+
+            shutil.rmtree(tile_dir, ignore_errors=True)
+
+        else:
+
+            print message
+
+    print '\n------------------------------------------------------------------'
+
+    if failed:
+
+        print 'Downloading finished, {} failed! See log/collector.log.'.format(
+            len(failed))
+
+    else:
+
+        print 'Downloading complete!'
+
+    print '------------------------------------------------------------------\n'
+
+
+def download_results(entries):
 
     #
     # Create download directory if not already existing (default = ./tempS2)
@@ -1286,12 +1483,13 @@ def download_results(entries):
     if (options.tile is None or options.tile == '?'):
 
         #
-       	# Download all whole scenes matching the query.
+       	# Download all whole scenes matching the query, up to options.workers
+        # at the same time.
         #
         for entry in range(len(entries)):
 
             #
-            # Create download command for the entry.
+            # Create download link for the entry.
             #
             uuid_element = (entries[entry].find('{http://www.w3.org/2005/Atom}'
                 'id')).text
@@ -1300,73 +1498,22 @@ def download_results(entries):
             filename = (entries[entry].find('.//*[@name="filename"]')).text
             title_element = (entries[entry].find('{http://www.w3.org/2005/Atom}'
                 'title')).text
-            zfile = '{}.zip'.format(title_element)
 
             #
             # Skip files that have already been downloaded.
             #
-            check = download_check(options.write_dir, title_element, filename)
+            check = is_downloaded(uuid_element, title_element, filename)
 
             if check is True:
 
                 continue
 
             else:
-                #
-                # Save to defined directory (default = ./tempS2)
-                #
-                command_wget = '{} {} {}{}/{} "{}"'.format(wg, auth, wg_opt,
-                    options.write_dir, zfile, sentinel_link)
 
-                #
-                # Execute download.
-                #
-                try:
-                    os.system(command_wget)
-
-                except Exception as e:
-                    logging.error(str(e) + " in getting " + zfile +
-                        " from " + sentinel_link + " in " + options.write_dir)
-                    continue
-
-                print 'Downloaded Scene #{}: {}'.format(str(entry + 1), zfile)
-
-                #
-                # Unzip.
-                #
-                unzipped_path = os.path.join(options.write_dir, filename)
-                zipped_path = os.path.join(options.write_dir, zfile)
-
-                if options.unzip == 'y':
-
-                    try:
-
-                        with zipfile.ZipFile(zipped_path) as z:
-
-                            z.extractall(u'{}'.format(options.write_dir))
-
-                            print 'Unzipped Scene #{}'.format(str(entry + 1))
-
-                    except zipfile.BadZipfile:
+                downloads.submit(title_element, download_product, entry,
+                    uuid_element, title_element, filename, sentinel_link)
 
-                        print 'Zipfile corrupt or hub might have a problem.'
-
-                        continue
-
-                elif options.unzip == 'n':
-
-                    print 'Scene #{} remains unzipped'.format(str(entry + 1))
-
-                #
-                # If the unzipped and zipped version exist, delete the zipped version.
-                #
-                if (os.path.exists(unzipped_path) and os.path.exists(zipped_path)):
-
-                    os.remove(zipped_path)
-
-        print '\n------------------------------------------------------------------'
-        print 'Downloading complete!'
-        print '------------------------------------------------------------------\n'
+        finish_downloads()
 
     #
     # If you want to download a tile that you searched for, then it will
@@ -1377,12 +1524,15 @@ def download_results(entries):
     elif options.tile is not None and options.tile is not '?':
 
         #
-       	# Search through entries for matching tiles.
+       	# Search through entries for matching tiles. The files of all tiles
+        # are queued, and the tile folders reported once they are done.
         #
+        tile_dirs = []
+
         for entry in range(len(entries)):
 
             #
-            # Create download command for the entry.
+            # Create download link for the entry.
             #
             uuid_element = (entries[entry].find('{http://www.w3.org/2005/Atom}'
                 'id')).text
@@ -1448,15 +1598,8 @@ def download_results(entries):
                 header_link = "{}('{}')/{}".format(
                     sentinel_link, header_file, value)
 
-                command_wget = '{} {} {}{}/{} "{}"'.format(wg, auth, wg_opt,
-                    product_dir_name, header_file, header_link)
-
-                try:
-                    os.system(command_wget)
-
-                except Exception as e:
-                    logging.error(str(e) + " in getting " + header_file +
-                        " from " + header_link + " in " + product_dir_name)
+                downloads.submit(tile_dir, fetch_file, header_link,
+                    os.path.join(product_dir_name, header_file))
 
                 #
                 # Download INSPIRE.xml
@@ -1464,15 +1607,9 @@ def download_results(entries):
                 inspire_file = 'INSPIRE.xml'
                 inspire_link = "{}('{}')/{}".format(
                     sentinel_link, inspire_file, value)
-                command_wget = '{} {} {}{}/{} "{}"'.format(wg, auth, wg_opt,
-                    product_dir_name, inspire_file, inspire_link)
-
-                try:
-                    os.system(command_wget)
 
-                except Exception as e:
-                    logging.error(str(e) + " in getting " + inspire_file +
-                        " from " + inspire_link + " in " + product_dir_name)
+                downloads.submit(tile_dir, fetch_file, inspire_link,
+                    os.path.join(product_dir_name, inspire_file))
 
                 #
                 # Download manifest.safe
@@ -1480,15 +1617,9 @@ def download_results(entries):
                 manifest_file = 'manifest.safe'
                 manifest_link = "{}('{}')/{}".format(
                     sentinel_link, manifest_file, value)
-                command_wget = '{} {} {}{}/{} "{}"'.format(wg, auth, wg_opt,
-                    product_dir_name, manifest_file, manifest_link)
 
-                try:
-                    os.system(command_wget)
-
-                except Exception as e:
-                    logging.error(str(e) + " in getting " + manifest_file +
-                        " from " + manifest_link + " in " + product_dir_name)
+                downloads.submit(tile_dir, fetch_file, manifest_link,
+                    os.path.join(product_dir_name, manifest_file))
 
                 #
                 # Download tile xml file and create AUX_DATA, IMG_DATA and QI_DATA
@@ -1496,94 +1627,48 @@ def download_results(entries):
                 #
                 get_tile_files(uuid_element, filename, tile_file, tile_dir)
 
-                print 'Downloaded tile {} from scene #{}\n{}'.format(
-                    options.tile, str(entry + 1), product_dir_name)
+                tile_dirs.append((tile_dir,
+                    'Downloaded tile {} from scene #{}\n{}'.format(
+                        options.tile, str(entry + 1), product_dir_name)))
 
             elif (options.tile in included_tiles
                     and (filename.startswith('S2A_MSIL')
                     or filename.startswith('S2B_MSIL'))):
 
                 #
-                # Create download command for the entry.
+                # Create download link for the entry.
                 #
                 sentinel_link = ("{}odata/v1/Products('{}')/{}").format(
                     huburl, uuid_element, value)
-                zfile = '{}.zip'.format(title_element)
 
                 #
                 # Skip files that have already been downloaded.
                 #
-                check = download_check(options.write_dir, title_element, filename)
+                check = is_downloaded(uuid_element, title_element, filename)
 
                 if check is True:
 
                     continue
 
                 else:
-                    #
-                    # Save to defined directory (default = ./tempS2)
-                    #
-                    command_wget = '{} {} {}{}/{} "{}"'.format(wg, auth, wg_opt,
-                        options.write_dir, zfile, sentinel_link)
-
-                    #
-                    # Execute download.
-                    #
-                    try:
-                        os.system(command_wget)
-
-                    except Exception as e:
-                        logging.error(str(e) + " in getting " + zfile +
-                            " from " + sentinel_link + " in " + options.write_dir)
-                        continue
-
-                    print 'Downloaded Scene #{}: {}'.format(
-                        str(entry + 1), zfile)
-
-                    #
-                    # Unzip the downloaded file.
-                    #
-                    unzipped_path = os.path.join(options.write_dir, filename)
-                    zipped_path = os.path.join(options.write_dir, zfile)
-
-                    if options.unzip == 'y':
-                        try:
-                            with zipfile.ZipFile(zipped_path) as z:
-
-                                if (sys.platform.startswith('linux')
-                                        or sys.platform.startswith('darwin')):
-
-                                    z.extractall(u'{}'.format(options.write_dir))
-
-                                else:
-
-                                    z.extractall(u'\\\\?\\{}'.format(options.write_dir))
-
-                                print 'Unzipped Scene #{}'.format(str(entry + 1))
-
-                        except zipfile.BadZipfile:
 
-                            print 'Zipfile corrupt or problem with hub.'
+                    downloads.submit(title_element, download_product, entry,
+                        uuid_element, title_element, filename, sentinel_link)
 
-                    elif options.unzip == 'n':
-
-                        print 'Scene #{} remains unzipped'.format(str(entry + 1))
+            else:
 
-                    #
-                    # If the unzipped and zipped version exist, delete the zipped version.
-                    #
-                    if (os.path.exists(unzipped_path) and os.path.exists(zipped_path)):
+                print '\nTile {} not in scene #{}\n'.format(
+                    options.tile, str(entry + 1))
 
-                        os.remove(zipped_path)
+                #
+                # Single tile products of other tiles are not listed as still
+                # to download by later runs.
+                #
+                if not filename.startswith('S2A_OPER_'):
 
-                    else:
+                    product_catalog.set_state(uuid_element, catalog.SKIPPED)
 
-                        print '\nTile {} not in scene #{}\n'.format(
-                            options.tile, str(entry + 1))
-
-        print '\n------------------------------------------------------------------'
-        print 'Downloading complete!'
-        print '------------------------------------------------------------------\n'
+        finish_downloads(tile_dirs)
 
 
 if __name__ == '__main__':
@@ -1593,11 +1678,22 @@ if __name__ == '__main__':
     logging.basicConfig(filename='log/collector.log',
                     format='%(asctime)s:%(levelname)s:%(message)s',
                     level=logging.DEBUG)
+    metrics.configure('log/metrics.jsonl', 'log/collector.prom', 'collector')
 
     #
     # Parse command line to get global arguments.
     #
     options = get_args()
+    profiling.configure(options.profile)
+
+    #
+    # Open the catalog of the products found by earlier queries.
+    #
+    if options.catalog is None:
+
+        options.catalog = os.path.join(options.write_dir, catalog.CATALOG_FILE)
+
+    product_catalog = catalog.open_catalog(options.catalog)
 
     #
     # Create hub query.
@@ -1610,9 +1706,11 @@ if __name__ == '__main__':
     session, huburl, account, passwd = start_session()
 
     #
-    # Set wget query variables used throughout the script.
+    # Set query variables used throughout the script, and the pool the files
+    # are downloaded with.
     #
-    url_search, wg, auth, search_output, wg_opt, value = set_wget_var()
+    url_search, value = set_download_var()
+    downloads = transfer.Pool(options.workers)
 
     #
     # Query hub, print results and ask whether to continue.
@@ -1622,11 +1720,12 @@ if __name__ == '__main__':
     if download_bool:
 
         download_results(entries)
+        downloads.close()
 
     else:
         #
         # You decided not to download this time in the message box.
         #
         print '\n------------------------------------------------------------------'
-        print 'Nothing downloaded, but xml file saved!'
+        print 'Nothing downloaded!'
         print '------------------------------------------------------------------\n'
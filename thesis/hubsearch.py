@@ -0,0 +1,147 @@
+# ------------------------------------------------------------------------------
+# Name:        Paginated OpenSearch queries of the data hubs.
+# Purpose:     Return every product matching a hub query, not only its first
+#              page. The hubs answer at most PAGE_ROWS results per request
+#              (10 on dhus), so the pages are requested with 'start=' until
+#              the total of the first page is reached, one after another or a
+#              few at a time. Each page is read completely and parsed in
+#              memory with iterparse, so a page cut off by a dropped connection
+#              is requested again, and entries already returned by an earlier
+#              page (results shift between pages while products are ingested)
+#              are dropped by their UUID.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import io
+import multiprocessing.pool
+import xml.etree.ElementTree as etree
+
+import requests
+
+import transfer
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+OPENSEARCH = '{http://a9.com/-/spec/opensearch/1.1/}'
+
+#
+# Results per page: the most the hubs answer per request.
+#
+PAGE_ROWS = 100
+
+
+def parse_page(stream):
+
+    '''
+    Parses a page of results from a file-like object as it is read. Returns
+    the total number of results of the query (None if the page lacks it) and
+    the entry elements of the page.
+    '''
+
+    total = None
+    entries = []
+
+    for event, element in etree.iterparse(stream):
+        if element.tag == ATOM + 'entry':
+            entries.append(element)
+        elif element.tag == OPENSEARCH + 'totalResults':
+            total = int(element.text)
+
+    return total, entries
+
+
+def get_page(session, search_url, start, rows, orderby='',
+             retries=transfer.RETRIES, timeout=transfer.TIMEOUT):
+
+    '''
+    Requests one page of results, retrying after a dropped connection, a
+    server error or a page that does not parse (cut off), and returns it
+    parsed (see parse_page).
+    '''
+
+    page_url = '{}&start={}&rows={}{}'.format(search_url, start, rows, orderby)
+    attempt = 0
+
+    while True:
+        try:
+            response = session.get(page_url, timeout=timeout)
+            response.raise_for_status()
+
+            #
+            # The whole page is read by requests first, which raises its own
+            # exceptions for a connection dropped while reading.
+            #
+            return parse_page(io.BytesIO(response.content))
+
+        except (requests.exceptions.RequestException, IOError,
+                etree.ParseError) as e:
+            attempt += 1
+            transfer.retry('Results {}-{}'.format(start + 1, start + rows),
+                           e, attempt, retries)
+
+
+def entry_uuid(entry):
+
+    return entry.find(ATOM + 'id').text
+
+
+def search(session, search_url, rows=PAGE_ROWS, max_results=None, workers=1,
+           orderby=''):
+
+    '''
+    Returns the entries of all results of a query (search_url ending with
+    the query, e.g. 'https://.../search?q=...'), up to max_results, without
+    duplicates. With workers > 1 the pages after the first are requested
+    that many at a time.
+    '''
+
+    if max_results is not None:
+        rows = min(rows, max_results)
+
+    total, entries = get_page(session, search_url, 0, rows, orderby)
+    pages = [entries]
+
+    if total is None:
+        #
+        # Without a total, request pages until one is not full.
+        #
+        start = rows
+        while (len(entries) == rows
+               and (max_results is None or start < max_results)):
+            total, entries = get_page(session, search_url, start, rows,
+                                      orderby)
+            pages.append(entries)
+            start += rows
+    else:
+        if max_results is not None:
+            total = min(total, max_results)
+        starts = range(rows, total, rows)
+
+        def page(start):
+            return get_page(session, search_url, start, rows, orderby)[1]
+
+        if workers > 1 and len(starts) > 1:
+            pool = multiprocessing.pool.ThreadPool(min(workers, len(starts)))
+            try:
+                pages.extend(pool.map(page, starts))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            pages.extend(page(start) for start in starts)
+
+    results = []
+    seen = set()
+    for entries in pages:
+        for entry in entries:
+            uuid = entry_uuid(entry)
+            if uuid not in seen:
+                seen.add(uuid)
+                results.append(entry)
+
+    if max_results is not None:
+        results = results[:max_results]
+
+    return results
@@ -4,6 +4,12 @@ import logging
 import datetime
 import subprocess
 
+#
+# Data inventory shared with the scripts in 'thesis'.
+#
+import thesispath
+import inventory
+
 def main(datasets):
 
     for yaml_path in datasets:
@@ -35,16 +41,19 @@ if __name__ == "__main__":
 
     # datasets = ['/data/s2/37SBA/S2A_OPER_PRD_MSIL1C_PDMC_20161007T104254_R121_V20150830T082006_20150830T082754.SAFE/datacube-metadata.yaml']
     datasets = []
-    for dirpath, dirnames, filenames in os.walk('/data/s2/', topdown=True):
-        for filename in filenames:
-            if filename.endswith('siam-metadata.yaml'):
-                #
-                # Only adds files older than 5 days.
-                #
-                test_path = os.path.join(dirpath, filename)
-                creation_time = (datetime.datetime.fromtimestamp(os.path.getmtime(test_path)))
-                now = datetime.datetime.now()
-                diff = (now-creation_time).days
-                if diff <= 6:
-                    datasets.append(os.path.join(dirpath, filename))
+    for test_path, size, mtime in inventory.open_inventory('/data/s2/').files('*siam-metadata.yaml'):
+        #
+        # Only adds files older than 5 days. The inventory finds the files,
+        # but their mtime is read again, as a yaml written again in place
+        # does not change the mtime of its folder.
+        #
+        try:
+            mtime = os.path.getmtime(test_path)
+        except OSError:
+            continue
+        creation_time = datetime.datetime.fromtimestamp(mtime)
+        now = datetime.datetime.now()
+        diff = (now-creation_time).days
+        if diff <= 6:
+            datasets.append(test_path)
     main(datasets)
@@ -21,6 +21,13 @@ import shapely.affinity
 import shapely.geometry
 import shapely.ops
 
+#
+# Tile metadata reader and profiling shared with the scripts in 'thesis'.
+#
+import thesispath
+import tilemeta
+import profiling
+
 
 # IMAGE BOUNDARY CODE
 
@@ -86,24 +93,6 @@ def _to_lists(x):
     return x
 
 
-def get_geo_ref_points(root):
-    nrows = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NROWS')[0].text)
-    ncols = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NCOLS')[0].text)
-
-    ulx = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULX')[0].text)
-    uly = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULY')[0].text)
-
-    xdim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/XDIM')[0].text)
-    ydim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/YDIM')[0].text)
-
-    return {
-        'ul': {'x': ulx, 'y': uly},
-        'ur': {'x': ulx + ncols * abs(xdim), 'y': uly},
-        'll': {'x': ulx, 'y': uly - nrows * abs(ydim)},
-        'lr': {'x': ulx + ncols * abs(xdim), 'y': uly - nrows * abs(ydim)},
-    }
-
-
 def get_coords(geo_ref_points, spatial_ref):
     t = osr.CoordinateTransformation(spatial_ref, spatial_ref.CloneGeogCS())
 
@@ -142,8 +131,8 @@ def prepare_dataset(path):
             images_sixty_list = []
             gran_path = str(path.parent.joinpath('GRANULE', granule_id, granule_id[:-7].replace('MSI', 'MTD') + '.xml'))
             if os.path.exists(gran_path):
-                root = ElementTree.parse(gran_path).getroot()
-                sensing_time = root.findall('./*/SENSING_TIME')[0].text
+                tile_metadata = tilemeta.read(gran_path)
+                sensing_time = tile_metadata['SENSING_TIME']
 
                 img_data_path = str(path.parent.joinpath('GRANULE', granule_id, 'IMG_DATA'))
                 for image in images:
@@ -161,13 +150,13 @@ def prepare_dataset(path):
                         if item in image:
                             images_sixty_list.append(os.path.join(img_data_path, image + ".jp2"))
 
-                station = root.findall('./*/Archiving_Info/ARCHIVING_CENTRE')[0].text
+                station = tile_metadata['ARCHIVING_CENTRE']
 
-                cs_code = root.findall('./*/Tile_Geocoding/HORIZONTAL_CS_CODE')[0].text
+                cs_code = tile_metadata['HORIZONTAL_CS_CODE']
                 spatial_ref = osr.SpatialReference()
                 spatial_ref.SetFromUserInput(cs_code)
 
-                geo_ref_points = get_geo_ref_points(root)
+                geo_ref_points = tilemeta.geo_ref_points(tile_metadata)
 
                 documents.append({
                 'id': str(uuid.uuid4()),
@@ -225,8 +214,8 @@ def prepare_dataset(path):
             images_sixty_list = []
 
             gran_path = str(path.parent.joinpath((os.path.dirname(os.path.dirname(images[0]))), 'MTD_TL.xml'))
-            root = ElementTree.parse(gran_path).getroot()
-            sensing_time = root.findall('./*/SENSING_TIME')[0].text
+            tile_metadata = tilemeta.read(gran_path)
+            sensing_time = tile_metadata['SENSING_TIME']
             parent_path = str(path.parent)
             for image in images:
                 ten_list = ['B02', 'B03', 'B04', 'B08']
@@ -243,13 +232,13 @@ def prepare_dataset(path):
                     if item in image:
                         images_sixty_list.append(os.path.join(parent_path, image + ".jp2"))
 
-            station = root.findall('./*/Archiving_Info/ARCHIVING_CENTRE')[0].text
+            station = tile_metadata['ARCHIVING_CENTRE']
 
-            cs_code = root.findall('./*/Tile_Geocoding/HORIZONTAL_CS_CODE')[0].text
+            cs_code = tile_metadata['HORIZONTAL_CS_CODE']
             spatial_ref = osr.SpatialReference()
             spatial_ref.SetFromUserInput(cs_code)
 
-            geo_ref_points = get_geo_ref_points(root)
+            geo_ref_points = tilemeta.geo_ref_points(tile_metadata)
 
             documents.append({
                 'id': str(uuid.uuid4()),
@@ -303,8 +292,12 @@ def prepare_dataset(path):
 @click.argument('datasets',
                 type=click.Path(exists=True, readable=True, writable=True),
                 nargs=-1)
-def main(datasets):
+@click.option('--profile', type=click.Path(file_okay=False), default=None,
+              help='Directory to save cProfile stats, sampled stacks and '
+                   'tracemalloc reports of each product to.')
+def main(datasets, profile):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+    profiling.configure(profile)
 
     for dataset in datasets:
         path = Path(dataset)
@@ -322,7 +315,8 @@ def main(datasets):
             raise RuntimeError('want xml')
 
         logging.info("Processing %s", path)
-        documents = prepare_dataset(path)
+        with profiling.profile('prepare_' + str(path.parent)):
+            documents = prepare_dataset(path)
         if documents:
             yaml_path = str(path.parent.joinpath('datacube-metadata.yaml'))
             logging.info("Writing %s dataset(s) into %s", len(documents), yaml_path)
@@ -346,4 +340,4 @@ if __name__ == "__main__":
                 datasets.append(dataset)
     # datasets = ['/data/s2/37SBA/S2A_OPER_PRD_MSIL1C_PDMC_20160714T041913_R021_V20150902T083049_20150902T083049.SAFE/']
     # datasets = ['/data/s2/37SBA/S2A_OPER_PRD_MSIL1C_PDMC_20161007T104254_R121_V20150830T082006_20150830T082754.SAFE']
-    main(datasets)
+    main(sys.argv[1:] + datasets)
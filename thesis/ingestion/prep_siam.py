@@ -12,7 +12,6 @@ import yaml
 import click
 from osgeo import osr
 import os
-import sys
 import datetime
 # image boundary imports
 import rasterio
@@ -22,6 +21,27 @@ import shapely.affinity
 import shapely.geometry
 import shapely.ops
 
+#
+# Data inventory, tile metadata reader and profiling shared with the scripts
+# in 'thesis'.
+#
+import thesispath
+import inventory
+import tilemeta
+import profiling
+
+#
+# Data root of the products. Its inventory is shared by all lookups, and
+# only the folders of the product looked up are refreshed.
+#
+DATA_ROOT = '/data/s2/'
+
+_config = {'root': DATA_ROOT}
+
+#
+# Tile folders of the root searched for products when no datasets are given.
+#
+TILE_FOLDERS = ['37SBA', '37SCA', '37SDA', '37SBU', '37SBV']
 
 # IMAGE BOUNDARY CODE
 
@@ -87,24 +107,6 @@ def _to_lists(x):
     return x
 
 
-def get_geo_ref_points(root):
-    nrows = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NROWS')[0].text)
-    ncols = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NCOLS')[0].text)
-
-    ulx = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULX')[0].text)
-    uly = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULY')[0].text)
-
-    xdim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/XDIM')[0].text)
-    ydim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/YDIM')[0].text)
-
-    return {
-        'ul': {'x': ulx, 'y': uly},
-        'ur': {'x': ulx + ncols * abs(xdim), 'y': uly},
-        'll': {'x': ulx, 'y': uly - nrows * abs(ydim)},
-        'lr': {'x': ulx + ncols * abs(xdim), 'y': uly - nrows * abs(ydim)},
-    }
-
-
 def get_coords(geo_ref_points, spatial_ref):
     t = osr.CoordinateTransformation(spatial_ref, spatial_ref.CloneGeogCS())
 
@@ -115,22 +117,19 @@ def get_coords(geo_ref_points, spatial_ref):
     return {key: transform(p) for key, p in geo_ref_points.items()}
 
 
+def product_inventory(path):
+    # Inventory of the data root, brought up to date below the product.
+    return inventory.open_inventory(_config['root'], under=str(path))
+
 def get_relevantpaths(path):
-    for dirpath, dirnames, filenames in os.walk(str(path.parent)):
-        for dirname in dirnames:
-            if dirname == 'siamoutput':
-                siamoutput = os.path.join(dirpath, dirname)
-        for filename in filenames:
-            if filename == 'datacube-metadata.yaml':
-                datacube_YAML = os.path.join(dirpath, filename)
+    inv = product_inventory(path.parent)
+    siamoutput = inv.folders('siamoutput', under=str(path.parent))[-1]
+    datacube_YAML = inv.files('datacube-metadata.yaml', under=str(path.parent))[-1][0]
     return siamoutput, datacube_YAML
 
 def get_PROC_DATA(path):
 
-    for dirpath, dirnames, filenames in os.walk(path):
-        for dirname in dirnames:
-            if dirname == 'PROC_DATA':
-                PROC_DATA =  os.path.join(dirpath, dirname)
+    PROC_DATA = product_inventory(path).folders('PROC_DATA', under=str(path))[-1]
 
     return PROC_DATA
 
@@ -144,11 +143,26 @@ def get_siamlayers(path):
             if layer in item and item.endswith('.dat'):
                 siam_dict[layer] = os.path.join('siamoutput', item)
     for item in os.listdir(os.path.dirname(path)):
-        if item.endswith('nodata.dat'):
+        if item.endswith(('nodata.dat', 'nodata.tif')):
             siam_dict['nodata'] = item
 
     return siam_dict
 
+def find_datasets(root):
+    # Products in the tile folders of the root without a SIAM metadata yaml.
+    datasets = []
+    for tile in TILE_FOLDERS:
+        folder_path = os.path.join(root, tile)
+        if not os.path.isdir(folder_path):
+            continue
+        for ds in os.listdir(folder_path):
+            dataset = os.path.join(folder_path, ds)
+            test_path = get_PROC_DATA(dataset)
+            yaml_test = Path(os.path.join(test_path, 'siam-metadata.yaml'))
+            if not yaml_test.exists():
+                datasets.append(dataset)
+    return datasets
+
 def prepare_dataset(path):
 
     root = ElementTree.parse(str(path)).getroot()
@@ -179,13 +193,13 @@ def prepare_dataset(path):
         for granule_id, images in granules.items():
             gran_path = str(path.parent.joinpath('GRANULE', granule_id, granule_id[:-7].replace('MSI', 'MTD') + '.xml'))
             if os.path.exists(gran_path):
-                root = ElementTree.parse(gran_path).getroot()
+                tile_metadata = tilemeta.read(gran_path)
 
-                sensing_time = root.findall('./*/SENSING_TIME')[0].text
-                cs_code = root.findall('./*/Tile_Geocoding/HORIZONTAL_CS_CODE')[0].text
+                sensing_time = tile_metadata['SENSING_TIME']
+                cs_code = tile_metadata['HORIZONTAL_CS_CODE']
                 spatial_ref = osr.SpatialReference()
                 spatial_ref.SetFromUserInput(cs_code)
-                geo_ref_points = get_geo_ref_points(root)
+                geo_ref_points = tilemeta.geo_ref_points(tile_metadata)
 
                 documents.append({
                 'id': str(uuid.uuid4()),
@@ -228,13 +242,13 @@ def prepare_dataset(path):
         for granule_id, images in granules.items():
 
             gran_path = str(path.parent.joinpath((os.path.dirname(os.path.dirname(images[0]))), 'MTD_TL.xml'))
-            root = ElementTree.parse(gran_path).getroot()
+            tile_metadata = tilemeta.read(gran_path)
 
-            sensing_time = root.findall('./*/SENSING_TIME')[0].text
-            cs_code = root.findall('./*/Tile_Geocoding/HORIZONTAL_CS_CODE')[0].text
+            sensing_time = tile_metadata['SENSING_TIME']
+            cs_code = tile_metadata['HORIZONTAL_CS_CODE']
             spatial_ref = osr.SpatialReference()
             spatial_ref.SetFromUserInput(cs_code)
-            geo_ref_points = get_geo_ref_points(root)
+            geo_ref_points = tilemeta.geo_ref_points(tile_metadata)
 
             documents.append({
                 'id': str(uuid.uuid4()),
@@ -275,8 +289,27 @@ def prepare_dataset(path):
 @click.argument('datasets',
                 type=click.Path(exists=True, readable=True, writable=True),
                 nargs=-1)
-def main(datasets):
+@click.option('--profile', type=click.Path(file_okay=False), default=None,
+              help='Directory to save cProfile stats, sampled stacks and '
+                   'tracemalloc reports of each product to.')
+@click.option('--root', type=click.Path(exists=True, file_okay=False),
+              default=DATA_ROOT,
+              help='Data root holding the datasets, whose inventory is used. '
+                   'Without datasets, the products of its tile folders that '
+                   'have no SIAM metadata yet are prepared.')
+def main(datasets, profile, root):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+    profiling.configure(profile)
+    _config['root'] = root
+
+    if not datasets:
+        datasets = find_datasets(root)
+
+    for dataset in datasets:
+        if not os.path.abspath(dataset).startswith(
+                os.path.join(os.path.abspath(root), '')):
+            raise click.BadParameter(
+                '{} is not below the data root {}.'.format(dataset, root))
 
     for dataset in datasets:
         path = Path(dataset)
@@ -294,7 +327,8 @@ def main(datasets):
             raise RuntimeError('want xml')
 
         logging.info("Processing %s", path)
-        documents = prepare_dataset(path)
+        with profiling.profile('prepare_' + str(path.parent)):
+            documents = prepare_dataset(path)
         print(documents)
         #
         # BE sure to save in PROC_DATA folder.
@@ -310,17 +344,6 @@ def main(datasets):
 
 
 if __name__ == "__main__":
-    root_folder = '/data/s2/'
-    granule_folders = ['37SBA', '37SCA', '37SDA', '37SBU', '37SBV']
-    datasets = []
-    for tile in granule_folders:
-        folder_path = os.path.join(root_folder, tile)
-        for ds in os.listdir(folder_path):
-            dataset = os.path.join(folder_path, ds)
-            test_path = get_PROC_DATA(dataset)
-            yaml_test = Path(os.path.join(test_path, 'siam-metadata.yaml'))
-            if not yaml_test.exists():
-                datasets.append(dataset)
     # datasets = ['/data/s2/37SBA/S2A_OPER_PRD_MSIL1C_PDMC_20160714T041913_R021_V20150902T083049_20150902T083049.SAFE/']
     # datasets = ['/data/s2/37SBA/S2A_OPER_PRD_MSIL1C_PDMC_20161007T104254_R121_V20150830T082006_20150830T082754.SAFE']
-    main(datasets)
+    main()
@@ -0,0 +1,19 @@
+# ------------------------------------------------------------------------------
+# Name:        Path of the shared modules.
+# Purpose:     Make the modules in 'thesis' (data inventory, tile metadata
+#              reader, profiling) importable by the ingestion scripts, which
+#              import this module before them, instead of each changing
+#              sys.path itself.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import sys
+
+THESIS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if THESIS_DIR not in sys.path:
+    sys.path.insert(0, THESIS_DIR)
@@ -0,0 +1,323 @@
+# ------------------------------------------------------------------------------
+# Name:        Inventory of a Sentinel-2 data folder.
+# Purpose:     Keep the folders and files below a data root (e.g. /data/s2/)
+#              with their sizes and mtimes in a SQLite file in the root, so
+#              the scripts can look up products, granules and IMG_DATA,
+#              PROC_DATA and siamoutput folders without walking the whole
+#              tree every time. A refresh only stats the known folders and
+#              lists again those whose mtime has changed, i.e. where entries
+#              were added, removed or renamed. Files in PROC_DATA and
+#              siamoutput folders are stat'ed on every refresh, as their
+#              sizes change while they are written. A refresh costs one stat
+#              per known folder (tens of thousands for a large root), so
+#              callers that only need one product refresh the folders below
+#              it only.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import stat
+import sqlite3
+
+#
+# Name of the inventory database in the data root.
+#
+INVENTORY_FILE = '.s2_inventory.sqlite'
+
+#
+# Folders whose files are stat'ed again on every refresh.
+#
+RESTAT_FOLDERS = ('PROC_DATA', 'siamoutput')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    name TEXT,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS dirs_name ON dirs (name);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS files_parent ON files (parent);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+'''
+
+#
+# Inventories already opened and refreshed by this process.
+#
+_OPEN = {}
+
+
+class Inventory(object):
+
+    '''
+    Inventory of the folders and files below a root folder.
+    '''
+
+    def __init__(self, root, db_path=None):
+
+        self.root = os.path.abspath(root)
+        if db_path is None:
+            db_path = os.path.join(self.root, INVENTORY_FILE)
+
+        try:
+            self.db = self._connect(db_path)
+        except sqlite3.DatabaseError:
+            #
+            # Read-only root or broken database: keep the inventory in
+            # memory for this run, which works like a full walk.
+            #
+            self.db = self._connect(':memory:')
+
+    @staticmethod
+    def _connect(db_path):
+
+        db = sqlite3.connect(db_path, timeout=60)
+        db.text_factory = str
+
+        #
+        # The default rollback journal keeps the database intact if a run is
+        # killed during a write. The journal file changes the mtime of the
+        # root, which only costs a listing of the root on the next refresh
+        # (the database files themselves are left out of the inventory).
+        #
+        db.executescript(SCHEMA)
+
+        return db
+
+    def refresh(self, under=None):
+
+        '''
+        Brings the inventory up to date with the folder tree, or only with
+        the folders below a folder (and the folder itself). A folder new to
+        the inventory is scanned.
+        '''
+
+        if under is None:
+            known = self.db.execute(
+                'SELECT path, name, mtime FROM dirs').fetchall()
+        else:
+            under = os.path.abspath(under)
+            condition, args = self._under(under)
+            known = self.db.execute(
+                'SELECT path, name, mtime FROM dirs WHERE path = ? OR (1' +
+                condition + ')', (under,) + args).fetchall()
+
+        if not known:
+            self._scan(self.root if under is None else under)
+        else:
+            for path, name, mtime in sorted(known):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    self._forget(path)
+                    continue
+                if st.st_mtime != mtime:
+                    self._rescan(path, st.st_mtime)
+                elif name in RESTAT_FOLDERS:
+                    self._restat_files(path)
+        self.db.commit()
+
+        return self
+
+    def _entries(self, path):
+
+        '''
+        Lists a folder, returning (name, lstat) of every entry that can be
+        stat'ed. The inventory database itself is left out.
+        '''
+
+        entries = []
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return entries
+        for name in names:
+            if name.startswith(INVENTORY_FILE):
+                continue
+            try:
+                entries.append((name, os.lstat(os.path.join(path, name))))
+            except OSError:
+                continue
+
+        return entries
+
+    def _scan(self, path):
+
+        '''
+        Adds a folder and everything below it. Symbolic links are not
+        followed, as with os.walk.
+        '''
+
+        todo = [path]
+        while todo:
+            current = todo.pop()
+            try:
+                st = os.stat(current)
+            except OSError:
+                continue
+            self.db.execute(
+                'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                (current, os.path.dirname(current), os.path.basename(current),
+                 st.st_mtime))
+            for name, entry in self._entries(current):
+                entry_path = os.path.join(current, name)
+                if stat.S_ISDIR(entry.st_mode):
+                    todo.append(entry_path)
+                else:
+                    self._add_file(entry_path, current, name, entry)
+
+    def _add_file(self, path, parent, name, entry):
+
+        self.db.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+            (path, parent, name, entry.st_size, entry.st_mtime))
+
+    def _rescan(self, path, mtime):
+
+        '''
+        Lists a changed folder again: new sub-folders are scanned, removed
+        entries are dropped and its files are stat'ed again.
+        '''
+
+        subdirs = set(row[0] for row in self.db.execute(
+            'SELECT path FROM dirs WHERE parent = ?', (path,)))
+        self.db.execute('DELETE FROM files WHERE parent = ?', (path,))
+
+        present = set()
+        for name, entry in self._entries(path):
+            entry_path = os.path.join(path, name)
+            if stat.S_ISDIR(entry.st_mode):
+                present.add(entry_path)
+                if entry_path not in subdirs:
+                    self._scan(entry_path)
+            else:
+                self._add_file(entry_path, path, name, entry)
+
+        for subdir in subdirs - present:
+            self._forget(subdir)
+
+        self.db.execute('UPDATE dirs SET mtime = ? WHERE path = ?',
+                        (mtime, path))
+
+    def _restat_files(self, path):
+
+        for file_path, name in self.db.execute(
+                'SELECT path, name FROM files WHERE parent = ?',
+                (path,)).fetchall():
+            try:
+                entry = os.lstat(file_path)
+            except OSError:
+                self.db.execute('DELETE FROM files WHERE path = ?',
+                                (file_path,))
+                continue
+            self._add_file(file_path, path, name, entry)
+
+    def _forget(self, path):
+
+        '''
+        Drops a folder and everything below it.
+        '''
+
+        prefix = path + os.sep
+        for table in ('dirs', 'files'):
+            self.db.execute(
+                'DELETE FROM {0} WHERE path = ? OR '
+                'substr(path, 1, ?) = ?'.format(table),
+                (path, len(prefix), prefix))
+
+    def _under(self, under):
+
+        '''
+        SQL condition and arguments restricting paths to below a folder, by
+        default the root.
+        '''
+
+        if under is None:
+            under = self.root
+        prefix = os.path.abspath(under).rstrip(os.sep) + os.sep
+
+        return ' AND substr(path, 1, ?) = ?', (len(prefix), prefix)
+
+    def files(self, pattern='*', under=None):
+
+        '''
+        Returns (path, size, mtime) of all files whose name matches the
+        pattern (case sensitive, as fnmatch.fnmatchcase), sorted by path.
+        '''
+
+        condition, args = self._under(under)
+
+        return self.db.execute(
+            'SELECT path, size, mtime FROM files WHERE name GLOB ?' +
+            condition + ' ORDER BY path', (pattern,) + args).fetchall()
+
+    def folders(self, name, under=None):
+
+        '''
+        Returns the sorted paths of all folders whose name matches the
+        pattern (a plain name, or with wildcards as fnmatch.fnmatchcase).
+        '''
+
+        condition, args = self._under(under)
+
+        return [row[0] for row in self.db.execute(
+            'SELECT path FROM dirs WHERE name GLOB ?' + condition +
+            ' ORDER BY path', (name,) + args)]
+
+    def products(self, under=None):
+
+        '''
+        Returns the sorted paths of all products, i.e. '*.SAFE' folders and
+        product zips.
+        '''
+
+        return sorted(self.folders('*.SAFE', under) +
+                      [row[0] for row in self.files('S2*.zip', under)])
+
+    def granules(self, under=None):
+
+        '''
+        Returns the sorted paths of all granule folders, i.e. the folders in
+        a GRANULE folder.
+        '''
+
+        condition, args = self._under(under)
+
+        return [row[0] for row in self.db.execute(
+            'SELECT path FROM dirs WHERE parent GLOB ?' + condition +
+            ' ORDER BY path', ('*' + os.sep + 'GRANULE',) + args)]
+
+    def close(self):
+
+        self.db.close()
+
+
+def open_inventory(root, refresh=True, under=None):
+
+    '''
+    Returns the inventory of a root folder, refreshed, or with under only
+    the folders below that folder (the whole tree the first time). With
+    refresh=False an inventory already opened by the process is returned as
+    it is, e.g. for many lookups in a row.
+    '''
+
+    root = os.path.abspath(root)
+    if root not in _OPEN:
+        inv = Inventory(root)
+        if under is not None and not inv.folders('*'):
+            under = None
+        _OPEN[root] = inv.refresh(under)
+    elif refresh:
+        _OPEN[root].refresh(under)
+
+    return _OPEN[root]
@@ -0,0 +1,112 @@
+# ------------------------------------------------------------------------------
+# Name:        Array kernels for Sentinel-2 conversion.
+# Purpose:     NumPy kernels shared by the conversion scripts to turn
+#              Sentinel-2 L1C digital numbers (reflectance * 10000) into the
+#              8-bit values SIAM expects, to build the fake thermal band and
+#              to apply the noData mask. The 8-bit conversion is a single
+#              lookup in a 65536-entry table, so no float64/int64 copies of
+#              the bands are made.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import numpy
+
+#
+# L1C digital numbers are reflectance scaled by this value.
+#
+QUANTIFICATION_VALUE = 10000.0
+
+
+def reflectance(img_array):
+
+    '''
+    Returns the top-of-atmosphere reflectance of an L1C band, adjusting
+    outliers (very high reflectance and negative) to the range [0, 1].
+    '''
+
+    outData = img_array / QUANTIFICATION_VALUE
+    outData = numpy.where((outData > 1), (1), outData)
+    outData = numpy.where((outData < 0), (0), outData)
+
+    return outData
+
+
+def reflectance_to_byte(outData):
+
+    '''
+    Converts reflectance in the range [0, 1] to 8-bit.
+    '''
+
+    return ((numpy.absolute(outData) * 255.0) + 0.5).astype(numpy.uint8)
+
+
+#
+# 8-bit value of every possible 16-bit digital number, built with the formula
+# above so the lookup gives exactly the same bytes.
+#
+BYTE_LUT = reflectance_to_byte(
+    reflectance(numpy.arange(65536, dtype=numpy.uint16)))
+
+
+def to_byte(img_array, out=None):
+
+    '''
+    Converts an L1C band (or a strip of one) to 8-bit. UInt16 bands are
+    converted with one lookup in BYTE_LUT into the uint8 array 'out', which is
+    allocated if not given. Other data types fall back to the formula.
+    '''
+
+    if out is None:
+        out = numpy.empty(img_array.shape, dtype=numpy.uint8)
+
+    if img_array.dtype != numpy.uint16:
+        out[...] = reflectance_to_byte(reflectance(img_array))
+        return out
+
+    return numpy.take(BYTE_LUT, img_array, out=out, mode='clip')
+
+
+#
+# Faked temperature, equivalent to 10 degree Celsius, byte-coded for SIAM.
+# The lookup gives it for valid pixels (mask 0) and 0 for noData (mask 1).
+#
+THERMAL_VALUE = 110
+THERMAL_LUT = numpy.array([THERMAL_VALUE, 0], dtype=numpy.uint8)
+
+
+def fake_thermal(noData_array, out=None):
+
+    '''
+    Returns the fake thermal band for a noData mask (or a strip of one) with
+    one lookup in THERMAL_LUT, into the uint8 array 'out' if given.
+    '''
+
+    if out is None:
+        out = numpy.empty(noData_array.shape, dtype=numpy.uint8)
+
+    return numpy.take(THERMAL_LUT, noData_array, out=out, mode='clip')
+
+
+def flag_nodata(noData_array, band_array):
+
+    '''
+    Sets the noData mask to 1 wherever the band has a value of 0, in place.
+    '''
+
+    noData_array[band_array == 0] = 1
+
+    return noData_array
+
+
+def mask_nodata(outData, noData_array):
+
+    '''
+    Sets all pixels flagged as noData (1) in the mask to 0, in place.
+    '''
+
+    outData[noData_array == 1] = 0
+
+    return outData
@@ -0,0 +1,359 @@
+# ------------------------------------------------------------------------------
+# Name:        Timing and throughput metrics.
+# Purpose:     Measure the stages of the processing chain (download,
+#              conversion, stacking, layer and batch creation): wall and CPU
+#              time, bytes read and written, peak memory (RSS) and counters
+#              such as the time spent decoding bands, per tile and per run.
+#              Every finished stage is appended as one JSON line to a metrics
+#              file, and the totals per stage are kept in a Prometheus
+#              textfile (for the node exporter's textfile collector), which is
+#              rewritten after every stage.
+#              Bytes and peak RSS come from /proc (Linux); where it is missing
+#              (e.g. Windows) they are left out. Nothing is written until
+#              configure is called, and write errors are ignored, so the
+#              metrics never stop a run.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import json
+import time
+import datetime
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#
+# Prefix of the Prometheus metric names.
+#
+PROM_PREFIX = 's2'
+
+_config = {'jsonl': None, 'prom': None, 'job': None, 'collect': False}
+
+#
+# Stages running in this process, innermost last, the records kept by a
+# worker process for the main process, and the totals per stage.
+#
+_active = []
+_records = []
+_totals = {}
+_lock = threading.Lock()
+
+
+def configure(jsonl_path=None, prom_path=None, job=None):
+
+    '''
+    Sets the JSON lines file and the Prometheus textfile the stages of this
+    process are written to, and the job name of the script.
+    '''
+
+    _config.update(jsonl=jsonl_path, prom=prom_path, job=job, collect=False)
+
+
+def collect():
+
+    '''
+    Keeps the finished stages in memory instead of writing them, e.g. in a
+    worker process whose records are written by the main process (see
+    take_records and emit).
+    '''
+
+    _config['collect'] = True
+    del _records[:]
+
+    #
+    # Stages of the parent process are not running in this one.
+    #
+    del _active[:]
+
+
+def take_records():
+
+    '''
+    Returns and forgets the records kept since collect.
+    '''
+
+    records = _records[:]
+    del _records[:]
+
+    return records
+
+
+def _proc_io():
+
+    '''
+    Bytes read and written by this process (all threads), or None.
+    '''
+
+    try:
+        with open('/proc/self/io') as f:
+            values = dict(line.split(':') for line in f if ':' in line)
+        return int(values['rchar']), int(values['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def _reset_peak_rss():
+
+    '''
+    Resets the peak RSS of the process (Linux 4.0 and later), so it can be
+    measured for one stage.
+    '''
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peak_rss():
+
+    '''
+    Peak RSS of the process in bytes (since the start of the innermost
+    stage on Linux 4.0 and later), or None.
+    '''
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return None
+
+
+def _cpu_time():
+
+    times = os.times()
+
+    return times[0] + times[1]
+
+
+class Stage(object):
+
+    '''
+    One measured stage, e.g. the conversion of a tile. Used as a context
+    manager, or with start and finish where a block does not fit. Labels
+    (e.g. tile='37SBA') are kept in the JSON lines only.
+    '''
+
+    def __init__(self, name, **labels):
+
+        self.name = name
+        self.labels = labels
+        self.counters = {}
+
+    def start(self):
+
+        if not _active:
+            _reset_peak_rss()
+        self._started = datetime.datetime.now()
+        self._wall = time.time()
+        self._cpu = _cpu_time()
+        self._io = _proc_io()
+        with _lock:
+            _active.append(self)
+
+        return self
+
+    def add(self, key, value):
+
+        '''
+        Adds to a counter of this stage, e.g. add('decode_s', seconds).
+        '''
+
+        with _lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def finish(self, status='ok'):
+
+        '''
+        Ends the stage and writes (or keeps) its record, which is returned.
+        '''
+
+        with _lock:
+            if self in _active:
+                _active.remove(self)
+
+        record = {
+            'stage': self.name,
+            'job': _config['job'],
+            'status': status,
+            'pid': os.getpid(),
+            'start': self._started.isoformat(),
+            'wall_s': round(time.time() - self._wall, 6),
+            'cpu_s': round(_cpu_time() - self._cpu, 6),
+            'peak_rss_bytes': peak_rss(),
+        }
+        io = _proc_io()
+        if io is not None and self._io is not None:
+            record['read_bytes'] = io[0] - self._io[0]
+            record['write_bytes'] = io[1] - self._io[1]
+        record.update(self.counters)
+        record.update(self.labels)
+
+        emit(record)
+
+        return record
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+
+        self.finish('ok' if exc_type is None else 'error')
+
+        return False
+
+
+def stage(name, **labels):
+
+    '''
+    Returns a new Stage, to be used in a with statement.
+    '''
+
+    return Stage(name, **labels)
+
+
+def add(key, value):
+
+    '''
+    Adds to a counter of all running stages of this process, e.g. the decode
+    time of a band read in a thread of the tile being converted.
+    '''
+
+    with _lock:
+        active = _active[:]
+    for running in active:
+        running.add(key, value)
+
+
+def _escape(value):
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _write_prom():
+
+    '''
+    Writes the totals per stage as a Prometheus textfile, replacing it in
+    one rename so the collector never reads a partial file.
+    '''
+
+    samples = {}
+    for (job, name, status), totals in _totals.items():
+        labels = '{{job="{}",stage="{}",status="{}"}}'.format(
+            _escape(job), _escape(name), _escape(status))
+        for key, value in totals.items():
+            samples.setdefault(key, []).append((labels, value))
+
+    #
+    # The samples of a metric have to follow its TYPE line.
+    #
+    lines = []
+    for key in sorted(samples):
+        metric = '{}_stage_{}'.format(PROM_PREFIX, key)
+        lines.append('# TYPE {} {}'.format(
+            metric, 'counter' if key.endswith('_total') else 'gauge'))
+        lines.extend('{}{} {}'.format(metric, labels, value)
+                     for labels, value in sorted(samples[key]))
+
+    temp_path = _config['prom'] + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    try:
+        os.rename(temp_path, _config['prom'])
+    except OSError:
+        #
+        # Windows does not replace existing files on rename.
+        #
+        os.remove(_config['prom'])
+        os.rename(temp_path, _config['prom'])
+
+
+def _add_totals(record):
+
+    key = (record.get('job') or '', record['stage'], record['status'])
+    totals = _totals.setdefault(key, {'runs_total': 0})
+    totals['runs_total'] += 1
+    totals['last_wall_seconds'] = record['wall_s']
+
+    for name, value in (('wall_seconds_total', record['wall_s']),
+                        ('cpu_seconds_total', record['cpu_s']),
+                        ('read_bytes_total', record.get('read_bytes')),
+                        ('write_bytes_total', record.get('write_bytes')),
+                        ('decode_seconds_total', record.get('decode_s')),
+                        ('transfer_bytes_total', record.get('bytes'))):
+        if value is not None:
+            totals[name] = totals.get(name, 0) + value
+
+    if record.get('peak_rss_bytes') is not None:
+        totals['peak_rss_bytes'] = max(totals.get('peak_rss_bytes', 0),
+                                       record['peak_rss_bytes'])
+
+
+def emit(record):
+
+    '''
+    Writes a finished stage (also one handed back by a worker process) to
+    the JSON lines file and the Prometheus textfile.
+    '''
+
+    if _config['collect']:
+        _records.append(record)
+        return
+
+    try:
+        if _config['jsonl'] is not None:
+            with open(_config['jsonl'], 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+        if _config['prom'] is not None:
+            _add_totals(record)
+            _write_prom()
+    except (IOError, OSError):
+        pass
+
+
+def mean_wall(name, job=None):
+
+    '''
+    Returns the mean wall time in seconds of the successful runs of a stage
+    in the JSON lines file, or None if there are none, e.g. to estimate the
+    duration of a run.
+    '''
+
+    if _config['jsonl'] is None or not os.path.exists(_config['jsonl']):
+        return None
+
+    count = 0
+    total = 0.0
+    try:
+        with open(_config['jsonl']) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if (record.get('stage') == name
+                        and record.get('status') == 'ok'
+                        and (job is None or record.get('job') == job)):
+                    count += 1
+                    total += record['wall_s']
+    except (IOError, OSError):
+        return None
+
+    return total / count if count else None
@@ -61,7 +61,13 @@ import xml.etree.ElementTree as etree
 
 import gdal
 import numpy
-import scipy.ndimage
+
+import kernels
+import bandstats
+import inventory
+import rasterout
+import resample
+import profiling
 
 ###############################################################################
 
@@ -108,16 +114,36 @@ def get_args():
             help=('No user input necessary -- automatically converts all '
                   'previously not converted images files.'),
             default=None)
+        parser.add_argument(
+            '--output-format', dest='output_format', action='store',
+            choices=sorted(rasterout.FORMATS),
+            help=('Format of the nodata mask: ENVI .dat as needed by SIAM, '
+                  'or a tiled, compressed GeoTIFF with overviews (cloud '
+                  'optimized) for other uses. Default envi.'),
+            default='envi')
+        parser.add_argument(
+            '--compress', dest='compress', action='store',
+            choices=rasterout.COMPRESSIONS,
+            help=('Compression of GeoTIFF outputs. ZSTD needs GDAL 2.3 or '
+                  'later. Default DEFLATE.'),
+            default='DEFLATE')
+        parser.add_argument(
+            '--profile', dest='profile', action='store', type=str,
+            help=('Directory to save cProfile stats, sampled stacks and '
+                  'tracemalloc reports of each tile to. Default: none.'),
+            default=None)
 
         return parser.parse_args()
 
 
-def nodata_array(tile_bands, PROC_DATA):
+def nodata_array(tile_bands, PROC_DATA, output_format='envi',
+                 compress='DEFLATE'):
 
     '''
     This function creates a noData mask array based on all pixels that have
     a value of 0 in any of the original Sentinel-2 bands used to create the
-    6 band .dat SIAM input file, and saves a copy as '*nodata.dat'.
+    6 band .dat SIAM input file, and saves a copy as '*nodata.dat' (or as a
+    compressed GeoTIFF '*nodata.tif' with output_format 'gtiff').
     These correspond to S2 bands: 2, 3, 4, 8, 10 and 11.
     '''
 
@@ -125,8 +151,6 @@ def nodata_array(tile_bands, PROC_DATA):
     # Create array with same projection, etc.
     #
     noData = gdal.Open(tile_bands[0], gdal.GA_ReadOnly)
-    noData_array = (noData.GetRasterBand(1)).ReadAsArray()
-    noData_array = numpy.where((noData_array > 0), (1), noData_array)
     #
     # Establish size of raster from B02 for nodata output file.
     #
@@ -136,34 +160,28 @@ def nodata_array(tile_bands, PROC_DATA):
     img_cols = noData.RasterXSize
 
     #
-    # Open output format driver, see gdal_translate --formats for list.
+    # 8-bit mask, where 0 are values to be processed and 1 is nodata.
     #
-    gdal_format = 'ENVI'
-    driver = gdal.GetDriverByName(gdal_format)
+    noData_array = numpy.zeros((img_rows, img_cols), dtype=numpy.uint8)
 
     #
     # Test nodata mask file path.
     #
     band_basename = os.path.basename(tile_bands[0])
-    nodata_file = '{}nodata.dat'.format(
+    nodata_file = '{}nodata'.format(
         os.path.basename(band_basename[:-7]))
-    filepath = os.path.join(PROC_DATA, nodata_file)
+    filepath = rasterout.output_path(PROC_DATA, nodata_file, output_format)
 
     #
-    # Print driver for nodata mask (1 band, 8-bit unsigned).
+    # Create the georeferenced nodata mask (1 band, 8-bit unsigned).
     #
-    outDs = driver.Create(filepath, img_cols, img_rows, 1,
-                          gdal.GDT_Byte)
-    if outDs is None:
+    try:
+        outDs = rasterout.Output(filepath, img_cols, img_rows, 1, transform,
+                                 projection, output_format, compress)
+    except IOError:
         print 'Could not create test file.'
         sys.exit(1)
 
-    #
-    # Georeference the nodata .dat file and set the projection.
-    #
-    outDs.SetGeoTransform(transform)
-    outDs.SetProjection(projection)
-
     for band in tile_bands:
 
         #
@@ -185,43 +203,35 @@ def nodata_array(tile_bands, PROC_DATA):
         # Resample bands 11 and 12 from 20m to 10m resolution.
         #
         if band.endswith(('_B11.jp2', '_B12.jp2')):
-            band_array = scipy.ndimage.zoom(band_array, 2, order=0)
+            band_array = resample.nearest2x(band_array)
 
         #
-        # Adjust output layer to 0 where there is nodata.
+        # Adjust mask to 1 where there is nodata, in place.
         #
-        noData_array = numpy.where((band_array == 0), (0), noData_array)
-
-    #
-    # Invert array to mask, where 0 are values to be processed and 1 is nodata.
-    #
-    noData_array = numpy.where((noData_array == 0), (1), (0))
+        kernels.flag_nodata(noData_array, band_array)
 
     #
     # Write the data to the designated band.
     #
-    outBand = outDs.GetRasterBand(1)
-    outBand.WriteArray(noData_array, 0, 0)
+    outDs.write(1, noData_array)
 
     #
-    # Flush data to disk.
+    # Flush data to disk and set statistics from the written array, without
+    # reading the band back, and export its histogram.
     #
-    outBand.FlushCache()
-
-    #
-    # Calculate statistics.
-    #
-    stats = outBand.ComputeStatistics(False)
-    outBand.SetStatistics(stats[0], stats[1], stats[2], stats[3])
+    stats = bandstats.BandStats().update(noData_array)
+    try:
+        outDs.close([stats])
+    except IOError as e:
+        print str(e)
+        sys.exit(1)
+    bandstats.write_sidecar(filepath, [stats])
 
-    del gdal_format
     del outDs
-    del outBand
     del noData
     img = None
     band_id = None
     band_array = None
-    outBand = None
     stats = None
 
     return noData_array
@@ -230,25 +240,13 @@ def nodata_array(tile_bands, PROC_DATA):
 def check_imgFolders(options_in):
 
     #
-    # Create list for IMG_DATA folder and existing PROC_DATA folder paths.
+    # Create list for IMG_DATA folder and existing PROC_DATA folder paths,
+    # from the inventory of the read directory.
     #
-    imgFolders = []
-    procFolders = []
-
-    for dirpath, dirnames, filenames in os.walk(
-            options_in.read_dir, topdown=True):
-
-        for dirname in dirnames:
-
-            if dirname == 'IMG_DATA':
-
-                imgFolders.append(os.path.join(dirpath, dirname))
-
-            elif dirname == 'PROC_DATA':
-
-                procFolder = os.path.join(dirpath, dirname)
+    inv = inventory.open_inventory(options_in.read_dir)
+    imgFolders = inv.folders('IMG_DATA')
+    procFolders = inv.folders('PROC_DATA')
 
-                procFolders.append(procFolder)
     #
     # Determine which tile folders have no PROC_DATA folder.
     #
@@ -262,7 +260,7 @@ def check_imgFolders(options_in):
 
         if test_path in procFolders:
             for filename in os.listdir(test_path):
-                if filename.endswith('nodata.dat'):
+                if filename.endswith(('nodata.dat', 'nodata.tif')):
                     bool_process = False
         else:
             continue
@@ -308,7 +306,8 @@ def check_imgFolders(options_in):
     return bool_ans, unprocFolders
 
 
-def convert_imgs(root_folder, imgFolders):
+def convert_imgs(root_folder, imgFolders, output_format='envi',
+                 compress='DEFLATE'):
 
     start_time = datetime.datetime.now()
 
@@ -465,7 +464,10 @@ def convert_imgs(root_folder, imgFolders):
 
         print tile_bands
         noData_array = None
-        noData_array = nodata_array(tile_bands, PROC_DATA)
+        with profiling.profile(
+                'nodata_' + os.path.basename(os.path.dirname(imgFolder))):
+            noData_array = nodata_array(tile_bands, PROC_DATA, output_format,
+                                        compress)
 
         i += 1
 
@@ -516,6 +518,7 @@ if __name__ == '__main__':
     #
     options = get_args()
     root_folder = options.read_dir
+    profiling.configure(options.profile)
 
     bool_answer, imgFolders_toProcess = check_imgFolders(options)
 
@@ -530,4 +533,5 @@ if __name__ == '__main__':
 
     else:
 
-        convert_imgs(root_folder, imgFolders_toProcess)
+        convert_imgs(root_folder, imgFolders_toProcess,
+                     options.output_format, options.compress)
@@ -0,0 +1,93 @@
+# ------------------------------------------------------------------------------
+# Name:        Nodata probe of a tile.
+# Purpose:     Estimate the fraction of valid (non-zero) pixels of a tile
+#              before converting it, from a low resolution read of its 60m
+#              B01 band: the smallest JP2 overview (resolution level) that is
+#              still at least PROBE_SIZE pixels wide, or a decimated read if
+#              the band has no overviews. This takes milliseconds, so tiles at
+#              the edge of the swath that are mostly nodata can be skipped
+#              before conversion, SIAM and ingestion.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+
+import gdal
+import numpy
+
+import safezip
+
+#
+# Width (and height) in pixels of the read the fraction is estimated from.
+#
+PROBE_SIZE = 256
+
+#
+# Band probed, and the 10m band used if it is missing.
+#
+PROBE_BANDS = ('_B01.jp2', '_B02.jp2')
+
+
+def probe_band(imgFolder):
+
+    '''
+    Returns the path of the band to probe in an IMG_DATA folder, or None.
+    '''
+
+    found = {}
+    for dirpath, dirnames, filenames in safezip.walk(imgFolder):
+        for filename in filenames:
+            if filename.endswith(PROBE_BANDS):
+                found.setdefault(filename[-8:], os.path.join(dirpath,
+                                                             filename))
+
+    for suffix in PROBE_BANDS:
+        if suffix in found:
+            return found[suffix]
+
+    return None
+
+
+def _probe_array(img_band):
+
+    '''
+    Reads the band at low resolution.
+    '''
+
+    overview = None
+    for i in range(img_band.GetOverviewCount()):
+        candidate = img_band.GetOverview(i)
+        if candidate.XSize >= PROBE_SIZE and (
+                overview is None or candidate.XSize < overview.XSize):
+            overview = candidate
+    if overview is not None:
+        return overview.ReadAsArray()
+
+    buf_xsize = min(PROBE_SIZE, img_band.XSize)
+    buf_ysize = min(PROBE_SIZE, img_band.YSize)
+
+    return img_band.ReadAsArray(0, 0, img_band.XSize, img_band.YSize,
+                                buf_xsize=buf_xsize, buf_ysize=buf_ysize)
+
+
+def valid_fraction(imgFolder):
+
+    '''
+    Returns the estimated fraction of valid pixels of the tile in an IMG_DATA
+    folder, from 0.0 to 1.0. Raises IOError if no band can be read.
+    '''
+
+    band = probe_band(imgFolder)
+    img = None
+    if band is not None:
+        img = gdal.Open(band, gdal.GA_ReadOnly)
+    if img is None:
+        raise IOError('No band to probe in {}.'.format(imgFolder))
+
+    probe = _probe_array(img.GetRasterBand(1))
+    img = None
+
+    return numpy.count_nonzero(probe) / float(probe.size)
@@ -0,0 +1,240 @@
+# ------------------------------------------------------------------------------
+# Name:        Profiling of tiles and products.
+# Purpose:     With '--profile DIR' the scripts profile each tile (or product)
+#              they process and save to DIR:
+#                <name>.prof       cProfile stats (pstats, snakeviz, ...)
+#                <name>.collapsed  stacks sampled every SAMPLE_INTERVAL s of
+#                                  CPU time, one 'a;b;c count' line per stack
+#                                  as read by flamegraph.pl and speedscope,
+#                                  the count in SAMPLE_INTERVAL units of CPU
+#                                  time
+#                <name>.malloc.txt the TOP_N lines allocating the most memory
+#                                  (tracemalloc, Python 3), or only the peak
+#                                  RSS of the process (Python 2)
+#              cProfile and the sampler only see the thread that processes
+#              the tile; stack sampling needs SIGPROF (not on Windows), which
+#              is set to restart interrupted system calls.
+#              The signal is only handled between two bytecodes, so a long
+#              C call (numpy, scipy zoom, GDAL/JP2 decoding) is sampled once,
+#              when it returns. Each sample therefore counts the CPU time of
+#              the process since the previous one (os.times), which puts the
+#              time of the C call on the stack that made it. That CPU time
+#              includes other threads of the process (e.g. the band
+#              threads), and the stack shows no frames inside the C call: a
+#              native sampler such as py-spy --native shows those.
+#              Without a directory nothing is profiled.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import re
+import signal
+import sys
+import cProfile
+import threading
+
+import metrics
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+#
+# Seconds of CPU time between two stack samples.
+#
+SAMPLE_INTERVAL = 0.005
+
+#
+# Number of allocating lines in the tracemalloc report.
+#
+TOP_N = 25
+
+_config = {'directory': None}
+
+
+def configure(directory):
+
+    '''
+    Sets the directory the profiles are written to (None to profile
+    nothing) and creates it.
+    '''
+
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _config['directory'] = directory
+
+
+def enabled():
+
+    return _config['directory'] is not None
+
+
+def _file_name(name):
+
+    '''
+    Returns a file name made from a tile or product name, e.g. a folder path.
+    '''
+
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('_') or 'profile'
+
+
+def _frame_name(frame):
+
+    code = frame.f_code
+
+    return '{} ({}:{})'.format(
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def _cpu_time():
+
+    times = os.times()
+
+    return times[0] + times[1]
+
+
+class Profile(object):
+
+    '''
+    Profile of one tile or product. Used as a context manager, or with start
+    and stop where a block does not fit.
+    '''
+
+    def __init__(self, name):
+
+        self.name = name
+        self.stacks = {}
+        self.profiler = None
+
+    def _sample(self, signum, frame):
+
+        #
+        # Signals arriving during a C call are merged into one, so the
+        # sample counts every SAMPLE_INTERVAL of CPU time since the last.
+        #
+        cpu = _cpu_time()
+        weight = max(1, int(round((cpu - self.last_cpu) / SAMPLE_INTERVAL)))
+        self.last_cpu = cpu
+
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + weight
+
+    def _start_sampler(self):
+
+        '''
+        Samples the stack on SIGPROF, which is only possible in the main
+        thread of a process on Unix.
+        '''
+
+        self.sampling = False
+        if (not hasattr(signal, 'setitimer')
+                or threading.current_thread().name != 'MainThread'):
+            return
+        self.last_cpu = _cpu_time()
+        self.previous_handler = signal.signal(signal.SIGPROF, self._sample)
+
+        #
+        # Without this, reads and writes (files, sockets, the band threads)
+        # interrupted by a sample fail with EINTR in Python 2.
+        #
+        signal.siginterrupt(signal.SIGPROF, False)
+        self.previous_timer = signal.setitimer(
+            signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+        self.sampling = True
+
+    def _stop_sampler(self):
+
+        if not self.sampling:
+            return
+        signal.setitimer(signal.ITIMER_PROF, *self.previous_timer)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+        self.sampling = False
+
+    def start(self):
+
+        if not enabled():
+            return self
+
+        self.tracing = False
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+        self._start_sampler()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+        return self
+
+    def stop(self):
+
+        '''
+        Stops profiling and writes the reports. Returns the path of the
+        cProfile stats, or None if nothing was profiled.
+        '''
+
+        if self.profiler is None:
+            return None
+
+        self.profiler.disable()
+        self._stop_sampler()
+
+        base = os.path.join(_config['directory'], _file_name(self.name))
+        self.profiler.dump_stats(base + '.prof')
+        self.profiler = None
+
+        if self.stacks:
+            with open(base + '.collapsed', 'w') as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write('{} {}\n'.format(stack, count))
+
+        if self.tracing:
+            #
+            # Leave out what the profiler itself allocated.
+            #
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, '*cProfile.py'),
+                tracemalloc.Filter(False, '*profiling.py')])
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(base + '.malloc.txt', 'w') as f:
+                f.write('Traced memory: {} bytes, peak {} bytes\n'.format(
+                    current, peak))
+                f.write('Top {} allocating lines:\n'.format(TOP_N))
+                for stat in snapshot.statistics('lineno')[:TOP_N]:
+                    f.write('{}\n'.format(stat))
+        elif tracemalloc is None:
+            with open(base + '.malloc.txt', 'w') as f:
+                f.write('tracemalloc is not available in Python {}.\n'.format(
+                    sys.version.split()[0]))
+                f.write('Peak RSS of the process: {} bytes\n'.format(
+                    metrics.peak_rss()))
+
+        return base + '.prof'
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+
+        self.stop()
+
+        return False
+
+
+def profile(name):
+
+    '''
+    Returns a new Profile, to be used in a with statement.
+    '''
+
+    return Profile(name)
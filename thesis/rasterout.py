@@ -0,0 +1,169 @@
+# ------------------------------------------------------------------------------
+# Name:        8-bit output files of the conversion.
+# Purpose:     Create the 8-bit outputs of the conversion either as ENVI
+#              .dat/.hdr files, or as tiled, compressed GeoTIFFs with internal
+#              overviews laid out as cloud optimized GeoTIFFs (COG). The
+#              caltembyt and calrefbyt stacks SIAM reads are always ENVI
+#              files (SIAM_OUTPUTS); the format only applies to the others,
+#              e.g. the nodata mask. GDAL 2.2
+#              has no COG driver, so the blocks are written to a temporary
+#              tiled GeoTIFF, overviews are built on it and it is copied with
+#              COPY_SRC_OVERVIEWS=YES, which puts the overviews first.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+
+import gdal
+
+#
+# Output formats, with their GDAL driver and file extension.
+#
+FORMATS = {'envi': ('ENVI', '.dat'), 'gtiff': ('GTiff', '.tif')}
+
+#
+# Outputs read by the SIAM executable, which only reads ENVI files.
+#
+SIAM_OUTPUTS = ('caltembyt_lndstlk', 'calrefbyt_lndstlk')
+
+#
+# Compression of GeoTIFF outputs. ZSTD needs GDAL 2.3 or later.
+#
+COMPRESSIONS = ('DEFLATE', 'ZSTD')
+
+TILE_SIZE = 512
+
+
+def output_format_of(name, output_format='envi'):
+
+    '''
+    Returns the format an output is written in: 'envi' for the outputs SIAM
+    reads, otherwise output_format.
+    '''
+
+    if name.endswith(SIAM_OUTPUTS):
+        return 'envi'
+
+    return output_format
+
+
+def output_path(PROC_DATA, name, output_format='envi'):
+
+    '''
+    Returns the path of an output file, e.g. '<basename>nodata' -> '.dat' or
+    '.tif' in PROC_DATA. Outputs SIAM reads always get '.dat'.
+    '''
+
+    return os.path.join(
+        PROC_DATA, name + FORMATS[output_format_of(name, output_format)][1])
+
+
+def _temp_path(filepath):
+
+    return '{}.tmp.tif'.format(os.path.splitext(filepath)[0])
+
+
+def creation_options(compress='DEFLATE'):
+
+    '''
+    GeoTIFF creation options of the tiled, compressed outputs.
+    '''
+
+    return ['TILED=YES',
+            'BLOCKXSIZE={}'.format(TILE_SIZE),
+            'BLOCKYSIZE={}'.format(TILE_SIZE),
+            'COMPRESS={}'.format(compress)]
+
+
+def overview_levels(img_cols, img_rows):
+
+    '''
+    Overview factors 2, 4, 8, ... until the overview fits in one tile.
+    '''
+
+    levels = []
+    level = 2
+    while max(img_cols, img_rows) > TILE_SIZE * level // 2:
+        levels.append(level)
+        level *= 2
+
+    return levels
+
+
+class Output(object):
+
+    '''
+    An 8-bit output file with the georeferencing of the input tile, written
+    block by block with write and completed with close. GeoTIFFs are written
+    to a temporary file until then. The dataset is only referenced here, so
+    close can release it before the temporary file is removed.
+    '''
+
+    def __init__(self, filepath, img_cols, img_rows, num_bands, transform,
+                 projection, output_format='envi', compress='DEFLATE'):
+
+        self.filepath = filepath
+        self.output_format = output_format
+        self.compress = compress
+        self.driver = gdal.GetDriverByName(FORMATS[output_format][0])
+
+        if output_format == 'envi':
+            self.ds = self.driver.Create(filepath, img_cols, img_rows,
+                                         num_bands, gdal.GDT_Byte)
+        else:
+            self.ds = self.driver.Create(
+                _temp_path(filepath), img_cols, img_rows, num_bands,
+                gdal.GDT_Byte, options=creation_options(compress))
+        if self.ds is None:
+            raise IOError('Could not create {}.'.format(filepath))
+
+        self.ds.SetGeoTransform(transform)
+        self.ds.SetProjection(projection)
+        self.RasterCount = num_bands
+
+    def write(self, band_in_stack, array, yoff=0):
+
+        '''
+        Writes a block of full rows to a band, starting at row yoff.
+        '''
+
+        self.ds.GetRasterBand(band_in_stack).WriteArray(array, 0, yoff)
+
+    def close(self, band_stats, overview_resampling='NEAREST'):
+
+        '''
+        Flushes the output and sets the statistics of its bands (list of
+        bandstats.BandStats). GeoTIFFs get their overviews and are copied from
+        the temporary file to the output path. Raises IOError if the copy
+        could not be created.
+        '''
+
+        for band_in_stack, stats in enumerate(band_stats, 1):
+            outBand = self.ds.GetRasterBand(band_in_stack)
+            outBand.FlushCache()
+            if self.output_format == 'envi':
+                stats.apply(outBand)
+        outBand = None
+
+        if self.output_format == 'envi':
+            self.ds = None
+            return
+
+        levels = overview_levels(self.ds.RasterXSize, self.ds.RasterYSize)
+        if levels:
+            self.ds.BuildOverviews(overview_resampling, levels)
+        copyDs = self.driver.CreateCopy(
+            self.filepath, self.ds,
+            options=creation_options(self.compress) +
+            ['COPY_SRC_OVERVIEWS=YES'])
+        self.ds = None
+        self.driver.Delete(_temp_path(self.filepath))
+        if copyDs is None:
+            raise IOError('Could not create {}.'.format(self.filepath))
+
+        for band_in_stack, stats in enumerate(band_stats, 1):
+            stats.apply(copyDs.GetRasterBand(band_in_stack))
+        copyDs = None
@@ -0,0 +1,140 @@
+# ------------------------------------------------------------------------------
+# Name:        2x upsampling for Sentinel-2 20m bands.
+# Purpose:     NumPy kernels to bring bands 11 and 12 from 20m to 10m pixels,
+#              either with nearest interpolation (same result as
+#              scipy.ndimage.zoom(band, 2, order=0)) or bilinear interpolation
+#              (same weights as PIL's Image.BILINEAR resize). Both work on
+#              whole bands or on windows read block by block, using one row
+#              and column of halo around the window for bilinear.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import numpy
+
+#
+# Source pixels needed on each side of a window by each method.
+#
+HALO = {'nearest': 0, 'bilinear': 1}
+
+
+def nearest2x(band_array):
+
+    '''
+    Returns the band resampled by a factor of 2 with nearest interpolation,
+    i.e. every pixel repeated into a 2x2 block, made in a single copy.
+    '''
+
+    rows, cols = band_array.shape
+    out = numpy.broadcast_to(
+        band_array[:, None, :, None], (rows, 2, cols, 2))
+
+    return out.reshape(rows * 2, cols * 2)
+
+
+def _bilinear_rows(band_array):
+
+    '''
+    Doubles the rows of an array that has one halo row above and below, with
+    pixel centres aligned (weights 0.25/0.75). The halo rows are dropped.
+    '''
+
+    centre = band_array[1:-1]
+    out = numpy.empty((2 * centre.shape[0],) + centre.shape[1:],
+                      dtype=numpy.float32)
+    out[0::2] = 0.25 * band_array[:-2] + 0.75 * centre
+    out[1::2] = 0.75 * centre + 0.25 * band_array[2:]
+
+    return out
+
+
+def _bilinear_halo(band_array):
+
+    '''
+    Bilinear 2x of an array that already has one halo row and column on every
+    side. Returns float32.
+    '''
+
+    band_array = band_array.astype(numpy.float32)
+    out = _bilinear_rows(band_array)
+
+    return _bilinear_rows(out.T).T
+
+
+def bilinear2x(band_array):
+
+    '''
+    Returns the band resampled by a factor of 2 with bilinear interpolation,
+    as float32. Edge pixels are repeated outside the band.
+    '''
+
+    return _bilinear_halo(numpy.pad(band_array, 1, mode='edge'))
+
+
+def _axis_window(off, size, src_size, halo):
+
+    '''
+    First source pixel and number of source pixels covering the target
+    pixels [off, off + size) along one axis, clipped to the source.
+    '''
+
+    start = max(off // 2 - halo, 0)
+    end = min((off + size - 1) // 2 + halo + 1, src_size)
+
+    return start, end - start
+
+
+def source_window(xoff, yoff, xsize, ysize, src_xsize, src_ysize,
+                  method='nearest'):
+
+    '''
+    Returns the window (xoff, yoff, xsize, ysize) of the 20m band to read for
+    the 10m window given, including the halo the method needs.
+    '''
+
+    halo = HALO[method]
+    src_xoff, src_xsize = _axis_window(xoff, xsize, src_xsize, halo)
+    src_yoff, src_ysize = _axis_window(yoff, ysize, src_ysize, halo)
+
+    return src_xoff, src_yoff, src_xsize, src_ysize
+
+
+def upsample_window(block, xoff, yoff, xsize, ysize, src_xoff, src_yoff,
+                    method='nearest'):
+
+    '''
+    Resamples a block of the 20m band read with source_window and returns the
+    10m window (xoff, yoff, xsize, ysize). Halo pixels missing at the edges of
+    the band are filled by repeating the edge pixels.
+    '''
+
+    if method == 'nearest':
+        out = nearest2x(block)
+        y = yoff - 2 * src_yoff
+        x = xoff - 2 * src_xoff
+        return out[y:y + ysize, x:x + xsize]
+
+    #
+    # Pad where the block starts or ends without its halo (band edges), so
+    # the block covers source pixels first - 1 to last + 1.
+    #
+    first_y = yoff // 2
+    first_x = xoff // 2
+    last_y = (yoff + ysize - 1) // 2
+    last_x = (xoff + xsize - 1) // 2
+    pad_top = src_yoff - (first_y - 1)
+    pad_left = src_xoff - (first_x - 1)
+    pad_bottom = (last_y + 1) - (src_yoff + block.shape[0] - 1)
+    pad_right = (last_x + 1) - (src_xoff + block.shape[1] - 1)
+    if pad_top or pad_left or pad_bottom or pad_right:
+        block = numpy.pad(
+            block, ((pad_top, pad_bottom), (pad_left, pad_right)),
+            mode='edge')
+
+    out = _bilinear_halo(block)
+    y = yoff - 2 * first_y
+    x = xoff - 2 * first_x
+
+    return out[y:y + ysize, x:x + xsize]
@@ -0,0 +1,167 @@
+# ------------------------------------------------------------------------------
+# Name:        Zipped Sentinel-2 products.
+# Purpose:     Find the IMG_DATA folders inside downloaded SAFE zips and list,
+#              walk and open their contents, so the bands can be read by GDAL
+#              through /vsizip/ without extracting the product. Paths inside
+#              a zip look like '/vsizip/<product>.zip/<product>.SAFE/...' and
+#              work like folder paths with os.path functions; normal folder
+#              paths are passed on to os.
+#              As nothing can be written into the zip, the PROC_DATA folder of
+#              a zipped granule is created next to the zip in '<product>.PROC',
+#              e.g. '<product>.PROC/GRANULE/<granule>/PROC_DATA'.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import io
+import os
+import zipfile
+
+VSIZIP = '/vsizip/'
+PROC_SUFFIX = '.PROC'
+
+
+def is_product_zip(filename):
+
+    '''
+    True for the zip of a downloaded Sentinel-2 product.
+    '''
+
+    return filename.startswith('S2') and filename.endswith('.zip')
+
+
+def is_vsizip(path):
+
+    '''
+    True for a path inside a zip.
+    '''
+
+    return path.startswith(VSIZIP)
+
+
+def split_vsizip(path):
+
+    '''
+    Returns the zip file and the path inside it of a /vsizip/ path.
+    '''
+
+    end = path.index('.zip', len(VSIZIP)) + len('.zip')
+
+    return path[len(VSIZIP):end], path[end:].strip('/')
+
+
+def _tree(zip_path):
+
+    '''
+    Returns a dict of every folder in the zip ('' for the top) to the sorted
+    lists of its sub-folders and files. Zips do not always have entries for
+    their folders, so they are derived from the file names.
+    '''
+
+    with zipfile.ZipFile(zip_path) as z:
+        names = z.namelist()
+
+    tree = {'': (set(), set())}
+    for name in names:
+        parts = [p for p in name.split('/') if p]
+        if not parts:
+            continue
+        folder = ''
+        for i, part in enumerate(parts):
+            is_dir = i < len(parts) - 1 or name.endswith('/')
+            tree[folder][0 if is_dir else 1].add(part)
+            if not is_dir:
+                break
+            folder = '/'.join(parts[:i + 1])
+            tree.setdefault(folder, (set(), set()))
+
+    return dict((k, (sorted(v[0]), sorted(v[1]))) for k, v in tree.items())
+
+
+def find_img_folders(zip_path):
+
+    '''
+    Returns the /vsizip/ paths of the granule IMG_DATA folders in a product
+    zip.
+    '''
+
+    imgFolders = []
+    for folder in sorted(_tree(zip_path)):
+        parts = folder.split('/')
+        if parts[-1] == 'IMG_DATA' and 'GRANULE' in parts:
+            imgFolders.append('{}{}/{}'.format(VSIZIP, zip_path, folder))
+
+    return imgFolders
+
+
+def walk(folder):
+
+    '''
+    Like os.walk(folder, topdown=True), for folders in zips too.
+    '''
+
+    if not is_vsizip(folder):
+        for entry in os.walk(folder, topdown=True):
+            yield entry
+        return
+
+    zip_path, inner = split_vsizip(folder)
+    tree = _tree(zip_path)
+    todo = [inner]
+    while todo:
+        current = todo.pop(0)
+        if current not in tree:
+            continue
+        dirnames, filenames = tree[current]
+        yield ('{}{}/{}'.format(VSIZIP, zip_path, current).rstrip('/'),
+               list(dirnames), list(filenames))
+        todo.extend('/'.join(filter(None, [current, d])) for d in dirnames)
+
+
+def listdir(folder):
+
+    '''
+    Like os.listdir, for folders in zips too.
+    '''
+
+    if not is_vsizip(folder):
+        return os.listdir(folder)
+
+    zip_path, inner = split_vsizip(folder)
+    dirnames, filenames = _tree(zip_path).get(inner, ([], []))
+
+    return dirnames + filenames
+
+
+def open_file(path):
+
+    '''
+    Opens a file for reading in binary mode, e.g. to parse a metadata xml,
+    reading it into memory if it is in a zip.
+    '''
+
+    if not is_vsizip(path):
+        return open(path, 'rb')
+
+    zip_path, inner = split_vsizip(path)
+    with zipfile.ZipFile(zip_path) as z:
+        return io.BytesIO(z.read(inner))
+
+
+def proc_data_folder(imgFolder):
+
+    '''
+    Returns the PROC_DATA folder for an IMG_DATA folder: next to it for
+    extracted products, or in '<product>.PROC' next to the zip.
+    '''
+
+    if not is_vsizip(imgFolder):
+        return os.path.join(os.path.dirname(imgFolder), 'PROC_DATA')
+
+    zip_path, inner = split_vsizip(imgFolder)
+    granule = inner.split('/')[1:-1]
+
+    return os.path.join(os.path.splitext(zip_path)[0] + PROC_SUFFIX,
+                        *(granule + ['PROC_DATA']))
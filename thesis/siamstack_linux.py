@@ -15,23 +15,33 @@
 import os
 import sys
 import fnmatch
+import argparse
 
 import gdal
 import numpy
 
+import inventory
+import metrics
+import profiling
+
+#
+# Data root holding the inventory of all products (see inventory.py).
+#
+DATA_ROOT = '/data/s2/'
 
-def siam_folders(root_folder):
+
+def siam_folders(root_folder, data_root=DATA_ROOT):
 
     #
-    # Create empty list for 'siamoutput' folder paths
+    # List of 'siamoutput' folder paths in PROC_DATA folders below the
+    # root folder, from the inventory of the data root. The root folder
+    # may be a single product, which must not get an inventory of its own.
     #
-    siamFolders = []
-
-    for dirpath, dirnames, filenames in os.walk(root_folder, topdown=True):
-        for dirname in dirnames:
-            if (dirname == 'siamoutput'
-                    and fnmatch.fnmatch(dirpath, '*PROC_DATA*')):
-                siamFolders.append(os.path.join(dirpath, dirname))
+    siamFolders = [
+        folder for folder in
+        inventory.open_inventory(data_root, under=root_folder).folders(
+            'siamoutput', under=root_folder)
+        if fnmatch.fnmatch(os.path.dirname(folder), '*PROC_DATA*')]
 
     return siamFolders
 
@@ -43,6 +53,11 @@ def siam_stack(siam_folders, stack_type, layer_endings):
 
     for folder in siam_folders:
 
+        stage = metrics.Stage(
+            'stack', folder=folder, stack_type=stack_type).start()
+        folder_profile = profiling.profile(
+            'stack_{}_'.format(stack_type) + folder).start()
+
         #
         # Create new list of desired layers depending on stack type.
         #
@@ -157,6 +172,8 @@ def siam_stack(siam_folders, stack_type, layer_endings):
             img = None
 
         del outDs
+        folder_profile.stop()
+        stage.finish()
 
 
 def create_tif(layer, tiffname, num_layers):
@@ -234,6 +251,18 @@ if __name__ == "__main__":
     # Register all of the GDAL drivers
     #
     gdal.AllRegister()
+    metrics.configure('log/metrics.jsonl', 'log/siamstack.prom', 'siamstack')
+
+    #
+    # Optional profiling of each stack.
+    #
+    parser = argparse.ArgumentParser(description='SIAM stack creator.')
+    parser.add_argument(
+        '--profile', dest='profile', action='store', type=str,
+        help=('Directory to save cProfile stats, sampled stacks and '
+              'tracemalloc reports of each stack to. Default: none.'),
+        default=None)
+    profiling.configure(parser.parse_args().profile)
 
     root_folder = '/data/s2/37SBA/S2A_MSIL1C_20161212T082332_N0204_R121_T37SBA_20161212T082908.SAFE/'
 
@@ -0,0 +1,809 @@
+# ------------------------------------------------------------------------------
+# Name:        Synthetic Sentinel-2 products.
+# Purpose:     Write fake Level-1C products with the structure of real
+#              downloads, to test and benchmark the scripts without the data
+#              hub: the old layout (S2A_OPER_PRD_MSIL1C_*.SAFE, before
+#              06.12.16) or the new one
+#              (S2A_MSIL1C_*.SAFE with MTD_MSIL1C.xml), with product and tile
+#              metadata in the psd-12, psd-13 or psd-14 namespaces, a cloud
+#              mask in QI_DATA and JP2 bands at 10, 20 and 60m, optionally
+#              zipped as downloaded with '--unzip n'. Level-2A products (new
+#              layout, psd-12) have the R10m, R20m and R60m band folders of
+#              Sen2Cor, as read by conversion2.py.
+#              The bands are uint16 noise over a smooth field, with nodata
+#              (0) west of a slanted swath edge covering the given fraction of
+#              the tile and opaque clouds covering the given percentage, on a
+#              grid of CLOUD_CELLS x CLOUD_CELLS cells so the cloud mask
+#              matches the CLOUDY_PIXEL_PERCENTAGE exactly. Everything is
+#              derived from the seed, so a benchmark can be repeated.
+#              Each product holds one tile, like the tile downloads of
+#              download_linux.py, as restructure.py expects. The tile
+#              origin follows the MGRS 100km square of the tile id, without
+#              the tiling grid, so it is close to but not exactly that of the
+#              real tile.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import sys
+import math
+import shutil
+import zipfile
+import argparse
+import datetime
+import xml.etree.ElementTree as etree
+
+import gdal
+import osr
+import numpy
+
+#
+# Bands of a Level-1C tile and their resolution in m, in product order.
+#
+BANDS = (('B01', 60), ('B02', 10), ('B03', 10), ('B04', 10), ('B05', 20),
+         ('B06', 20), ('B07', 20), ('B08', 10), ('B8A', 20), ('B09', 60),
+         ('B10', 60), ('B11', 20), ('B12', 20))
+
+#
+# Typical top of atmosphere reflectance of the bands (x 10000) over land.
+#
+REFLECTANCE = {'B01': 1400, 'B02': 1200, 'B03': 1100, 'B04': 1100,
+               'B05': 1400, 'B06': 2000, 'B07': 2300, 'B08': 2400,
+               'B8A': 2600, 'B09': 800, 'B10': 30, 'B11': 2200, 'B12': 1500}
+CLOUD_REFLECTANCE = 7000
+
+#
+# Bands of a Level-2A tile in its resolution folders.
+#
+L2A_BANDS = ((10, ('B02', 'B03', 'B04', 'B08')),
+             (20, ('B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B11',
+                   'B12')),
+             (60, ('B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A',
+                   'B09', 'B11', 'B12')))
+
+#
+# Width of a tile in 10m pixels (109.8km).
+#
+TILE_SIZE = 10980
+
+#
+# Product and tile metadata namespaces of the PSD versions.
+#
+PSD_NAMESPACES = {
+    12: ('https://psd-12.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd',
+         'https://psd-12.sentinel2.eo.esa.int/PSD/'
+         'S2_PDI_Level-1C_Tile_Metadata.xsd'),
+    13: ('https://psd-13.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd',
+         'https://psd-13.sentinel2.eo.esa.int/PSD/'
+         'S2_PDI_Level-1C_Tile_Metadata.xsd'),
+    14: ('https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd',
+         'https://psd-14.sentinel2.eo.esa.int/PSD/'
+         'S2_PDI_Level-1C_Tile_Metadata.xsd'),
+}
+L2A_NAMESPACES = (
+    'https://psd-12.sentinel2.eo.esa.int/PSD/User_Product_Level-2A.xsd',
+    'https://psd-12.sentinel2.eo.esa.int/PSD/'
+    'S2_PDI_Level-2A_Tile_Metadata.xsd')
+GML_NAMESPACE = 'http://www.opengis.net/gml/3.2'
+EOP_NAMESPACE = 'http://www.opengis.net/eop/2.0'
+
+#
+# Slope of the swath edge, relative to the largest slope that keeps the edge
+# inside the tile.
+#
+EDGE_SLOPE = 0.5
+
+#
+# Clouds are whole cells of a CLOUD_CELLS x CLOUD_CELLS grid over the tile.
+#
+CLOUD_CELLS = 20
+
+#
+# Points per side of the sun and viewing angle grids (5km steps).
+#
+ANGLE_GRID = 23
+
+JP2_DRIVER = 'JP2OpenJPEG'
+JP2_OPTIONS = ['QUALITY=100', 'REVERSIBLE=YES', 'YCBCR420=NO']
+JP2_BLOCK = 1024
+
+BASELINE = '02.04'
+RELATIVE_ORBIT = 121
+
+#
+# Letters of the MGRS 100km squares and latitude bands.
+#
+MGRS_COLUMNS = ('ABCDEFGH', 'JKLMNPQR', 'STUVWXYZ')
+MGRS_ROWS = 'ABCDEFGHJKLMNPQRSTUV'
+MGRS_BANDS = 'CDEFGHJKLMNPQRSTUVWX'
+
+
+def tile_geocoding(tile):
+
+    '''
+    Returns the EPSG code and the upper left corner of a tile, e.g. '37SBA',
+    from the MGRS 100km square of its id. Raises ValueError for other ids.
+    '''
+
+    try:
+        zone = int(tile[:2])
+        band = MGRS_BANDS.index(tile[2])
+        column = MGRS_COLUMNS[(zone - 1) % 3].index(tile[3])
+        row = MGRS_ROWS.index(tile[4])
+    except (ValueError, IndexError):
+        raise ValueError('Not a Sentinel-2 tile id: {}'.format(tile))
+    if len(tile) != 5 or not 1 <= zone <= 60:
+        raise ValueError('Not a Sentinel-2 tile id: {}'.format(tile))
+
+    north = tile[2] >= 'N'
+    epsg = (32600 if north else 32700) + zone
+
+    #
+    # Rows repeat every 2000km and start at F in even zones. The cycle is
+    # the one at the southern edge of the latitude band.
+    #
+    row_northing = ((row - (5 if zone % 2 == 0 else 0)) % 20) * 100000
+    band_northing = (-80 + 8 * band) * 110574.0 + (0 if north else 10000000)
+    cycles = int(math.ceil((band_northing - row_northing) / 2000000.0))
+    northing = row_northing + max(cycles, 0) * 2000000
+
+    return epsg, (column + 1) * 100000, northing + 100000
+
+
+def product_names(layout, tile, sensing, generation, absolute_orbit,
+                  level='L1C'):
+
+    '''
+    Returns the names of the product folder, its metadata file, the granule
+    folder, the tile metadata file, the band file prefix, the cloud mask and
+    the tile and datastrip ids of a product in the old or new layout.
+    '''
+
+    sensing_s = sensing.strftime('%Y%m%dT%H%M%S')
+    generation_s = generation.strftime('%Y%m%dT%H%M%S')
+    tile_id = 'S2A_OPER_MSI_L1C_TL_SGS__{}_A{:06d}_T{}_N{}'.format(
+        generation_s, absolute_orbit, tile, BASELINE)
+    datastrip_id = 'S2A_OPER_MSI_L1C_DS_SGS__{}_S{}_N{}'.format(
+        generation_s, sensing_s, BASELINE)
+
+    if layout == 'old':
+        product = 'S2A_OPER_PRD_MSIL1C_PDMC_{}_R{:03d}_V{}_{}'.format(
+            generation_s, RELATIVE_ORBIT, sensing_s, sensing_s)
+        return {
+            'product': product + '.SAFE',
+            'product_metadata': product.replace(
+                'PRD_MSIL1C', 'MTD_SAFL1C') + '.xml',
+            'granule': tile_id,
+            'tile_metadata': tile_id[:-7].replace('MSI', 'MTD') + '.xml',
+            'band_prefix': tile_id[:-7] + '_',
+            'cloud_mask': '{}_B00_MSIL1C.gml'.format(
+                tile_id[:-7].replace('MSI_L1C_TL', 'MSK_CLOUDS')),
+            'tile_id': tile_id,
+            'datastrip_id': datastrip_id,
+            'datastrip': datastrip_id,
+            'datastrip_metadata': datastrip_id[:-7].replace(
+                'MSI', 'MTD') + '.xml',
+        }
+
+    product = 'S2A_MSI{}_{}_N{}_R{:03d}_T{}_{}'.format(
+        level, sensing_s, BASELINE.replace('.', ''), RELATIVE_ORBIT, tile,
+        generation_s)
+    return {
+        'product': product + '.SAFE',
+        'product_metadata': 'MTD_MSI{}.xml'.format(level),
+        'granule': '{}_T{}_A{:06d}_{}'.format(level, tile, absolute_orbit,
+                                              sensing_s),
+        'tile_metadata': 'MTD_TL.xml',
+        'band_prefix': ('L2A_T{}_{}_' if level == 'L2A' else 'T{}_{}_')
+        .format(tile, sensing_s),
+        'cloud_mask': 'MSK_CLOUDS_B00.gml',
+        'tile_id': tile_id if level == 'L1C' else tile_id.replace(
+            'OPER_MSI_L1C', 'USER_MSI_L2A'),
+        'datastrip_id': datastrip_id,
+        'datastrip': 'DS_SGS_{}_S{}'.format(generation_s, sensing_s),
+        'datastrip_metadata': 'MTD_DS.xml',
+    }
+
+
+def nodata_mask(size, nodata):
+
+    '''
+    Returns the nodata mask (True for nodata) of a square grid, west of a
+    slanted swath edge covering the fraction nodata of it.
+    '''
+
+    if nodata <= 0:
+        return numpy.zeros((size, size), bool)
+    if nodata >= 1:
+        return numpy.ones((size, size), bool)
+
+    centres = (numpy.arange(size) + 0.5) / size
+    slope = 2 * EDGE_SLOPE * min(nodata, 1 - nodata)
+    edge = nodata + slope * (centres - 0.5)
+
+    return centres[numpy.newaxis, :] < edge[:, numpy.newaxis]
+
+
+def cloud_cells(size, cloud, nodata, rng):
+
+    '''
+    Returns the cells (x0, y0, x1, y1 in pixels of a square grid) covered by
+    clouds, about the percentage cloud of the grid, preferably in cells
+    without nodata.
+    '''
+
+    cells = min(CLOUD_CELLS, size)
+    edges = [int(round(i * size / float(cells))) for i in range(cells + 1)]
+    grid = [(edges[i], edges[j], edges[i + 1], edges[j + 1])
+            for j in range(cells) for i in range(cells)]
+
+    count = int(round(cloud / 100.0 * len(grid)))
+    order = rng.permutation(len(grid))
+    valid = [grid[k] for k in order if not nodata[grid[k][1]:grid[k][3],
+                                                 grid[k][0]:grid[k][2]].any()]
+    others = [grid[k] for k in order if grid[k] not in valid]
+
+    return (valid + others)[:count]
+
+
+def base_field(size, rng):
+
+    '''
+    Returns a smooth field between 0.6 and 1.4 over a square grid, shared by
+    the bands of a tile.
+    '''
+
+    coarse = max(1, size // 30)
+    field = rng.uniform(0.6, 1.4, (coarse, coarse))
+    factor = int(math.ceil(size / float(coarse)))
+    field = numpy.repeat(numpy.repeat(field, factor, 0), factor, 1)
+
+    return field[:size, :size]
+
+
+def band_array(band, factor, field, nodata, clouds, rng):
+
+    '''
+    Returns the uint16 values of a band, from the 60m field, nodata mask and
+    cloud cells, repeated factor times to its resolution.
+    '''
+
+    values = (field * REFLECTANCE[band]).astype(numpy.uint16)
+    for x0, y0, x1, y1 in clouds:
+        values[y0:y1, x0:x1] = CLOUD_REFLECTANCE if band != 'B10' else 1000
+    values[nodata] = 0
+    if factor > 1:
+        values = numpy.repeat(numpy.repeat(values, factor, 0), factor, 1)
+
+    #
+    # Noise at full resolution, so the bands compress like real ones.
+    #
+    noise = rng.randint(1, 200, values.shape, dtype=numpy.uint16)
+    noise[values == 0] = 0
+
+    return values + noise
+
+
+def write_jp2(path, arrays, ulx, uly, resolution, projection):
+
+    '''
+    Writes bands (2D arrays of the same type) to a georeferenced JP2.
+    '''
+
+    rows, cols = arrays[0].shape
+    data_type = gdal.GDT_Byte if arrays[0].dtype == numpy.uint8 \
+        else gdal.GDT_UInt16
+
+    mem = gdal.GetDriverByName('MEM').Create('', cols, rows, len(arrays),
+                                             data_type)
+    mem.SetGeoTransform((ulx, resolution, 0, uly, 0, -resolution))
+    mem.SetProjection(projection)
+    for i, array in enumerate(arrays):
+        mem.GetRasterBand(i + 1).WriteArray(array, 0, 0)
+
+    driver = gdal.GetDriverByName(JP2_DRIVER)
+    if driver is None:
+        raise IOError('GDAL has no {} driver to write {}.'.format(
+            JP2_DRIVER, path))
+    block = min(JP2_BLOCK, cols, rows)
+    img = driver.CreateCopy(path, mem, options=JP2_OPTIONS + [
+        'BLOCKXSIZE={}'.format(block), 'BLOCKYSIZE={}'.format(block)])
+    if img is None:
+        raise IOError('Could not write {}.'.format(path))
+    img = None
+    mem = None
+
+
+def _sub(parent, tag, text=None, **attrib):
+
+    elem = etree.SubElement(parent, tag, dict(
+        (k, str(v)) for k, v in attrib.items()))
+    if text is not None:
+        elem.text = str(text)
+
+    return elem
+
+
+def _write_xml(root, path):
+
+    etree.ElementTree(root).write(path, encoding='UTF-8',
+                                  xml_declaration=True)
+
+
+def _time(value):
+
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(
+        value.microsecond // 1000)
+
+
+def _angle_grid(parent, start, step_x, step_y):
+
+    _sub(parent, 'COL_STEP', 5000, unit='m')
+    _sub(parent, 'ROW_STEP', 5000, unit='m')
+    values = _sub(parent, 'Values_List')
+    for row in range(ANGLE_GRID):
+        _sub(values, 'VALUES', ' '.join(
+            '{:.4f}'.format(start + row * step_y + col * step_x)
+            for col in range(ANGLE_GRID)))
+
+
+def _namespaces(level, psd):
+
+    return L2A_NAMESPACES if level == 'L2A' else PSD_NAMESPACES[psd]
+
+
+def tile_metadata(psd, names, sensing, generation, epsg, ulx, uly, size,
+                  cloud_percentage, cloud_tag=True, level='L1C'):
+
+    '''
+    Returns the tile metadata (MTD_TL.xml or S2A_OPER_MTD_L1C_TL_*.xml).
+    Level-2A tiles have a TILE_ID_2A.
+    '''
+
+    namespace = _namespaces(level, psd)[1]
+    etree.register_namespace('n1', namespace)
+    root = etree.Element('{{{}}}Level-{}_Tile_ID'.format(namespace,
+                                                          level[1:]))
+
+    general = _sub(root, '{{{}}}General_Info'.format(namespace))
+    _sub(general, 'TILE_ID_2A' if level == 'L2A' else 'TILE_ID',
+         names['tile_id'], metadataLevel='Brief')
+    _sub(general, 'DATASTRIP_ID', names['datastrip_id'],
+         metadataLevel='Standard')
+    _sub(general, 'DOWNLINK_PRIORITY', 'NOMINAL', metadataLevel='Standard')
+    _sub(general, 'SENSING_TIME', _time(sensing), metadataLevel='Standard')
+    archiving = _sub(general, 'Archiving_Info', metadataLevel='Expertise')
+    _sub(archiving, 'ARCHIVING_CENTRE', 'SGS_')
+    _sub(archiving, 'ARCHIVING_TIME', _time(generation))
+
+    geometric = _sub(root, '{{{}}}Geometric_Info'.format(namespace))
+    geocoding = _sub(geometric, 'Tile_Geocoding', metadataLevel='Brief')
+    _sub(geocoding, 'HORIZONTAL_CS_NAME', 'WGS84 / UTM zone {}{}'.format(
+        epsg % 100, 'N' if epsg < 32700 else 'S'))
+    _sub(geocoding, 'HORIZONTAL_CS_CODE', 'EPSG:{}'.format(epsg))
+    for resolution in (10, 20, 60):
+        size_elem = _sub(geocoding, 'Size', resolution=resolution)
+        _sub(size_elem, 'NROWS', size * 10 // resolution)
+        _sub(size_elem, 'NCOLS', size * 10 // resolution)
+    for resolution in (10, 20, 60):
+        position = _sub(geocoding, 'Geoposition', resolution=resolution)
+        _sub(position, 'ULX', ulx)
+        _sub(position, 'ULY', uly)
+        _sub(position, 'XDIM', resolution)
+        _sub(position, 'YDIM', -resolution)
+
+    #
+    # The angle grids make up most of a real tile metadata file.
+    #
+    angles = _sub(geometric, 'Tile_Angles', metadataLevel='Standard')
+    sun = _sub(angles, 'Sun_Angles_Grid')
+    _angle_grid(_sub(sun, 'Zenith'), 40.0, 0.01, -0.02)
+    _angle_grid(_sub(sun, 'Azimuth'), 150.0, 0.05, 0.01)
+    mean_sun = _sub(angles, 'Mean_Sun_Angle')
+    _sub(mean_sun, 'ZENITH_ANGLE', '40.2', unit='deg')
+    _sub(mean_sun, 'AZIMUTH_ANGLE', '150.6', unit='deg')
+    for band_id in range(len(BANDS)):
+        viewing = _sub(angles, 'Viewing_Incidence_Angles_Grids',
+                       bandId=band_id, detectorId=1)
+        _angle_grid(_sub(viewing, 'Zenith'), 5.0, 0.1, 0.0)
+        _angle_grid(_sub(viewing, 'Azimuth'), 100.0, 0.2, 0.1)
+
+    quality = _sub(root, '{{{}}}Quality_Indicators_Info'.format(namespace),
+                   metadataLevel='Standard')
+    content = _sub(quality, 'Image_Content_QI')
+    if cloud_tag:
+        _sub(content, 'CLOUDY_PIXEL_PERCENTAGE',
+             '{:.4f}'.format(cloud_percentage))
+    _sub(content, 'DEGRADED_MSI_DATA_PERCENTAGE', 0)
+    pixel = _sub(quality, 'Pixel_Level_QI', geometry='FULL_RESOLUTION')
+    _sub(pixel, 'MASK_FILENAME', 'GRANULE/{}/QI_DATA/{}'.format(
+        names['granule'], names['cloud_mask']), type='MSK_CLOUDS')
+
+    return root
+
+
+def product_metadata(layout, psd, names, sensing, generation,
+                     absolute_orbit, images, cloud_percentage, level='L1C'):
+
+    '''
+    Returns the product metadata (MTD_MSIL1C.xml, MTD_MSIL2A.xml or
+    S2A_OPER_MTD_SAFL1C_*.xml) listing the band images of the granule.
+    '''
+
+    namespace = _namespaces(level, psd)[0]
+    etree.register_namespace('n1', namespace)
+    root = etree.Element('{{{}}}Level-{}_User_Product'.format(namespace,
+                                                               level[1:]))
+
+    general = _sub(root, '{{{}}}General_Info'.format(namespace))
+    info = _sub(general, 'Product_Info')
+    _sub(info, 'PRODUCT_START_TIME', _time(sensing))
+    _sub(info, 'PRODUCT_STOP_TIME', _time(sensing))
+    _sub(info, 'PRODUCT_URI', names['product'])
+    _sub(info, 'PROCESSING_LEVEL',
+         'Level-2Ap' if level == 'L2A' else 'Level-1C')
+    _sub(info, 'PRODUCT_TYPE', 'S2MSI2Ap' if level == 'L2A' else 'S2MSI1C')
+    _sub(info, 'PROCESSING_BASELINE', BASELINE)
+    _sub(info, 'GENERATION_TIME', _time(generation))
+    _sub(info, 'PREVIEW_IMAGE_URL', 'Not applicable')
+    _sub(info, 'PREVIEW_GEO_INFO', 'Not applicable')
+    datatake = _sub(info, 'Datatake', datatakeIdentifier='GS2A_{}_{:06d}_N{}'
+                    .format(sensing.strftime('%Y%m%dT%H%M%S'),
+                            absolute_orbit, BASELINE))
+    _sub(datatake, 'DATATAKE_TYPE', 'INS-NOBS')
+    _sub(datatake, 'SPACECRAFT_NAME', 'Sentinel-2A')
+    _sub(datatake, 'DATATAKE_SENSING_START', _time(sensing))
+    _sub(datatake, 'SENSING_ORBIT_NUMBER', RELATIVE_ORBIT)
+    _sub(datatake, 'SENSING_ORBIT_DIRECTION', 'DESCENDING')
+    options = _sub(info, 'Query_Options', completeSingleTile='true')
+    _sub(options, 'PRODUCT_FORMAT',
+         'SAFE' if layout == 'old' else 'SAFE_COMPACT')
+
+    #
+    # The old layout lists the images of each granule by id, the new one by
+    # their path in the product.
+    #
+    organisation = _sub(info, 'Product_Organisation')
+    granule_list = _sub(organisation, 'Granule_List')
+    granule = _sub(granule_list, 'Granules' if layout == 'old' else 'Granule',
+                   datastripIdentifier=names['datastrip_id'],
+                   granuleIdentifier=names['tile_id'],
+                   imageFormat='JPEG2000')
+    image_tag = 'IMAGE_ID' if layout == 'old' else 'IMAGE_FILE'
+    if level == 'L2A':
+        image_tag += '_2A'
+    for image in images:
+        _sub(granule, image_tag, image)
+
+    characteristics = _sub(general, 'Product_Image_Characteristics')
+    for name, value in (('NODATA', 0), ('SATURATED', 65535)):
+        special = _sub(characteristics, 'Special_Values')
+        _sub(special, 'SPECIAL_VALUE_TEXT', name)
+        _sub(special, 'SPECIAL_VALUE_INDEX', value)
+    _sub(characteristics, 'QUANTIFICATION_VALUE', 10000, unit='none')
+
+    quality = _sub(root, '{{{}}}Quality_Indicators_Info'.format(namespace))
+    _sub(quality, 'Cloud_Coverage_Assessment',
+         '{:.4f}'.format(cloud_percentage))
+
+    return root
+
+
+def cloud_mask(clouds, epsg, ulx, uly, pixel):
+
+    '''
+    Returns the cloud mask GML, with one OPAQUE polygon per cloud cell.
+    '''
+
+    etree.register_namespace('eop', EOP_NAMESPACE)
+    etree.register_namespace('gml', GML_NAMESPACE)
+    srs = 'urn:ogc:def:crs:EPSG::{}'.format(epsg)
+    root = etree.Element('{{{}}}Mask'.format(EOP_NAMESPACE))
+    members = _sub(root, '{{{}}}maskMembers'.format(EOP_NAMESPACE))
+
+    for i, (x0, y0, x1, y1) in enumerate(clouds):
+        feature = _sub(members, '{{{}}}MaskFeature'.format(EOP_NAMESPACE),
+                       **{'{{{}}}id'.format(GML_NAMESPACE): 'OPAQUE.{}'
+                          .format(i)})
+        _sub(feature, '{{{}}}maskType'.format(EOP_NAMESPACE), 'OPAQUE',
+             codeSpace='urn:gs2:S2PDGS:maskType')
+        extent = _sub(feature, '{{{}}}extentOf'.format(EOP_NAMESPACE))
+        polygon = _sub(extent, '{{{}}}Polygon'.format(GML_NAMESPACE),
+                       srsName=srs)
+        exterior = _sub(polygon, '{{{}}}exterior'.format(GML_NAMESPACE))
+        ring = _sub(exterior, '{{{}}}LinearRing'.format(GML_NAMESPACE))
+        corners = [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+        _sub(ring, '{{{}}}posList'.format(GML_NAMESPACE), ' '.join(
+            '{} {}'.format(ulx + x * pixel, uly - y * pixel)
+            for x, y in corners), srsDimension=2)
+
+    return root
+
+
+def _zip_product(product_folder):
+
+    '''
+    Zips a product folder into '<product>.zip' next to it, like the data
+    hub, and removes the folder. The bands are stored, as JP2s do not
+    compress further.
+    '''
+
+    parent = os.path.dirname(product_folder)
+    zip_path = os.path.splitext(product_folder)[0] + '.zip'
+
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        for dirpath, dirnames, filenames in os.walk(product_folder):
+            for dirname in dirnames:
+                path = os.path.join(dirpath, dirname)
+                z.write(path, os.path.relpath(path, parent) + '/')
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                z.write(path, os.path.relpath(path, parent),
+                        zipfile.ZIP_STORED if filename.endswith('.jp2')
+                        else zipfile.ZIP_DEFLATED)
+    shutil.rmtree(product_folder)
+
+    return zip_path
+
+
+def make_product(out_dir, layout='new', psd=None, tile='37SBA',
+                 sensing=None, size=TILE_SIZE, nodata=0.0, cloud=0.0,
+                 seed=0, zipped=False, cloud_tag=True, level='L1C'):
+
+    '''
+    Writes a synthetic product with one tile to out_dir and returns its path
+    (of the zip if zipped). size is the width of the tile in 10m pixels, a
+    multiple of 6, nodata the fraction of the tile without data and cloud the
+    percentage covered by clouds. Without cloud_tag the tile metadata has no
+    CLOUDY_PIXEL_PERCENTAGE, so it has to be read from the cloud mask.
+    Level-2A products are always in the new layout with psd-12 metadata.
+    '''
+
+    if layout not in ('old', 'new'):
+        raise ValueError('Layout must be old or new: {}'.format(layout))
+    if level not in ('L1C', 'L2A'):
+        raise ValueError('Level must be L1C or L2A: {}'.format(level))
+    if level == 'L2A':
+        layout = 'new'
+        psd = 12
+    if psd is None:
+        psd = 13 if layout == 'old' else 14
+    if psd not in PSD_NAMESPACES:
+        raise ValueError('PSD version must be one of {}: {}'.format(
+            sorted(PSD_NAMESPACES), psd))
+    if size <= 0 or size % 6:
+        raise ValueError('Tile size must be a multiple of 6: {}'.format(size))
+    if sensing is None:
+        sensing = datetime.datetime(2016 if layout == 'old' else 2017, 1, 1,
+                                    8, 23, 32)
+
+    epsg, ulx, uly = tile_geocoding(tile)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    projection = srs.ExportToWkt()
+
+    #
+    # Old products were generated days after sensing, new ones within hours.
+    #
+    generation = sensing + (datetime.timedelta(days=2) if layout == 'old'
+                            else datetime.timedelta(hours=3))
+    absolute_orbit = 2000 + int(
+        (sensing - datetime.datetime(2015, 7, 1)).days * 14.3)
+    names = product_names(layout, tile, sensing, generation, absolute_orbit,
+                          level)
+
+    product_folder = os.path.join(out_dir, names['product'])
+    granule_folder = os.path.join(product_folder, 'GRANULE',
+                                  names['granule'])
+    img_folder = os.path.join(granule_folder, 'IMG_DATA')
+    qi_folder = os.path.join(granule_folder, 'QI_DATA')
+    datastrip_folder = os.path.join(product_folder, 'DATASTRIP',
+                                    names['datastrip'])
+    for folder in (img_folder, qi_folder, datastrip_folder,
+                   os.path.join(product_folder, 'AUX_DATA')):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    #
+    # Nodata, clouds and the field are laid out on the 60m grid, so all
+    # bands agree.
+    #
+    rng = numpy.random.RandomState(seed)
+    size60 = size // 6
+    nodata60 = nodata_mask(size60, nodata)
+    clouds = cloud_cells(size60, cloud, nodata60, rng)
+    cloud_percentage = 100.0 * sum(
+        (x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in clouds) / size60 ** 2
+    field = base_field(size60, rng)
+
+    #
+    # Level-2A bands are in a folder per resolution, some at several.
+    #
+    if level == 'L2A':
+        band_files = [(band, resolution, 'R{}m/{}{}_{}m'.format(
+            resolution, names['band_prefix'], band, resolution))
+            for resolution, bands in L2A_BANDS for band in bands]
+        for resolution, bands in L2A_BANDS:
+            folder = os.path.join(img_folder, 'R{}m'.format(resolution))
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+    else:
+        band_files = [(band, resolution, names['band_prefix'] + band)
+                      for band, resolution in BANDS]
+
+    images = []
+    tci = {}
+    for band, resolution, name in band_files:
+        array = band_array(band, 60 // resolution, field, nodata60, clouds,
+                           rng)
+        write_jp2(os.path.join(img_folder, name + '.jp2'), [array], ulx, uly,
+                  resolution, projection)
+        images.append(name if layout == 'old' else
+                      'GRANULE/{}/IMG_DATA/{}'.format(names['granule'], name))
+        if level == 'L1C' and layout == 'new' and band in ('B02', 'B03',
+                                                            'B04'):
+            tci[band] = numpy.where(
+                array > 0, numpy.clip(array // 12, 1, 255), 0).astype(
+                    numpy.uint8)
+        array = None
+
+    #
+    # Level-1C products of the new layout have a true colour image.
+    #
+    if level == 'L1C' and layout == 'new':
+        name = names['band_prefix'] + 'TCI'
+        write_jp2(os.path.join(img_folder, name + '.jp2'),
+                  [tci['B04'], tci['B03'], tci['B02']], ulx, uly, 10,
+                  projection)
+        images.append('GRANULE/{}/IMG_DATA/{}'.format(names['granule'],
+                                                      name))
+        tci = None
+
+    _write_xml(cloud_mask(clouds, epsg, ulx, uly, 60),
+               os.path.join(qi_folder, names['cloud_mask']))
+    _write_xml(tile_metadata(psd, names, sensing, generation, epsg, ulx, uly,
+                             size, cloud_percentage, cloud_tag, level),
+               os.path.join(granule_folder, names['tile_metadata']))
+    _write_xml(product_metadata(layout, psd, names, sensing, generation,
+                                absolute_orbit, images, cloud_percentage,
+                                level),
+               os.path.join(product_folder, names['product_metadata']))
+
+    datastrip = etree.Element('Level-{}_DataStrip_ID'.format(level[1:]))
+    _sub(_sub(datastrip, 'General_Info'), 'DATASTRIP_ID',
+         names['datastrip_id'])
+    _write_xml(datastrip, os.path.join(datastrip_folder,
+                                       names['datastrip_metadata']))
+
+    manifest = etree.Element('XFDU', version='esa/safe/sentinel-2.0')
+    _sub(_sub(manifest, 'informationPackageMap'), 'contentUnit',
+         unitType='Product_Level-{}'.format(level[1:]),
+         textInfo=names['product'])
+    _write_xml(manifest, os.path.join(product_folder, 'manifest.safe'))
+
+    if zipped:
+        return _zip_product(product_folder)
+
+    return product_folder
+
+
+def get_args():
+
+    '''
+    Gets arguments from command line.
+    '''
+
+    prog = os.path.basename(sys.argv[0])
+
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        usage='%(prog)s [options]',
+        description='Synthetic Sentinel-2 product generator.',
+        argument_default=None,
+        epilog='Go get \'em!')
+
+    #
+    # Arguments.
+    #
+    parser.add_argument(
+        '-o', '--out_dir', dest='out_dir', action='store', type=str,
+        help='Folder to write the products to.', required=True)
+    parser.add_argument(
+        '--layout', dest='layout', action='store', choices=('old', 'new'),
+        help=('Product structure: old (S2A_OPER_PRD_MSIL1C_*.SAFE, before '
+              '06.12.16) or new (S2A_MSIL1C_*.SAFE). Default new.'),
+        default='new')
+    parser.add_argument(
+        '--psd', dest='psd', action='store', type=int,
+        choices=sorted(PSD_NAMESPACES),
+        help=('PSD version of the metadata namespaces. Default 13 for the '
+              'old layout and 14 for the new one.'),
+        default=None)
+    parser.add_argument(
+        '--level', dest='level', action='store', choices=('L1C', 'L2A'),
+        help=('Processing level. Level-2A products are in the new layout '
+              'with psd-12 metadata. Default L1C.'),
+        default='L1C')
+    parser.add_argument(
+        '-t', '--tiles', dest='tiles', action='store', type=str,
+        help='Comma separated tile ids, one product each. Default 37SBA.',
+        default='37SBA')
+    parser.add_argument(
+        '-n', '--count', dest='count', action='store', type=int,
+        help=('Products per tile, sensed 10 days apart (the revisit of '
+              'Sentinel-2A). Default 1.'),
+        default=1)
+    parser.add_argument(
+        '--start', dest='start', action='store', type=str,
+        help=('Sensing date of the first product, YYYY-MM-DD. Default '
+              '2016-01-01 (old layout) or 2017-01-01 (new layout).'),
+        default=None)
+    parser.add_argument(
+        '--size', dest='size', action='store', type=int,
+        help=('Width of the tiles in 10m pixels, a multiple of 6. Default '
+              '{} as in real tiles.').format(TILE_SIZE),
+        default=TILE_SIZE)
+    parser.add_argument(
+        '--nodata', dest='nodata', action='store', type=float,
+        help='Fraction of each tile without data (0-1). Default 0.',
+        default=0.0)
+    parser.add_argument(
+        '--cloud', dest='cloud', action='store', type=float,
+        help='Percentage of each tile covered by clouds. Default 0.',
+        default=0.0)
+    parser.add_argument(
+        '--mask_only', dest='cloud_tag', action='store_false',
+        help=('Leave CLOUDY_PIXEL_PERCENTAGE out of the tile metadata, so '
+              'it is read from the cloud mask.'))
+    parser.add_argument(
+        '--zip', dest='zipped', action='store_true',
+        help='Zip each product, as downloaded with \'--unzip n\'.')
+    parser.add_argument(
+        '--seed', dest='seed', action='store', type=int,
+        help='Seed of the first product. Default 0.', default=0)
+
+    options = parser.parse_args()
+
+    if not 0 <= options.nodata <= 1:
+        parser.error('--nodata must be between 0 and 1.')
+    if not 0 <= options.cloud <= 100:
+        parser.error('--cloud must be between 0 and 100.')
+    if options.size <= 0 or options.size % 6:
+        parser.error('--size must be a positive multiple of 6.')
+
+    return options
+
+
+if __name__ == '__main__':
+
+    options = get_args()
+
+    if options.start is not None:
+        start = datetime.datetime.strptime(options.start, '%Y-%m-%d')
+        start = start.replace(hour=8, minute=23, second=32)
+    else:
+        start = datetime.datetime(2016 if options.layout == 'old' else 2017,
+                                  1, 1, 8, 23, 32)
+
+    #
+    # The tiles of a date are sensed seconds apart along the orbit, which
+    # also keeps the names of old layout products apart.
+    #
+    seed = options.seed
+    for t, tile in enumerate(options.tiles.split(',')):
+        for i in range(options.count):
+            sensing = start + datetime.timedelta(days=10 * i, seconds=5 * t)
+            try:
+                path = make_product(
+                    options.out_dir, options.layout, options.psd,
+                    tile.strip(), sensing, options.size, options.nodata,
+                    options.cloud, seed, options.zipped, options.cloud_tag,
+                    options.level)
+            except ValueError as e:
+                print(str(e))
+                sys.exit(1)
+            print(path)
+            seed += 1
@@ -0,0 +1,341 @@
+# ------------------------------------------------------------------------------
+# Name:        Index of the Sentinel-2 tiling grid.
+# Purpose:     Compile the ESA tiling grid kml (about 100 MB, one placemark per
+#              tile) once into a small SQLite file next to it, with the center
+#              point, bounding box and outline of every tile, and an R*Tree of
+#              the bounding boxes. Tiles are then looked up by ID, by point or
+#              by bounding box with one indexed query, instead of parsing the
+#              whole kml again. Tiles across the antimeridian are kept with
+#              their eastern longitudes above 180 degrees.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import xml.etree.ElementTree as etree
+
+KML = '{http://www.opengis.net/kml/2.2}'
+
+#
+# Tiling grid kml of ESA (see README.md) and the index compiled from it.
+#
+KML_FILE = ('S2A_OPER_GIP_TILPAR_MPC__20151209T095117_V20150622T000000'
+            '_21000101T000000_B00.kml')
+INDEX_FILE = 's2_tiles.sqlite'
+
+SCHEMA = '''
+CREATE TABLE tiles (
+    tile TEXT PRIMARY KEY,
+    lon REAL,
+    lat REAL,
+    outline TEXT
+);
+'''
+
+#
+# R*Tree of the tile bounding boxes, by rowid of the tiles table. Without the
+# rtree module of SQLite the boxes are kept in a plain (unindexed) table.
+#
+RTREE = '''
+CREATE VIRTUAL TABLE boxes USING rtree (
+    id, min_lon, max_lon, min_lat, max_lat
+);
+'''
+BOXES = '''
+CREATE TABLE boxes (
+    id INTEGER PRIMARY KEY, min_lon REAL, max_lon REAL, min_lat REAL,
+    max_lat REAL
+);
+'''
+
+#
+# Placemarks written per transaction while compiling.
+#
+BATCH = 1000
+
+
+class TileGridError(Exception):
+    pass
+
+
+def _points(text):
+
+    '''
+    Returns the (lon, lat) points of a kml coordinates text
+    ('lon,lat,z lon,lat,z ...').
+    '''
+
+    points = []
+    for xyz in text.split():
+        values = xyz.split(',')
+        points.append((float(values[0]), float(values[1])))
+
+    return points
+
+
+def _unwrap(rings):
+
+    '''
+    Returns the rings of a tile with the negative longitudes moved above 180
+    degrees if the tile crosses the antimeridian.
+    '''
+
+    lons = [lon for ring in rings for lon, lat in ring]
+    if max(lons) - min(lons) <= 180:
+        return rings
+
+    return [[(lon + 360 if lon < 0 else lon, lat) for lon, lat in ring]
+            for ring in rings]
+
+
+def placemarks(kml_file):
+
+    '''
+    Yields the ID, center point and outer rings of each tile of a kml file,
+    parsing it as it is read and dropping each placemark once done.
+    '''
+
+    for event, element in etree.iterparse(kml_file):
+        if element.tag != KML + 'Placemark':
+            continue
+
+        name = element.find(KML + 'name')
+        rings = [_points(polygon.find('.//' + KML + 'coordinates').text)
+                 for polygon in element.iter(KML + 'Polygon')
+                 if polygon.find('.//' + KML + 'coordinates') is not None]
+        point = element.find('.//{0}Point/{0}coordinates'.format(KML))
+
+        if name is not None and rings:
+            if point is not None:
+                center = _points(point.text)[0]
+            else:
+                ring = rings[0][:-1] or rings[0]
+                center = (sum(lon for lon, lat in ring) / len(ring),
+                          sum(lat for lon, lat in ring) / len(ring))
+            yield name.text.strip(), center, _unwrap(rings)
+
+        element.clear()
+
+
+def compile_kml(kml_file, index_file):
+
+    '''
+    Compiles the tiling grid of a kml file into an index file, replacing it.
+    Returns the number of tiles.
+    '''
+
+    temp_file = index_file + '.tmp'
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+
+    db = sqlite3.connect(temp_file)
+    db.text_factory = str
+    db.execute('PRAGMA journal_mode=MEMORY')
+    db.executescript(SCHEMA)
+    try:
+        db.executescript(RTREE)
+    except sqlite3.OperationalError:
+        db.executescript(BOXES)
+
+    count = 0
+    for tile, center, rings in placemarks(kml_file):
+        lons = [lon for ring in rings for lon, lat in ring]
+        lats = [lat for ring in rings for lon, lat in ring]
+        cursor = db.execute(
+            'INSERT OR REPLACE INTO tiles (tile, lon, lat, outline) '
+            'VALUES (?, ?, ?, ?)',
+            (tile, center[0], center[1], json.dumps(rings)))
+        db.execute('INSERT OR REPLACE INTO boxes VALUES (?, ?, ?, ?, ?)',
+                   (cursor.lastrowid, min(lons), max(lons), min(lats),
+                    max(lats)))
+        count += 1
+        if count % BATCH == 0:
+            db.commit()
+
+    db.commit()
+    db.close()
+
+    if count == 0:
+        os.remove(temp_file)
+        raise TileGridError('No tiles in {}'.format(kml_file))
+
+    #
+    # Replace the index only once it is complete.
+    #
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    os.rename(temp_file, index_file)
+
+    return count
+
+
+def _inside(lon, lat, ring):
+
+    '''
+    Returns True if a point is inside a ring (even-odd rule).
+    '''
+
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if ((yi > lat) != (yj > lat)
+                and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi):
+            inside = not inside
+        j = i
+
+    return inside
+
+
+class TileGrid(object):
+
+    '''
+    Lookups of tiles in a compiled index file.
+    '''
+
+    def __init__(self, index_file):
+
+        if not os.path.exists(index_file):
+            raise TileGridError('No tile index {}'.format(index_file))
+
+        self.db = sqlite3.connect(index_file, check_same_thread=False)
+        self.db.text_factory = str
+
+    def center(self, tile):
+
+        '''
+        Returns the (lon, lat) center point of a tile, or None if there is
+        no such tile.
+        '''
+
+        row = self.db.execute('SELECT lon, lat FROM tiles WHERE tile = ?',
+                              (tile,)).fetchone()
+
+        return tuple(row) if row is not None else None
+
+    def outline(self, tile):
+
+        '''
+        Returns the (lon, lat) points of the first outer ring of a tile, or
+        None if there is no such tile.
+        '''
+
+        row = self.db.execute('SELECT outline FROM tiles WHERE tile = ?',
+                              (tile,)).fetchone()
+        if row is None:
+            return None
+
+        return [tuple(point) for point in json.loads(row[0])[0]]
+
+    def _boxes(self, min_lon, min_lat, max_lon, max_lat):
+
+        #
+        # Tiles across the antimeridian are indexed with longitudes above
+        # 180, so the box is looked for there as well.
+        #
+        rows = []
+        for shift in (0, 360):
+            rows.extend(self.db.execute(
+                'SELECT t.tile, t.outline FROM boxes b JOIN tiles t '
+                'ON t.rowid = b.id WHERE b.min_lon <= ? AND b.max_lon >= ? '
+                'AND b.min_lat <= ? AND b.max_lat >= ?',
+                (max_lon + shift, min_lon + shift, max_lat, min_lat)))
+
+        return rows
+
+    def at(self, lon, lat):
+
+        '''
+        Returns the IDs of the tiles containing a point, sorted.
+        '''
+
+        tiles = set()
+        for tile, outline in self._boxes(lon, lat, lon, lat):
+            for ring in json.loads(outline):
+                if _inside(lon, lat, ring) or _inside(lon + 360, lat, ring):
+                    tiles.add(tile)
+
+        return sorted(tiles)
+
+    def within(self, min_lon, min_lat, max_lon, max_lat):
+
+        '''
+        Returns the IDs of the tiles whose bounding box intersects a lon/lat
+        bounding box, sorted.
+        '''
+
+        return sorted(set(tile for tile, outline in
+                          self._boxes(min_lon, min_lat, max_lon, max_lat)))
+
+    def close(self):
+
+        self.db.close()
+
+
+def open_grid(kml_file=KML_FILE, index_file=None):
+
+    '''
+    Returns the tile grid of a kml file, compiling its index (next to it)
+    the first time or after the kml changed. The kml is not needed once the
+    index exists.
+    '''
+
+    if index_file is None:
+        index_file = os.path.join(os.path.dirname(kml_file), INDEX_FILE)
+
+    if os.path.exists(kml_file) and (
+            not os.path.exists(index_file)
+            or os.path.getmtime(index_file) < os.path.getmtime(kml_file)):
+        print('Compiling the tile index {} from the kml (once)...'.format(
+            index_file))
+        compile_kml(kml_file, index_file)
+
+    return TileGrid(index_file)
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description='Compiles the Sentinel-2 tiling grid kml into an index '
+                    'and looks up tiles in it.')
+    parser.add_argument('--kml', default=KML_FILE,
+                        help='Tiling grid kml file, default: %(default)s')
+    parser.add_argument('--index', default=None,
+                        help='Index file, default: {} next to the kml'.format(
+                            INDEX_FILE))
+    parser.add_argument('-t', '--tile', default=None,
+                        help='Print the center and outline of a tile')
+    parser.add_argument('--lat', type=float, default=None,
+                        help='Print the tiles at a point (with --lon)')
+    parser.add_argument('--lon', type=float, default=None)
+    parser.add_argument('--bbox', default=None,
+                        help='Print the tiles in a bounding box: '
+                             'lonmin,latmin,lonmax,latmax')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    options = get_args()
+    try:
+        grid = open_grid(options.kml, options.index)
+    except TileGridError as e:
+        sys.exit('{}. Download the kml, see README.md.'.format(e))
+
+    if options.tile is not None:
+        print('{} center: {}'.format(options.tile, grid.center(options.tile)))
+        print('{} outline: {}'.format(options.tile,
+                                      grid.outline(options.tile)))
+    if options.lat is not None and options.lon is not None:
+        print(' '.join(grid.at(options.lon, options.lat)))
+    if options.bbox is not None:
+        print(' '.join(grid.within(*[float(v) for v in
+                                     options.bbox.split(',')])))
@@ -0,0 +1,239 @@
+# ------------------------------------------------------------------------------
+# Name:        Conversion journal of a tile.
+# Purpose:     Make the conversion of a tile crash safe and resumable. The
+#              outputs are written to a temporary 'PROC_DATA.tmp' folder next
+#              to PROC_DATA, and only moved into PROC_DATA once all outputs
+#              are complete, so a killed run never leaves partial stacks in
+#              PROC_DATA. Other files of PROC_DATA (the SIAM outputs, the SIAM
+#              metadata, GDAL .aux.xml files) are kept. A JSON journal next to the folder records
+#              the stage of the tile, checksums of its input bands and the
+#              sizes of its outputs, so a restart can skip finished tiles
+#              without checking their files again and continue with the first
+#              unfinished one.
+#
+#              Stages: 'converting' -> 'converted' (outputs complete in the
+#              temporary folder) -> 'done' (moved to PROC_DATA), or
+#              'failed'. Before that a tile can be 'probed' or 'skipped' by
+#              the nodata probe, whose valid fraction is kept.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import json
+import zlib
+import shutil
+import zipfile
+import datetime
+
+import safezip
+
+JOURNAL_FILE = 'conversion_journal.json'
+TEMP_SUFFIX = '.tmp'
+
+#
+# Bytes read from the start and the end of an extracted band for its
+# checksum. Reading whole JP2s would double the input I/O of a tile.
+#
+CHECKSUM_BYTES = 1 << 20
+
+CONVERTING = 'converting'
+CONVERTED = 'converted'
+DONE = 'done'
+FAILED = 'failed'
+PROBED = 'probed'
+SKIPPED = 'skipped'
+
+
+def checksum(path):
+
+    '''
+    Returns the size and a CRC32 (hex) of an input band. Bands in a zip use
+    the CRC32 of the zip entry, other bands that of their first and last
+    CHECKSUM_BYTES.
+    '''
+
+    if safezip.is_vsizip(path):
+        zip_path, inner = safezip.split_vsizip(path)
+        with zipfile.ZipFile(zip_path) as z:
+            info = z.getinfo(inner)
+        return {'size': info.file_size, 'crc32': '{:08x}'.format(info.CRC)}
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        crc = zlib.crc32(f.read(CHECKSUM_BYTES))
+        if size > 2 * CHECKSUM_BYTES:
+            f.seek(-CHECKSUM_BYTES, os.SEEK_END)
+            crc = zlib.crc32(f.read(CHECKSUM_BYTES), crc)
+
+    return {'size': size, 'crc32': '{:08x}'.format(crc & 0xffffffff)}
+
+
+def folder_sizes(folder):
+
+    '''
+    Returns the sizes of the files in a folder, by file name.
+    '''
+
+    return dict((fn, os.path.getsize(os.path.join(folder, fn)))
+                for fn in os.listdir(folder))
+
+
+class TileJournal(object):
+
+    '''
+    Journal of the conversion of the tile with the given PROC_DATA folder.
+    '''
+
+    def __init__(self, PROC_DATA):
+
+        self.PROC_DATA = PROC_DATA
+        self.temp_folder = PROC_DATA + TEMP_SUFFIX
+        self.path = os.path.join(os.path.dirname(PROC_DATA), JOURNAL_FILE)
+
+        try:
+            with open(self.path) as f:
+                self.record = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.record = {}
+
+    @property
+    def stage(self):
+
+        return self.record.get('stage')
+
+    def _save(self, stage, **values):
+
+        '''
+        Writes the journal with a new stage. It is written to a temporary
+        file and renamed, so it is never left half written.
+        '''
+
+        self.record.update(values)
+        self.record['stage'] = stage
+        self.record['updated'] = datetime.datetime.now().isoformat()
+
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with open(self.path + TEMP_SUFFIX, 'w') as f:
+            json.dump(self.record, f, indent=1, sort_keys=True)
+        os.rename(self.path + TEMP_SUFFIX, self.path)
+
+    def _outputs_match(self, *folders):
+
+        '''
+        True if every recorded output has its recorded size, in the first of
+        the folders that has it. Other files in the folders do not matter.
+        '''
+
+        outputs = self.record.get('outputs')
+        if not outputs:
+            return False
+
+        for fn, size in outputs.items():
+            paths = [os.path.join(folder, fn) for folder in folders
+                     if os.path.exists(os.path.join(folder, fn))]
+            if not paths or os.path.getsize(paths[0]) != size:
+                return False
+
+        return True
+
+    def is_done(self):
+
+        '''
+        True if the tile was converted completely: the journal says so (or
+        the run stopped between the move and the journal update) and the
+        outputs in PROC_DATA still have the recorded sizes.
+        '''
+
+        if self.stage == DONE or (self.stage == CONVERTED
+                                  and not os.path.exists(self.temp_folder)):
+            return self._outputs_match(self.PROC_DATA)
+
+        return False
+
+    def can_commit(self, inputs):
+
+        '''
+        True if the outputs of an earlier run are complete in the temporary
+        folder (or already moved to PROC_DATA) and were made from the same
+        inputs, so only the move is left.
+        '''
+
+        return (self.stage == CONVERTED
+                and os.path.exists(self.temp_folder)
+                and self.record.get('inputs') == inputs
+                and self._outputs_match(self.temp_folder, self.PROC_DATA))
+
+    def begin(self, tile_id, inputs):
+
+        '''
+        Starts the conversion in an empty temporary folder and returns it.
+        '''
+
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+        os.makedirs(self.temp_folder)
+
+        self.record = dict((k, v) for k, v in self.record.items()
+                           if k == 'valid_fraction')
+        self._save(CONVERTING, tile_id=tile_id, inputs=inputs)
+
+        return self.temp_folder
+
+    def converted(self):
+
+        '''
+        Records the sizes of the complete outputs in the temporary folder.
+        '''
+
+        self._save(CONVERTED, outputs=folder_sizes(self.temp_folder))
+
+    def commit(self):
+
+        '''
+        Moves the outputs from the temporary folder into PROC_DATA, replacing
+        those of an earlier conversion and keeping the other files there.
+        '''
+
+        if not os.path.exists(self.PROC_DATA):
+            os.rename(self.temp_folder, self.PROC_DATA)
+        else:
+            for fn in os.listdir(self.temp_folder):
+                os.rename(os.path.join(self.temp_folder, fn),
+                          os.path.join(self.PROC_DATA, fn))
+            os.rmdir(self.temp_folder)
+        self._save(DONE)
+
+    @property
+    def valid_fraction(self):
+
+        return self.record.get('valid_fraction')
+
+    def probed(self, valid_fraction, skipped):
+
+        '''
+        Records the valid fraction estimated by the nodata probe and whether
+        the tile is skipped for it. Tiles already converted keep their stage.
+        '''
+
+        if skipped:
+            stage = SKIPPED
+        elif self.stage in (None, SKIPPED):
+            stage = PROBED
+        else:
+            stage = self.stage
+        self._save(stage, valid_fraction=valid_fraction)
+
+    def fail(self, error):
+
+        '''
+        Removes the temporary folder and records the error, so the tile is
+        converted again by the next run.
+        '''
+
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+        self._save(FAILED, error=error)
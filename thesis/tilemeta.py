@@ -0,0 +1,295 @@
+# ------------------------------------------------------------------------------
+# Name:        Sentinel-2 tile metadata.
+# Purpose:     Read the values the scripts need from the tile metadata xml
+#              (MTD_TL.xml or S2A_OPER_MTD_L1C_TL_*.xml) in one pass: the
+#              namespace is taken from the root tag, whatever PSD version it
+#              is, and iterparse stops once the cloud percentage of the
+#              quality indicators has been read, dropping the large angle
+#              grids on the way. If the xml has no cloud percentage, it is
+#              derived from the cloud mask in QI_DATA. The values are cached
+#              in a JSON file next to the xml (or next to the PROC_DATA
+#              folder of a zipped granule), so later stages do not parse it
+#              again.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import json
+import fnmatch
+import xml.etree.ElementTree as etree
+
+import safezip
+
+#
+# Single values read from the metadata, by tag name.
+#
+TEXT_TAGS = ('TILE_ID', 'SENSING_TIME', 'ARCHIVING_CENTRE',
+             'HORIZONTAL_CS_NAME', 'HORIZONTAL_CS_CODE')
+
+#
+# Values of the tile geocoding, per resolution.
+#
+SIZE_TAGS = ('NROWS', 'NCOLS')
+GEOPOSITION_TAGS = ('ULX', 'ULY', 'XDIM', 'YDIM')
+
+#
+# Cloud percentage of the tile, the last value read.
+#
+CLOUD_TAG = 'CLOUDY_PIXEL_PERCENTAGE'
+
+#
+# Cloud mask vectors in QI_DATA, used if the xml has no cloud percentage.
+#
+CLOUD_MASK = '*MSK_CLOUDS*B00*.gml'
+GML_NAMESPACE = 'http://www.opengis.net/gml/3.2'
+
+CACHE_SUFFIX = '.json'
+
+#
+# Version of the cached records, raised when values are added.
+#
+CACHE_VERSION = 2
+
+
+class MetadataError(Exception):
+    pass
+
+
+def find_metadata(granule_folder):
+
+    '''
+    Returns the paths of the tile metadata files in a granule folder, for the
+    old (S2A_OPER_...) and new (MTD_TL.xml) product structure.
+    '''
+
+    return [os.path.join(granule_folder, fn)
+            for fn in sorted(safezip.listdir(granule_folder))
+            if (fn.startswith('S2') or fn.startswith('MTD'))
+            and fn.endswith('.xml')]
+
+
+def _local(tag):
+
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse(metadata_path):
+
+    '''
+    Parses a tile metadata file and returns a dict with the namespace, the
+    TEXT_TAGS values, the 'Size' and 'Geoposition' of each resolution and the
+    CLOUD_TAG percentage (if present). Raises MetadataError if it cannot be
+    parsed or values are missing.
+    '''
+
+    record = {'Size': {}, 'Geoposition': {}}
+    geocoded = False
+
+    try:
+        with safezip.open_file(metadata_path) as f:
+            for event, elem in etree.iterparse(f, events=('start', 'end')):
+                tag = _local(elem.tag)
+                if event == 'start':
+                    if 'namespace' not in record:
+                        record['namespace'] = elem.tag[1:].split('}')[0]
+                    continue
+                if tag in TEXT_TAGS:
+                    record[tag] = elem.text
+                elif tag == 'Size':
+                    record['Size'][elem.get('resolution')] = dict(
+                        (t, int(elem.find(t).text)) for t in SIZE_TAGS)
+                elif tag == 'Geoposition':
+                    record['Geoposition'][elem.get('resolution')] = dict(
+                        (t, int(elem.find(t).text))
+                        for t in GEOPOSITION_TAGS)
+                elif tag == 'Tile_Geocoding':
+                    geocoded = True
+                elif tag == CLOUD_TAG:
+                    record[CLOUD_TAG] = float(elem.text)
+                    break
+
+                #
+                # Nothing after the geocoding is kept but the cloud
+                # percentage, so the angle grids are dropped as they are
+                # read.
+                #
+                if geocoded:
+                    elem.clear()
+    except (etree.ParseError, AttributeError, TypeError, ValueError) as e:
+        raise MetadataError('{} in {} could not be parsed: {}'.format(
+            type(e).__name__, metadata_path, e))
+
+    missing = [t for t in TEXT_TAGS if t != 'ARCHIVING_CENTRE'
+               and not record.get(t)]
+    if missing:
+        raise MetadataError('{} in {} is missing {}.'.format(
+            os.path.basename(metadata_path), os.path.dirname(metadata_path),
+            ', '.join(missing)))
+
+    return record
+
+
+def _ring_area(posList):
+
+    '''
+    Area of a polygon ring given as a GML posList ('x1 y1 x2 y2 ...').
+    '''
+
+    values = [float(v) for v in posList.split()]
+    xs = values[0::2]
+    ys = values[1::2]
+
+    return abs(sum(xs[i] * ys[i + 1] - xs[i + 1] * ys[i]
+                   for i in range(len(xs) - 1))) / 2.0
+
+
+def mask_cloud_percentage(granule_folder, record):
+
+    '''
+    Returns the percentage of the tile covered by the polygons of the cloud
+    mask in QI_DATA, or None if there is no mask. Opaque and cirrus clouds
+    are both counted.
+    '''
+
+    qi_folder = os.path.join(granule_folder, 'QI_DATA')
+    try:
+        masks = fnmatch.filter(safezip.listdir(qi_folder), CLOUD_MASK)
+    except OSError:
+        return None
+    if not masks or '10' not in record['Size']:
+        return None
+
+    area = 0.0
+    with safezip.open_file(os.path.join(qi_folder, masks[0])) as f:
+        for event, elem in etree.iterparse(f):
+            if _local(elem.tag) != 'Polygon':
+                continue
+            #
+            # Holes (interior rings) are subtracted.
+            #
+            for boundary in elem:
+                ring_area = sum(
+                    _ring_area(posList.text) for posList in boundary.iter(
+                        '{{{}}}posList'.format(GML_NAMESPACE)))
+                if _local(boundary.tag) == 'exterior':
+                    area += ring_area
+                else:
+                    area -= ring_area
+            elem.clear()
+
+    size = record['Size']['10']
+    geoposition = record['Geoposition']['10']
+    tile_area = float(size['NROWS'] * abs(geoposition['YDIM']) *
+                      size['NCOLS'] * abs(geoposition['XDIM']))
+
+    return min(100.0, 100.0 * area / tile_area)
+
+
+def cloud_percentage(record):
+
+    '''
+    Returns the cloud percentage of a tile record, or None if unknown.
+    '''
+
+    return record.get(CLOUD_TAG)
+
+
+def cache_path(metadata_path):
+
+    '''
+    Returns the path of the JSON cache of a metadata file.
+    '''
+
+    if safezip.is_vsizip(metadata_path):
+        granule = os.path.dirname(safezip.proc_data_folder(
+            os.path.join(os.path.dirname(metadata_path), 'IMG_DATA')))
+        return os.path.join(
+            granule, os.path.basename(metadata_path) + CACHE_SUFFIX)
+
+    return metadata_path + CACHE_SUFFIX
+
+
+def _source(metadata_path):
+
+    '''
+    mtime and size of the metadata file (of the zip for zipped products),
+    to tell whether a cached record is still valid.
+    '''
+
+    if safezip.is_vsizip(metadata_path):
+        st = os.stat(safezip.split_vsizip(metadata_path)[0])
+    else:
+        st = os.stat(metadata_path)
+
+    return [st.st_mtime, st.st_size]
+
+
+def read(metadata_path):
+
+    '''
+    Returns the record of a metadata file (see parse), from its cache if the
+    file has not changed since, otherwise parsing it and caching the record.
+    '''
+
+    json_path = cache_path(metadata_path)
+    source = _source(metadata_path)
+
+    try:
+        with open(json_path) as f:
+            record = json.load(f)
+        if (record.get('source') == source
+                and record.get('version') == CACHE_VERSION):
+            return record
+    except (IOError, OSError, ValueError):
+        pass
+
+    record = parse(metadata_path)
+    if CLOUD_TAG not in record:
+        try:
+            cloud = mask_cloud_percentage(os.path.dirname(metadata_path),
+                                          record)
+        except (etree.ParseError, AttributeError, KeyError, ValueError,
+                IOError):
+            cloud = None
+        if cloud is not None:
+            record[CLOUD_TAG] = cloud
+    record['source'] = source
+    record['version'] = CACHE_VERSION
+
+    try:
+        if not os.path.isdir(os.path.dirname(json_path)):
+            os.makedirs(os.path.dirname(json_path))
+        with open(json_path, 'w') as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+    except (IOError, OSError):
+        #
+        # Read-only product folders are parsed every time.
+        #
+        pass
+
+    return record
+
+
+def geo_ref_points(record, resolution='10'):
+
+    '''
+    Returns the corner coordinates of the tile at a resolution, as used in the
+    datacube dataset documents.
+    '''
+
+    nrows = record['Size'][resolution]['NROWS']
+    ncols = record['Size'][resolution]['NCOLS']
+    ulx = record['Geoposition'][resolution]['ULX']
+    uly = record['Geoposition'][resolution]['ULY']
+    xdim = record['Geoposition'][resolution]['XDIM']
+    ydim = record['Geoposition'][resolution]['YDIM']
+
+    return {
+        'ul': {'x': ulx, 'y': uly},
+        'ur': {'x': ulx + ncols * abs(xdim), 'y': uly},
+        'll': {'x': ulx, 'y': uly - nrows * abs(ydim)},
+        'lr': {'x': ulx + ncols * abs(xdim), 'y': uly - nrows * abs(ydim)},
+    }
@@ -0,0 +1,512 @@
+# ------------------------------------------------------------------------------
+# Name:        HTTP transfers from the data hubs.
+# Purpose:     Download files in this process with one requests session, so
+#              all transfers reuse its authenticated keep-alive connections
+#              instead of a new wget process, TLS handshake and auth challenge
+#              per file. Files are streamed to disk in CHUNK_SIZE pieces and
+#              resumed with a Range request after a dropped connection or a
+#              server error (like wget --continue --tries). Each transfer
+#              reports its progress and throughput every PROGRESS_INTERVAL
+#              seconds and when it ends. A Pool runs up to a given number of
+#              transfers at the same time on threads.
+#              Large files (e.g. Sentinel-1 SLC zips of 4-8 GB) can be fetched
+#              in SEGMENT_SIZE pieces over several connections with Range
+#              requests (fetch_segmented). The pieces are written into a
+#              '.part' file, and a '.segments' JSON file next to it records
+#              the bytes done of each piece, so an interrupted download only
+#              fetches the missing byte ranges when it is started again.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+import multiprocessing.pool
+
+import requests
+
+#
+# Bytes written per piece of a streamed response.
+#
+CHUNK_SIZE = 1 << 20
+
+#
+# Concurrent transfers per account: the hubs allow two downloads at a time.
+#
+WORKERS = 2
+
+#
+# Attempts after a dropped connection or server error, and the seconds to
+# wait for data before the connection counts as dropped.
+#
+RETRIES = 20
+TIMEOUT = 60
+
+#
+# Seconds between two progress reports of a transfer.
+#
+PROGRESS_INTERVAL = 10.0
+
+#
+# Connections per file and bytes per piece of a segmented download. Each
+# connection counts against the download limit of the account, so files
+# are fetched over one connection unless asked otherwise.
+#
+SEGMENTS = 1
+SEGMENT_SIZE = 64 << 20
+
+#
+# Suffixes of the data and segment map of an unfinished segmented download.
+#
+PART_SUFFIX = '.part'
+MAP_SUFFIX = '.segments'
+
+#
+# Seconds between two saves of the segment map while pieces are written.
+#
+MAP_INTERVAL = 5.0
+
+_print_lock = threading.Lock()
+
+
+def report(message):
+
+    '''
+    Prints a line, without mixing it with the lines of other transfers.
+    '''
+
+    with _print_lock:
+        print(message)
+        sys.stdout.flush()
+
+
+def _mb(size):
+
+    return size / 1e6
+
+
+def open_session(account, passwd, workers=WORKERS):
+
+    '''
+    Returns a session sending the credentials with every request (no auth
+    challenge), which keeps enough connections alive for the transfers of a
+    pool of the given size.
+    '''
+
+    session = requests.Session()
+    session.auth = (account, passwd)
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 10))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+class Progress(object):
+
+    '''
+    Bytes received by a transfer, reported every PROGRESS_INTERVAL seconds.
+    '''
+
+    def __init__(self, name, total=None, done=0):
+
+        self.name = name
+        self.total = total
+        self.done = done
+        self.received = 0
+        self.start = time.time()
+        self.reported = self.start
+        self.lock = threading.Lock()
+
+    def add(self, size):
+
+        with self.lock:
+            self.done += size
+            self.received += size
+            now = time.time()
+            if now - self.reported < PROGRESS_INTERVAL:
+                return
+            self.reported = now
+        report('{}: {}'.format(self.name, self.status()))
+
+    def rate(self):
+
+        '''
+        Throughput of this transfer so far in MB/s.
+        '''
+
+        seconds = time.time() - self.start
+
+        return _mb(self.received) / seconds if seconds > 0 else 0.0
+
+    def status(self):
+
+        if self.total:
+            done = '{:.0f}% of {:.1f} MB'.format(
+                100.0 * self.done / self.total, _mb(self.total))
+        else:
+            done = '{:.1f} MB'.format(_mb(self.done))
+
+        return '{} at {:.2f} MB/s'.format(done, self.rate())
+
+
+def retry(name, error, attempt, retries):
+
+    '''
+    Raises the error if it should not be retried (a client error, e.g. wrong
+    credentials or a missing file, but not too many connections) or the
+    attempts are used up, or waits before the next attempt.
+    '''
+
+    response = getattr(error, 'response', None)
+    if (attempt > retries or (response is not None
+                              and response.status_code < 500
+                              and response.status_code != 429)):
+        raise error
+
+    report('{}: {}, retrying ({} of {})'.format(name, error, attempt,
+                                                  retries))
+    time.sleep(min(attempt, 10))
+
+
+def fetch(session, url, path, name=None, resume=True, retries=RETRIES,
+          timeout=TIMEOUT):
+
+    '''
+    Downloads url to path and returns the bytes received and the seconds
+    taken. With resume an existing file is continued from its end (a
+    partial download of an earlier run), otherwise it is replaced. Raises
+    requests.exceptions.RequestException or IOError if it fails.
+    '''
+
+    name = name or os.path.basename(path)
+    progress = None
+    attempt = 0
+
+    while True:
+
+        done = os.path.getsize(path) if os.path.exists(path) else 0
+        if not resume and progress is None:
+            done = 0
+        headers = {'Range': 'bytes={}-'.format(done)} if done else {}
+
+        try:
+            response = session.get(url, headers=headers, stream=True,
+                                   timeout=timeout)
+            try:
+                #
+                # The file is already complete.
+                #
+                if done and response.status_code == 416:
+                    break
+
+                response.raise_for_status()
+
+                #
+                # A server ignoring the range sends the whole file again.
+                #
+                if response.status_code != 206:
+                    done = 0
+                length = response.headers.get('Content-Length')
+                total = done + int(length) if length is not None else None
+
+                if progress is None:
+                    progress = Progress(name, total, done)
+                    report('Downloading {} ({})'.format(
+                        name, '{:.1f} MB'.format(_mb(total))
+                        if total is not None else 'size unknown'))
+                else:
+                    progress.total = total
+                    progress.done = done
+
+                with open(path, 'ab' if done else 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        progress.add(len(chunk))
+            finally:
+                response.close()
+
+            if total is not None and os.path.getsize(path) < total:
+                raise IOError('Connection closed after {} of {} bytes'.format(
+                    os.path.getsize(path), total))
+
+            break
+
+        except (requests.exceptions.RequestException, IOError) as e:
+            attempt += 1
+            retry(name, e, attempt, retries)
+
+    if progress is None:
+        progress = Progress(name)
+    report('Downloaded {}: {:.1f} MB in {:.1f} s ({:.2f} MB/s)'.format(
+        name, _mb(progress.received), time.time() - progress.start,
+        progress.rate()))
+
+    return progress.received, time.time() - progress.start
+
+
+class Pool(object):
+
+    '''
+    Runs up to a number of transfers (or functions making them) at the same
+    time on threads, e.g. the products of a query, which then share the
+    connections of one session. Each function is submitted with the name of
+    what it downloads, e.g. a product, under which its error is returned.
+    '''
+
+    def __init__(self, workers=WORKERS):
+
+        self.pool = multiprocessing.pool.ThreadPool(workers)
+        self.results = []
+
+    def submit(self, name, function, *args):
+
+        self.results.append((name, self.pool.apply_async(function, args)))
+
+    def wait(self):
+
+        '''
+        Waits for all submitted functions. Returns the errors of those that
+        failed as (name, error) pairs, in the order they were submitted.
+        '''
+
+        results = self.results
+        self.results = []
+        errors = []
+        for name, result in results:
+            try:
+                result.get()
+            except Exception as e:
+                errors.append((name, e))
+
+        return errors
+
+    def close(self):
+
+        self.pool.close()
+        self.pool.join()
+
+
+def _file_size(session, url, timeout):
+
+    '''
+    Returns the size of the file at url if the server answers Range
+    requests, otherwise None.
+    '''
+
+    response = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                           timeout=timeout)
+    try:
+        response.raise_for_status()
+        match = re.match(r'bytes 0-0/(\d+)',
+                         response.headers.get('Content-Range', ''))
+    finally:
+        response.close()
+
+    if response.status_code != 206 or match is None:
+        return None
+
+    return int(match.group(1))
+
+
+class SegmentMap(object):
+
+    '''
+    Pieces of a segmented download, each [start, end, bytes done], saved
+    to a JSON file next to the '.part' file.
+    '''
+
+    def __init__(self, path, url, size):
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.saved = 0
+
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (IOError, OSError, ValueError):
+            record = {}
+
+        #
+        # A map of another file (or another size of it) is started again.
+        #
+        if record.get('url') == url and record.get('size') == size:
+            self.segments = record['segments']
+        else:
+            self.segments = [[start, min(start + SEGMENT_SIZE, size) - 1, 0]
+                             for start in range(0, size, SEGMENT_SIZE)]
+        self.url = url
+        self.size = size
+
+    def done(self):
+
+        return sum(segment[2] for segment in self.segments)
+
+    def missing(self):
+
+        '''
+        Returns the indices of the pieces not complete yet.
+        '''
+
+        return [i for i, (start, end, done) in enumerate(self.segments)
+                if start + done <= end]
+
+    def reset(self):
+
+        for segment in self.segments:
+            segment[2] = 0
+
+    def save(self):
+
+        '''
+        Writes the map to a temporary file and renames it, so it is never
+        left half written.
+        '''
+
+        with self.lock:
+            self.saved = time.time()
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'url': self.url, 'size': self.size,
+                           'segments': self.segments}, f)
+            os.rename(self.path + '.tmp', self.path)
+
+    def update(self, index, done):
+
+        '''
+        Records the bytes done of a piece, after they were flushed to the
+        '.part' file, and saves the map every MAP_INTERVAL seconds.
+        '''
+
+        with self.lock:
+            self.segments[index][2] = done
+            if time.time() - self.saved < MAP_INTERVAL:
+                return
+        self.save()
+
+
+def _fetch_segment(session, url, part_path, segments, index, progress,
+                   retries, timeout):
+
+    '''
+    Downloads the missing bytes of one piece into the '.part' file.
+    '''
+
+    attempt = 0
+
+    while True:
+
+        start, end, done = segments.segments[index]
+        if start + done > end:
+            return
+
+        try:
+            response = session.get(
+                url, headers={'Range': 'bytes={}-{}'.format(start + done,
+                                                             end)},
+                stream=True, timeout=timeout)
+            try:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IOError('Range request of bytes {}-{} answered '
+                                  'with status {}'.format(
+                                      start + done, end,
+                                      response.status_code))
+
+                with open(part_path, 'r+b') as f:
+                    f.seek(start + done)
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        chunk = chunk[:end + 1 - start - done]
+                        f.write(chunk)
+                        f.flush()
+                        done += len(chunk)
+                        progress.add(len(chunk))
+                        segments.update(index, done)
+                        if start + done > end:
+                            break
+            finally:
+                response.close()
+
+            if start + done <= end:
+                raise IOError('Connection closed after {} of {} bytes of '
+                              'piece {}'.format(done, end + 1 - start, index))
+
+            return
+
+        except (requests.exceptions.RequestException, IOError) as e:
+            attempt += 1
+            retry('{} piece {}'.format(progress.name, index), e, attempt,
+                   retries)
+
+
+def fetch_segmented(session, url, path, segments=SEGMENTS, name=None,
+                    retries=RETRIES, timeout=TIMEOUT):
+
+    '''
+    Downloads url to path over up to segments connections at the same time,
+    in SEGMENT_SIZE pieces, and returns the bytes received and the seconds
+    taken. The missing pieces of an earlier, interrupted run are continued.
+    Files of one piece, and servers without Range requests, are fetched
+    with fetch. Raises requests.exceptions.RequestException or IOError if it
+    fails.
+    '''
+
+    name = name or os.path.basename(path)
+    if segments <= 1:
+        return fetch(session, url, path, name, retries=retries,
+                     timeout=timeout)
+
+    attempt = 0
+    while True:
+        try:
+            size = _file_size(session, url, timeout)
+            break
+        except (requests.exceptions.RequestException, IOError) as e:
+            attempt += 1
+            retry(name, e, attempt, retries)
+
+    if size is None or size <= SEGMENT_SIZE:
+        return fetch(session, url, path, name, retries=retries,
+                     timeout=timeout)
+
+    part_path = path + PART_SUFFIX
+    segment_map = SegmentMap(path + MAP_SUFFIX, url, size)
+    if not os.path.exists(part_path) or segment_map.done() == 0:
+        segment_map.reset()
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+
+    missing = segment_map.missing()
+    progress = Progress(name, size, segment_map.done())
+    report('Downloading {} ({:.1f} MB, {} of {} pieces missing, {} '
+           'connections)'.format(name, _mb(size), len(missing),
+                                 len(segment_map.segments), segments))
+
+    pool = multiprocessing.pool.ThreadPool(min(segments, len(missing) or 1))
+    try:
+        results = [pool.apply_async(_fetch_segment, (
+            session, url, part_path, segment_map, index, progress, retries,
+            timeout)) for index in missing]
+        for result in results:
+            result.get()
+    finally:
+        pool.close()
+        pool.join()
+        segment_map.save()
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(part_path, path)
+    os.remove(segment_map.path)
+
+    report('Downloaded {}: {:.1f} MB in {:.1f} s ({:.2f} MB/s)'.format(
+        name, _mb(progress.received), time.time() - progress.start,
+        progress.rate()))
+
+    return progress.received, time.time() - progress.start
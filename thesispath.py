@@ -0,0 +1,19 @@
+# ------------------------------------------------------------------------------
+# Name:        Path of the shared modules.
+# Purpose:     Make the modules in 'thesis' (conversion kernels, resampling,
+#              band statistics, data inventory, metrics, profiling) importable
+#              by the scripts in this folder, which import this module before
+#              them, instead of each changing sys.path itself.
+#
+# ------------------------------------------------------------------------------
+
+#! /usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+import os
+import sys
+
+THESIS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thesis')
+
+if THESIS_DIR not in sys.path:
+    sys.path.insert(0, THESIS_DIR)